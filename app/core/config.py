@@ -1,3 +1,4 @@
+from typing import Any, Dict
 from pydantic import ConfigDict, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,6 +14,10 @@ class Settings(BaseSettings):
     appsecret: str
     verify_token: str
     template_id: str
+    templates: Dict[str, Dict[str, Any]] = {}  # 额外的模板消息定义 (JSON)
+    accounts: Dict[str, Dict[str, Any]] = {}  # 额外的公众号配置 (JSON)
+    accounts_file: str = ""  # 额外的公众号配置文件 (JSON), 修改后自动重新加载
+    wechat_rate_limit: float = 0  # 每个公众号每秒调用微信接口的上限, 0 表示不限制
 
     # MySQL 配置
     mysql_host: str = "localhost"
@@ -25,6 +30,36 @@ class Settings(BaseSettings):
     mysql_pool_minsize: int = 1
     mysql_pool_maxsize: int = 10
 
+    # MySQL 只读副本配置, 多个副本用逗号分隔, 如 10.0.0.2:3306,10.0.0.3:3306, 为空表示不使用
+    mysql_replicas: str = ""
+    mysql_replica_sticky_seconds: float = 5.0  # 用户写入后该时间内的读取仍使用主库
+    mysql_replica_check_interval: float = 5.0  # 副本健康检查间隔(秒)
+    mysql_replica_acquire_timeout: float = 1.0  # 获取副本连接的超时(秒), 超时后读取主库
+
+    # 微信回调配置
+    callback_reply_budget: float = 4.0  # 回调处理超过该时间(秒)时先回复 success, 结果通过客服消息发送, 0 表示关闭
+
+    # 准入控制配置
+    admission_max_inflight: int = 200  # 每个进程同时处理的 /send 请求上限(只统计 /send)
+    admission_max_pool_wait: float = 0.5  # MySQL 连接平均等待时间(秒)超过该值时拒绝 /send
+    admission_max_delivery_queue: int = 1000  # 发送队列超过该长度时拒绝 /send
+    admission_reserved_connections: int = 2  # 为微信回调保留的 MySQL 连接数量
+    admission_retry_after: int = 1  # 拒绝请求时 Retry-After 的秒数
+
+    # 启动预热配置
+    pool_warmup_size: int = 5  # MySQL/MongoDB/Redis 启动时预先建立的连接数
+    wechat_http_pool_size: int = 100  # 微信接口 HTTP 连接池大小
+    delivery_concurrency: int = 50  # 同时调用微信发送接口的协程数量, 按优先级调度
+
+    # 发送模式: local 为各节点独立发送; stream 为通过 Redis Streams 按接收者分区,
+    # 节点间分摊分区并保证同一接收者的消息按顺序发送
+    delivery_mode: str = "local"
+    stream_partitions: int = 64  # 分区数量, 所有节点必须相同, 应远大于节点数量
+    stream_concurrency: int = 100  # 每个节点同时发送的分区消息数量
+    stream_lease_seconds: int = 15  # 分区租约时间(秒), 节点宕机后经过该时间由其他节点接管
+    stream_batch_size: int = 10  # 每次从每个流读取的消息数量
+    stream_max_retries: int = 3  # 调用接口异常时的重试次数
+
     # MongoDB 配置
     mongo_host: str = "localhost"
     mongo_port: int = 27017
@@ -32,14 +67,67 @@ class Settings(BaseSettings):
     mongo_password: str
     mongo_database: str
     mongo_collection: str
+    mongo_job_collection: str = "broadcast_jobs"
+    mongo_sync_collection: str = "sync_jobs"
+    mongo_stats_collection: str = "send_stats"  # 按小时汇总的发送统计
+
+    # 广播任务配置
+    broadcast_batch_size: int = 100  # 每批发送的成员数量, 每批结束后记录检查点
+    broadcast_concurrency: int = 2  # 每个进程同时执行的任务数量
+    broadcast_heartbeat_timeout: int = 60  # 心跳超时(秒)后任务可被其他进程接管
 
     # Redis 配置
     redis_host: str = "localhost"
     redis_port: int = 6379
     redis_db: int = 0
+    redis_client_cache: bool = True  # 热点键客户端缓存
+    redis_client_cache_size: int = 10000  # 客户端缓存最大键数量
+
+    # 消息合并配置
+    coalesce_window: int = 0  # 默认合并窗口(秒), 0 表示不合并
+    coalesce_max_window: int = 600  # 发送者可配置的最大合并窗口(秒)
+    coalesce_retry_delay: int = 30  # 合并消息发送异常或进程中断后重试的间隔(秒)
+
+    # 用户注册配置
+    user_flush_interval: float = 0.2  # 用户缓冲区批量写入间隔(秒)
+    user_flush_batch_size: int = 500  # 每条 INSERT 语句写入的最大行数
+    user_known_cache_size: int = 100000  # 进程内缓存的已注册用户数量
+
+    sync_chunk_size: int = 1000  # 关注者同步时每次与 MySQL 比对的 openid 数量
+    sync_seen_ttl: int = 7 * 24 * 3600  # 关注者同步中已处理 openid 集合的保留时间(秒)
+
+    # 群组成员批量添加/移除时每条语句包含的最大行数
+    group_member_chunk_size: int = 500
+
+    # 按标签群发配置
+    mass_send_threshold: int = 1000  # 文本消息群组成员达到该数量时按标签群发, 0 表示关闭
+
+    # 消息页面配置
+    page_cache_size: int = 1000  # 进程内缓存的消息页面数量
+    page_max_age: int = 31536000  # 消息页面 Cache-Control max-age(秒)
+
+    # 消息检索配置 (需要 Redis 加载 RediSearch 模块, 如 redis-stack)
+    search_enabled: bool = True
+    search_index: str = "idx:messages"
+    search_language: str = "chinese"  # 分词语言
+    search_backfill_batch: int = 1000  # 回填时每批读取的消息数量
+
+    # 消息归档配置
+    archive_dir: str = "data/archive"  # 归档文件目录, 多台主机部署时需使用共享存储
+    archive_after_days: int = 0  # 超过该天数的消息移入归档, 0 表示不归档
+    archive_batch_size: int = 1000  # 每批归档的消息数量
+    archive_interval: int = 3600  # 归档任务执行间隔(秒)
+
+    # 发送统计配置
+    stats_retention_hours: int = 48  # Redis 中保留的小时分桶数量
+    stats_rollup_interval: int = 600  # 汇总到 MongoDB 的间隔(秒)
+
+    # 无法送达的用户(未关注、拒收等)在该时间内不再发送(秒), 重新关注时立即恢复
+    undeliverable_ttl: int = 7 * 24 * 3600
 
     # 日志配置
     log_level: str = "INFO"
+    log_format: str = "color"  # color: 彩色文本, json: 每行一条 JSON
 
     # 使用新的配置模式替换旧版 Config 类
     model_config = SettingsConfigDict(
@@ -55,6 +143,12 @@ class Settings(BaseSettings):
             raise ValueError("Invalid log level")
         return v
 
+    @field_validator("log_format")
+    def validate_log_format(cls, v):
+        if v not in ["color", "json"]:
+            raise ValueError("Invalid log format")
+        return v
+
 
 # 单例配置对象
 settings = Settings()
@@ -1,18 +1,60 @@
+import asyncio
 from aiomysql import Connection
-from fastapi import Depends, Request
+from fastapi import Depends, HTTPException, Request
+from app.core.config import settings
 from app.database.mysql import MySQL
 from app.database.mongo import MongoDB
 from app.database.redis import Redis
 from app.services.mp import MPUtils
+from app.services.coalesce import Coalescer
+from app.services.page import MessagePages
+from app.services.broadcast import BroadcastRunner
+from app.services.tag import TagSync
+from app.services.user import UserRegistry
+from app.services.follower import FollowerSync
+from app.services.delivery import DeliveryScheduler
+from app.services.status import StatusHub
+from app.services.admission import AdmissionController
+from app.services.search import MessageSearch
+from app.services.archive import MessageArchive
+from app.services.mute import GroupMute
+from app.services.undeliverable import UndeliverableCache
+from app.services.stats import SendStats
+from app.services.stream import StreamDelivery
 from typing import AsyncGenerator
 
 
-async def get_mysql() -> AsyncGenerator[Connection, None]:
+async def get_mysql(request: Request) -> AsyncGenerator[Connection, None]:
     conn = await MySQL.get_connection()
     try:
         yield conn
     finally:
-        await MySQL.release_connection(conn)
+        # 请求转入后台继续处理时, 由后台任务结束后释放连接
+        task = getattr(request.state, "background_task", None)
+        if task is not None and not task.done():
+            task.add_done_callback(
+                lambda _: asyncio.ensure_future(MySQL.release_connection(conn))
+            )
+        else:
+            await MySQL.release_connection(conn)
+
+
+async def get_api_mysql(request: Request) -> AsyncGenerator[Connection, None]:
+    """接口请求使用的MySQL连接, 不占用为微信回调保留的连接, 等待超时返回 503"""
+    admission: AdmissionController = request.app.state.admission
+    try:
+        conn = await admission.get_api_connection()
+    except asyncio.TimeoutError:
+        admission.shed += 1
+        raise HTTPException(
+            status_code=503,
+            detail="database pool saturated",
+            headers={"Retry-After": str(settings.admission_retry_after)},
+        )
+    try:
+        yield conn
+    finally:
+        await admission.release_api_connection(conn)
 
 
 async def get_mongodb(request: Request) -> MongoDB:
@@ -29,3 +71,78 @@ async def get_redis(request: Request) -> Redis:
 async def get_mp(request: Request) -> MPUtils:
     """获取微信公众号操作实例的依赖项"""
     return request.app.state.mp_instance
+
+
+async def get_coalescer(request: Request) -> Coalescer:
+    """获取消息合并实例的依赖项"""
+    return request.app.state.coalescer
+
+
+async def get_pages(request: Request) -> MessagePages:
+    """获取消息页面缓存的依赖项"""
+    return request.app.state.pages
+
+
+async def get_broadcast(request: Request) -> BroadcastRunner:
+    """获取广播任务实例的依赖项"""
+    return request.app.state.broadcast
+
+
+async def get_tag_sync(request: Request) -> TagSync:
+    """获取群组标签同步实例的依赖项"""
+    return request.app.state.tag_sync
+
+
+async def get_users(request: Request) -> UserRegistry:
+    """获取用户注册实例的依赖项"""
+    return request.app.state.users
+
+
+async def get_follower_sync(request: Request) -> FollowerSync:
+    """获取关注者同步实例的依赖项"""
+    return request.app.state.follower_sync
+
+
+async def get_delivery(request: Request) -> DeliveryScheduler:
+    """获取发送调度实例的依赖项"""
+    return request.app.state.delivery
+
+
+async def get_status(request: Request) -> StatusHub:
+    """获取消息状态推送实例的依赖项"""
+    return request.app.state.status
+
+
+async def get_admission(request: Request) -> AdmissionController:
+    """获取准入控制实例的依赖项"""
+    return request.app.state.admission
+
+
+async def get_search(request: Request) -> MessageSearch:
+    """获取消息检索实例的依赖项"""
+    return request.app.state.search
+
+
+async def get_archive(request: Request) -> MessageArchive:
+    """获取消息归档实例的依赖项"""
+    return request.app.state.archive
+
+
+async def get_mute(request: Request) -> GroupMute:
+    """获取群组免打扰实例的依赖项"""
+    return request.app.state.mute
+
+
+async def get_undeliverable(request: Request) -> UndeliverableCache:
+    """获取无法送达用户缓存的依赖项"""
+    return request.app.state.undeliverable
+
+
+async def get_send_stats(request: Request) -> SendStats:
+    """获取发送统计实例的依赖项"""
+    return request.app.state.send_stats
+
+
+async def get_streams(request: Request) -> StreamDelivery:
+    """获取分区有序发送实例的依赖项"""
+    return request.app.state.streams
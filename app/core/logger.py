@@ -1,8 +1,62 @@
 import os
+import sys
+import json
+import queue
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from app.core.config import settings
 
 
+class ColoredFormatter(logging.Formatter):
+    """自定义的格式化器，为不同级别的日志设置不同的颜色"""
+
+    FORMATS = {  # 定义不同级别对应的格式
+        logging.DEBUG: "[%(asctime)s]\033[36m[%(levelname)s]\033[92m[%(funcName)s]\033[0m %(message)s",
+        logging.INFO: "[%(asctime)s]\033[94m[%(levelname)s]\033[92m[%(funcName)s]\033[0m %(message)s",
+        logging.WARNING: "[%(asctime)s]\033[33m[%(levelname)s]\033[92m[%(funcName)s]\033[0m %(message)s",
+        logging.ERROR: "[%(asctime)s]\033[31m[%(levelname)s]\033[92m[%(funcName)s]\033[0m %(message)s",
+        logging.CRITICAL: "\033[45m\033[93m[%(asctime)s][%(levelname)s][%(funcName)s]\033[0m %(message)s",
+    }
+
+    def __init__(self):
+        super().__init__()
+        # 每个级别的格式化器只创建一次
+        self._formatters = {
+            level: logging.Formatter(fmt, datefmt="%Y-%m-%d %H:%M:%S")
+            for level, fmt in self.FORMATS.items()
+        }
+
+    def format(self, record):  # 获取对应级别的格式，如果没有则使用 DEBUG 的格式
+        formatter = self._formatters.get(record.levelno, self._formatters[logging.DEBUG])
+        return formatter.format(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """JSON 格式化器，每条日志输出为一行 JSON，便于日志采集"""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class _QueueHandler(QueueHandler):
+    """只在调用线程合并消息参数, 格式化和异常堆栈交给后台线程处理"""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 class LOG:
     DEBUG = logging.DEBUG
     INFO = logging.INFO
@@ -19,6 +73,10 @@ class LOG:
         "CRITICAL": logging.CRITICAL,
     }
 
+    # 所有日志器共用一个队列, 由后台线程负责格式化和写入控制台
+    _queue_handler = None
+    _listener = None
+
     def __init__(self, name: str = None, level: int = None):
         """
         初始化日志器
@@ -27,30 +85,9 @@ class LOG:
             name (str, optional): 日志器名称，默认为当前文件名
             level (int, optional): 日志级别，如果为None则从环境变量获取
         """
-
-        class ColoredFormatter(logging.Formatter):
-            """自定义的格式化器，为不同级别的日志设置不同的颜色"""
-
-            FORMATS = {  # 定义不同级别对应的格式
-                logging.DEBUG: "[%(asctime)s]\033[36m[%(levelname)s]\033[92m[%(funcName)s]\033[0m %(message)s",
-                logging.INFO: "[%(asctime)s]\033[94m[%(levelname)s]\033[92m[%(funcName)s]\033[0m %(message)s",
-                logging.WARNING: "[%(asctime)s]\033[33m[%(levelname)s]\033[92m[%(funcName)s]\033[0m %(message)s",
-                logging.ERROR: "[%(asctime)s]\033[31m[%(levelname)s]\033[92m[%(funcName)s]\033[0m %(message)s",
-                logging.CRITICAL: "\033[45m\033[93m[%(asctime)s][%(levelname)s][%(funcName)s]\033[0m %(message)s",
-            }
-
-            def format(self, record):  # 获取对应级别的格式，如果没有则使用 DEBUG 的格式
-                log_fmt = self.FORMATS.get(record.levelno, self.FORMATS[logging.DEBUG])
-                formatter = logging.Formatter(log_fmt, datefmt="%Y-%m-%d %H:%M:%S")
-                return formatter.format(record)
-
-        # 如果没有提供name参数，使用当前文件名(不含扩展名)
+        # 如果没有提供name参数，使用调用者的文件名(不含扩展名)
         if name is None:
-            import inspect
-
-            # 获取调用者的文件名
-            caller_frame = inspect.stack()[1]
-            caller_file = caller_frame.filename
+            caller_file = sys._getframe(1).f_code.co_filename
             name = os.path.splitext(os.path.basename(caller_file))[0]
 
         # 从环境变量获取日志级别，如果没有，则使用参数或默认值
@@ -66,9 +103,30 @@ class LOG:
 
         # 避免重复添加handler
         if not self.logger.handlers:
-            # 创建控制台处理器 (带颜色)
+            self.logger.addHandler(self._get_queue_handler())
+
+    @classmethod
+    def _get_queue_handler(cls) -> QueueHandler:
+        """创建共享的队列处理器, 事件循环中记录日志只需入队"""
+        if cls._queue_handler is None:
             console_handler = logging.StreamHandler()
-            console_handler.setFormatter(ColoredFormatter())
+            if settings.log_format == "json":
+                console_handler.setFormatter(JSONFormatter())
+            else:
+                console_handler.setFormatter(ColoredFormatter())
+
+            log_queue = queue.SimpleQueue()
+            cls._queue_handler = _QueueHandler(log_queue)
+            cls._listener = QueueListener(
+                log_queue, console_handler, respect_handler_level=True
+            )
+            cls._listener.start()
+            atexit.register(cls.shutdown)
+        return cls._queue_handler
 
-            # 添加处理器
-            self.logger.addHandler(console_handler)
+    @classmethod
+    def shutdown(cls):
+        """停止后台写入线程, 写完队列中剩余的日志"""
+        if cls._listener:
+            cls._listener.stop()
+            cls._listener = None
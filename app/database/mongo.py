@@ -1,5 +1,7 @@
-from typing import Union, Dict, Any, List, Optional
+import asyncio
+from typing import Union, Dict, Any, List, Optional, AsyncIterator
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
 from app.core.config import settings
 
@@ -71,6 +73,24 @@ class MongoDB:
         """关闭数据库连接"""
         self._client.close()
 
+    async def warm_up(self, size: int) -> None:
+        """
+        预热连接池, 并发执行 ping 以提前建立连接
+        Args:
+            size: 预热的连接数量
+        """
+        await asyncio.gather(
+            *[self._client.admin.command("ping") for _ in range(size)]
+        )
+
+    async def ping(self) -> bool:
+        """检查连接是否可用"""
+        try:
+            await self._client.admin.command("ping")
+            return True
+        except Exception:
+            return False
+
     async def insert(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         异步插入单个文档
@@ -111,6 +131,32 @@ class MongoDB:
             "upserted_id": str(result.upserted_id) if result.upserted_id else None,
         }
 
+    async def find_one_and_update(
+        self,
+        query: Dict[str, Any],
+        data: Dict[str, Any],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        异步原子地查询并更新单个文档
+        Args:
+            query: 查询条件
+            data: 更新操作, 如 {"$set": {...}, "$inc": {...}}
+        Returns:
+            更新后的文档或None
+        """
+        if "_id" in query and isinstance(query["_id"], str):
+            try:
+                query["_id"] = ObjectId(query["_id"])
+            except:
+                return None
+
+        result = await self._collection.find_one_and_update(
+            query, data, return_document=ReturnDocument.AFTER
+        )
+        if result:
+            result["_id"] = str(result["_id"])
+        return result
+
     async def find_one(self, query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
         异步查询单个文档
@@ -139,6 +185,7 @@ class MongoDB:
         query: Dict[str, Any],
         limit: int = 100,
         skip: int = 0,
+        sort: List[tuple] = None,
     ) -> List[Dict[str, Any]]:
         """
         异步查询多个文档
@@ -146,17 +193,42 @@ class MongoDB:
             query: 查询条件
             limit: 返回文档最大数量
             skip: 跳过的文档数量
+            sort: 排序条件, 如 [("_id", 1)]
         Returns:
             文档列表
         """
-        cursor = self._collection.find(query).skip(skip).limit(limit)
-        results = []
+        return [
+            doc async for doc in self.iter_find(query, sort=sort, skip=skip, limit=limit)
+        ]
 
+    async def iter_find(
+        self,
+        query: Dict[str, Any],
+        projection: Dict[str, Any] = None,
+        sort: List[tuple] = None,
+        skip: int = 0,
+        limit: int = 0,
+        batch_size: int = 1000,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        异步迭代查询结果, 每次只从服务端取回一批文档, 内存占用与结果总数无关
+        Args:
+            query: 查询条件
+            projection: 返回字段, 如 {"html": 0}
+            sort: 排序条件, 如 [("_id", 1)]
+            skip: 跳过的文档数量
+            limit: 返回文档最大数量, 0 表示不限制
+            batch_size: 每批取回的文档数量
+        Yields:
+            文档
+        """
+        cursor = self._collection.find(query, projection, batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        cursor = cursor.skip(skip).limit(limit)
         async for doc in cursor:
             doc["_id"] = str(doc["_id"])  # 转换ObjectId为字符串
-            results.append(doc)
-
-        return results
+            yield doc
 
     async def delete_one(self, query: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -204,9 +276,27 @@ class MongoDB:
         Returns:
             聚合结果列表
         """
-        results = []
-        async for doc in self._collection.aggregate(pipeline):
+        return [doc async for doc in self.iter_aggregate(pipeline)]
+
+    async def iter_aggregate(
+        self,
+        pipeline: List[Dict[str, Any]],
+        batch_size: int = 1000,
+        allow_disk_use: bool = False,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        异步迭代聚合结果, 每次只从服务端取回一批文档
+        Args:
+            pipeline: 聚合管道
+            batch_size: 每批取回的文档数量
+            allow_disk_use: 允许服务端在内存不足时使用临时文件
+        Yields:
+            文档
+        """
+        cursor = self._collection.aggregate(
+            pipeline, batchSize=batch_size, allowDiskUse=allow_disk_use
+        )
+        async for doc in cursor:
             if "_id" in doc and isinstance(doc["_id"], ObjectId):
                 doc["_id"] = str(doc["_id"])
-            results.append(doc)
-        return results
+            yield doc
@@ -1,10 +1,34 @@
+import time
+import asyncio
 import aiomysql
+from collections import OrderedDict
+from typing import Optional
 from app.core.logger import LOG
 from app.core.config import settings
 
 
 class MySQL:
+    """
+    MySQL 数据访问
+    写操作使用主库连接池; 配置 mysql_replicas 后, 通过 read() 调用的只读查询
+    轮流使用健康的副本。用户写入后 mysql_replica_sticky_seconds 内的读取仍使用主库,
+    保证能读到自己的写入(按进程记录)。副本不可用时读取回退到主库,
+    后台健康检查恢复后重新使用副本。
+    """
+
     _pool = None
+    _waiting = 0  # 正在等待连接的请求数量
+    _wait_ewma = 0.0  # 获取连接等待时间的指数移动平均(秒)
+
+    _replicas = []  # [地址, 连接池或 None]
+    _replica_healthy = []
+    _replica_next = 0
+    _replica_task = None
+    _sticky = OrderedDict()  # openid -> 读取主库的截止时间
+    STICKY_CACHE_SIZE = 100000
+
+    # 未指定公众号时用户和群组成员所属的公众号
+    DEFAULT_ACCOUNT = "default"
 
     # 数据库表名
     USERS_TABLE = "users"
@@ -28,12 +52,174 @@ class MySQL:
                 autocommit=True,
                 pool_recycle=3600,  # 连接1小时自动重建
             )
+            await cls._create_replicas()
         return cls._pool
 
+    @classmethod
+    async def _create_replica_pool(cls, address: str):
+        host, _, port = address.partition(":")
+        return await aiomysql.create_pool(
+            host=host,
+            port=int(port or 3306),
+            user=settings.mysql_user,
+            password=settings.mysql_password,
+            db=settings.mysql_database,
+            minsize=settings.mysql_pool_minsize,
+            maxsize=settings.mysql_pool_maxsize,
+            autocommit=True,
+            pool_recycle=3600,
+        )
+
+    @classmethod
+    async def _create_replicas(cls):
+        """创建副本连接池, 连接失败的副本标记为不可用, 由健康检查重试"""
+        addresses = [a.strip() for a in settings.mysql_replicas.split(",") if a.strip()]
+        if not addresses or cls._replicas:
+            return
+        cls._replicas = [[address, None] for address in addresses]
+        cls._replica_healthy = [False] * len(addresses)
+        for i, address in enumerate(addresses):
+            try:
+                cls._replicas[i][1] = await cls._create_replica_pool(address)
+                cls._replica_healthy[i] = True
+            except Exception as err:
+                cls.logger.warning(f"MySQL 副本 {address} 连接失败, 读取使用主库: {err}")
+        cls._replica_task = asyncio.create_task(cls._check_replicas())
+
+    @classmethod
+    async def _check_replicas(cls):
+        """定期检查副本是否可用"""
+        while True:
+            await asyncio.sleep(settings.mysql_replica_check_interval)
+            for i, replica in enumerate(cls._replicas):
+                address, pool = replica
+                try:
+                    if pool is None:
+                        pool = replica[1] = await cls._create_replica_pool(address)
+                    conn = await asyncio.wait_for(
+                        pool.acquire(), timeout=settings.mysql_replica_check_interval
+                    )
+                    try:
+                        await conn.ping(reconnect=False)
+                    finally:
+                        await pool.release(conn)
+                    healthy = True
+                except asyncio.CancelledError:
+                    raise
+                except Exception as err:
+                    healthy = False
+                    if cls._replica_healthy[i]:
+                        cls.logger.warning(f"MySQL 副本 {address} 不可用, 读取使用主库: {err}")
+                if healthy and not cls._replica_healthy[i]:
+                    cls.logger.info(f"MySQL 副本 {address} 已恢复")
+                cls._replica_healthy[i] = healthy
+
+    @classmethod
+    def mark_write(cls, openid: str):
+        """记录用户的写入, 之后一段时间内该用户的读取使用主库"""
+        if not cls._replicas or not openid:
+            return
+        cls._sticky[openid] = time.monotonic() + settings.mysql_replica_sticky_seconds
+        cls._sticky.move_to_end(openid)
+        while len(cls._sticky) > cls.STICKY_CACHE_SIZE:
+            cls._sticky.popitem(last=False)
+
+    @classmethod
+    def _pick_replica(cls, openid: str = None) -> int:
+        """选择用于读取的副本, 返回 -1 表示使用主库"""
+        if not cls._replicas:
+            return -1
+        if openid:
+            until = cls._sticky.get(openid)
+            if until is not None:
+                if until > time.monotonic():
+                    return -1
+                del cls._sticky[openid]
+        for _ in range(len(cls._replicas)):
+            i = cls._replica_next % len(cls._replicas)
+            cls._replica_next += 1
+            if cls._replica_healthy[i]:
+                return i
+        return -1
+
+    @classmethod
+    async def read(cls, method, *args, sticky: str = None, primary=None, **kwargs):
+        """
+        在副本上执行只读查询, 副本不可用或连接出错时回退到主库
+        Args:
+            method: 查询方法, 如 MySQL.get_info, 以连接作为第一个参数调用,
+                    需支持 raise_errors 参数, 副本上出错时抛出异常以便回退到主库
+            sticky (str): 发起读取的用户openid, 写入后短时间内读取主库
+            primary: 调用方已持有的主库连接, 回退时使用, 为空时从主库连接池获取
+            其余参数传给查询方法
+        Example:
+            info = await MySQL.read(MySQL.get_info, openid=openid, sticky=openid)
+        """
+        await cls.create_pool()
+        i = cls._pick_replica(sticky)
+        if i >= 0:
+            pool = cls._replicas[i][1]
+            try:
+                replica_conn = await asyncio.wait_for(
+                    pool.acquire(), timeout=settings.mysql_replica_acquire_timeout
+                )
+            except asyncio.TimeoutError:
+                # 副本连接池已满, 本次读取使用主库
+                cls.logger.warning(f"MySQL 副本 {cls._replicas[i][0]} 获取连接超时, 回退到主库")
+            except (aiomysql.OperationalError, aiomysql.InterfaceError, OSError) as err:
+                cls._replica_healthy[i] = False
+                cls.logger.warning(f"MySQL 副本 {cls._replicas[i][0]} 连接失败, 回退到主库: {err}")
+            else:
+                try:
+                    return await method(replica_conn, *args, raise_errors=True, **kwargs)
+                except (aiomysql.OperationalError, aiomysql.InterfaceError, OSError) as err:
+                    cls._replica_healthy[i] = False
+                    cls.logger.warning(
+                        f"MySQL 副本 {cls._replicas[i][0]} 读取失败, 回退到主库: {err}"
+                    )
+                finally:
+                    await pool.release(replica_conn)
+        if primary is not None:
+            return await method(primary, *args, **kwargs)
+        conn = await cls.get_connection()
+        try:
+            return await method(conn, *args, **kwargs)
+        finally:
+            await cls.release_connection(conn)
+
+    @classmethod
+    def replica_stats(cls) -> list:
+        """副本状态"""
+        return [
+            {
+                "address": address,
+                "healthy": cls._replica_healthy[i],
+                "size": pool.size if pool else 0,
+                "free": pool.freesize if pool else 0,
+            }
+            for i, (address, pool) in enumerate(cls._replicas)
+        ]
+
     @classmethod
     async def get_connection(cls):
         pool = await cls.create_pool()
-        return await pool.acquire()
+        started = time.perf_counter()
+        cls._waiting += 1
+        try:
+            return await pool.acquire()
+        finally:
+            cls._waiting -= 1
+            cls._wait_ewma = 0.8 * cls._wait_ewma + 0.2 * (time.perf_counter() - started)
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        """连接池状态, 用于准入控制"""
+        return {
+            "size": cls._pool.size if cls._pool else 0,
+            "free": cls._pool.freesize if cls._pool else 0,
+            "waiting": cls._waiting,
+            "wait_ewma": round(cls._wait_ewma, 4),
+        }
 
     @classmethod
     async def release_connection(cls, conn):
@@ -41,8 +227,50 @@ class MySQL:
         if conn:
             await pool.release(conn)
 
+    @classmethod
+    async def warm_up(cls, size: int):
+        """
+        预热连接池, 提前建立 size 个连接, 避免部署后首批请求承担建连开销
+        Args:
+            size (int): 预热的连接数量, 不超过连接池上限
+        """
+        pool = await cls.create_pool()
+        size = min(size, settings.mysql_pool_maxsize)
+        conns = await asyncio.gather(*[pool.acquire() for _ in range(size)])
+        try:
+            for conn in conns:
+                await conn.ping(reconnect=False)
+        finally:
+            for conn in conns:
+                await pool.release(conn)
+        cls.logger.info(f"MySQL连接池预热完成: {len(conns)} 个连接")
+
+    @classmethod
+    async def ping(cls, timeout: float = 2.0) -> bool:
+        """检查连接池是否可用, 连接池耗尽或数据库不可用时在 timeout 秒内返回 False"""
+        if not cls._pool:
+            return False
+        conn = None
+        try:
+            conn = await asyncio.wait_for(cls._pool.acquire(), timeout=timeout)
+            await asyncio.wait_for(conn.ping(reconnect=False), timeout=timeout)
+            return True
+        except Exception:
+            return False
+        finally:
+            if conn is not None:
+                await cls._pool.release(conn)
+
     @classmethod
     async def close_pool(cls):
+        if cls._replica_task:
+            cls._replica_task.cancel()
+            cls._replica_task = None
+        for _, pool in cls._replicas:
+            if pool:
+                pool.close()
+                await pool.wait_closed()
+        cls._replicas, cls._replica_healthy = [], []
         if cls._pool:
             cls._pool.close()
             await cls._pool.wait_closed()
@@ -108,6 +336,7 @@ class MySQL:
         conn: aiomysql.Connection,
         openid: str,
         nickname: str,
+        account: str = DEFAULT_ACCOUNT,
     ) -> bool:
         """
         创建用户 (异步版本)
@@ -115,6 +344,7 @@ class MySQL:
             conn (aiomysql.Connection): aiomysql 数据库连接对象
             openid (str): 用户的openid
             nickname (str): 用户昵称
+            account (str): 所属公众号
         Returns:
             bool: 是否成功创建用户
         Raises:
@@ -123,8 +353,8 @@ class MySQL:
         try:
             async with conn.cursor() as cursor:
                 await cursor.execute(
-                    f"INSERT INTO {cls.USERS_TABLE} (openid, nickname) VALUES (%s, %s);",
-                    (openid, nickname),
+                    f"INSERT INTO {cls.USERS_TABLE} (account, openid, nickname) VALUES (%s, %s, %s);",
+                    (account, openid, nickname),
                 )
             return True
         except aiomysql.IntegrityError as err:
@@ -139,12 +369,130 @@ class MySQL:
             cls.logger.error(f"创建用户时出错: {err}")
             return False
 
+    @classmethod
+    async def upsert_users(
+        cls,
+        conn: aiomysql.Connection,
+        rows: list,
+    ) -> int:
+        """
+        批量创建或更新用户 (异步版本)
+        使用单条多行 INSERT ... ON DUPLICATE KEY UPDATE, nickname 为 None 时保留原值
+        Args:
+            conn (aiomysql.Connection): aiomysql 数据库连接对象
+            rows (list): (account, openid, nickname, subscribed) 元组列表
+        Returns:
+            int: 受影响的行数
+        Raises:
+            aiomysql.Error: 数据库操作错误
+        """
+        if not rows:
+            return 0
+        placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+        params = [value for row in rows for value in row]
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                f"INSERT INTO {cls.USERS_TABLE} (account, openid, nickname, subscribed) VALUES {placeholders} "
+                f"ON DUPLICATE KEY UPDATE nickname = COALESCE(VALUES(nickname), nickname), "
+                f"subscribed = VALUES(subscribed);",
+                params,
+            )
+            return cursor.rowcount
+
+    @classmethod
+    async def get_subscription(
+        cls,
+        conn: aiomysql.Connection,
+        openids: list,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> dict:
+        """
+        批量查询用户的关注状态 (异步版本)
+        Args:
+            conn (aiomysql.Connection): aiomysql 数据库连接对象
+            openids (list): 用户openid列表
+            account (str): 所属公众号
+        Returns:
+            dict: openid -> subscribed, 不存在的用户不包含在结果中
+        """
+        if not openids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(openids))
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                f"SELECT openid, subscribed FROM {cls.USERS_TABLE} "
+                f"WHERE account = %s AND openid IN ({placeholders});",
+                [account, *openids],
+            )
+            return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    @classmethod
+    async def get_subscribed_page(
+        cls,
+        conn: aiomysql.Connection,
+        after: str = "",
+        limit: int = 1000,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> list:
+        """
+        按 openid 顺序分页获取已关注的用户 (异步版本)
+        Args:
+            conn (aiomysql.Connection): aiomysql 数据库连接对象
+            after (str): 游标, 返回 openid 大于该值的用户
+            limit (int): 每页数量
+            account (str): 所属公众号
+        Returns:
+            list: 用户openid列表
+        """
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                f"SELECT openid FROM {cls.USERS_TABLE} "
+                f"WHERE account = %s AND subscribed = 1 AND openid > %s ORDER BY openid LIMIT %s;",
+                (account, after, limit),
+            )
+            return [row[0] for row in await cursor.fetchall()]
+
+    @classmethod
+    async def set_unsubscribed(
+        cls,
+        conn: aiomysql.Connection,
+        openids: list,
+        before: float = None,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> int:
+        """
+        批量标记用户为已取消关注 (异步版本)
+        Args:
+            conn (aiomysql.Connection): aiomysql 数据库连接对象
+            openids (list): 用户openid列表
+            before (float): unix 时间戳, 只标记在此之前更新过的用户
+            account (str): 所属公众号
+        Returns:
+            int: 受影响的行数
+        """
+        if not openids:
+            return 0
+        placeholders = ", ".join(["%s"] * len(openids))
+        sql = (
+            f"UPDATE {cls.USERS_TABLE} SET subscribed = 0 "
+            f"WHERE account = %s AND openid IN ({placeholders})"
+        )
+        params = [account, *openids]
+        if before is not None:
+            # updated_at 精确到秒, 向下取整避免同一秒内关注的用户被标记
+            sql += " AND updated_at < FROM_UNIXTIME(%s)"
+            params.append(int(before))
+        async with conn.cursor() as cursor:
+            await cursor.execute(sql + ";", params)
+            return cursor.rowcount
+
     @classmethod
     async def create_group(
         cls,
         conn: aiomysql.Connection,
         openid: str,
         name: str,
+        account: str = DEFAULT_ACCOUNT,
     ) -> bool:
         """
         创建群组 (异步版本)
@@ -153,6 +501,7 @@ class MySQL:
             conn (aiomysql.Connection): aiomysql 数据库连接对象
             openid (str): 群主的openid
             name (str): 群组名称
+            account (str): 所属公众号, 只有该公众号的用户可以加入
         Returns:
             bool: 是否成功创建群组
         Raises:
@@ -161,9 +510,10 @@ class MySQL:
         try:
             async with conn.cursor() as cursor:
                 await cursor.execute(
-                    f"INSERT INTO {cls.GROUPS_TABLE} (name, owner_openid) VALUES (%s, %s);",
-                    (name, openid),
+                    f"INSERT INTO {cls.GROUPS_TABLE} (account, name, owner_openid) VALUES (%s, %s, %s);",
+                    (account, name, openid),
                 )
+            cls.mark_write(openid)
             return True
         except aiomysql.IntegrityError as err:
             if err.args[0] == 1452:  # 外键约束错误
@@ -183,6 +533,7 @@ class MySQL:
         conn: aiomysql.Connection,
         openid: str,
         group_name: str,
+        account: str = DEFAULT_ACCOUNT,
     ) -> bool:
         """
         删除群组 (异步版本)
@@ -191,6 +542,7 @@ class MySQL:
             conn (aiomysql.Connection): aiomysql 数据库连接对象
             openid (str): 用户的openid
             group_name (str): 群组名称
+            account (str): 群组所属公众号
         Returns:
             bool: 是否成功删除群组
         Raises:
@@ -200,21 +552,23 @@ class MySQL:
             async with conn.cursor() as cursor:
                 # 检查用户是否是群主
                 await cursor.execute(
-                    f"SELECT group_id FROM {cls.GROUPS_TABLE} WHERE name = %s AND owner_openid = %s;",
-                    (group_name, openid),
+                    f"SELECT group_id FROM {cls.GROUPS_TABLE} "
+                    f"WHERE account = %s AND name = %s AND owner_openid = %s;",
+                    (account, group_name, openid),
                 )
-                if not cursor.fetchone():
+                if not await cursor.fetchone():
                     return False
                 # 删除用户-群组关系
                 await cursor.execute(
-                    f"DELETE FROM {cls.USER_GROUPS_TABLE} WHERE group_name = %s;",
-                    (group_name,),
+                    f"DELETE FROM {cls.USER_GROUPS_TABLE} WHERE account = %s AND group_name = %s;",
+                    (account, group_name),
                 )
                 # 然后删除群组
                 await cursor.execute(
-                    f"DELETE FROM {cls.GROUPS_TABLE} WHERE name = %s;",
-                    (group_name,),
+                    f"DELETE FROM {cls.GROUPS_TABLE} WHERE account = %s AND name = %s;",
+                    (account, group_name),
                 )
+            cls.mark_write(openid)
             return True
         except aiomysql.Error as err:
             cls.logger.error(f"删除群组时出错: {err}")
@@ -226,6 +580,7 @@ class MySQL:
         conn: aiomysql.Connection,
         openid: str,
         group_name: str,
+        account: str = DEFAULT_ACCOUNT,
     ) -> bool:
         """
         通过群组名称加入群组 (异步版本)
@@ -234,6 +589,7 @@ class MySQL:
             conn (aiomysql.Connection): aiomysql 数据库连接对象
             openid (str): 用户的openid
             group_name (str): 群组名称
+            account (str): 用户所属公众号, 群组属于其他公众号时加入失败
         Returns:
             bool: 是否成功加入群组
         Raises:
@@ -243,10 +599,12 @@ class MySQL:
             async with conn.cursor() as cursor:
                 # 加入群组
                 await cursor.execute(
-                    f"INSERT INTO {cls.USER_GROUPS_TABLE} (openid, group_name) VALUES (%s, %s);",
-                    (openid, group_name),
+                    f"INSERT INTO {cls.USER_GROUPS_TABLE} (account, openid, group_name) "
+                    f"VALUES (%s, %s, %s);",
+                    (account, openid, group_name),
                 )
             cls.logger.info(f"用户 {openid} 成功加入群组 {group_name}")
+            cls.mark_write(openid)
             return True
         except aiomysql.IntegrityError as err:
             if err.args[0] == 1062:  # 主键重复错误
@@ -266,6 +624,7 @@ class MySQL:
         conn: aiomysql.Connection,
         openid: str,
         group_name: str,
+        account: str = DEFAULT_ACCOUNT,
     ) -> bool:
         """
         通过群组名称离开群组 (异步版本)
@@ -274,6 +633,7 @@ class MySQL:
             conn (aiomysql.Connection): aiomysql 数据库连接对象
             openid (str): 用户的openid
             group_name (str): 群组名称
+            account (str): 用户所属公众号
         Returns:
             bool: 是否成功离开群组
         Raises:
@@ -283,10 +643,12 @@ class MySQL:
             async with conn.cursor() as cursor:
                 # 离开群组
                 await cursor.execute(
-                    f"DELETE FROM {cls.USER_GROUPS_TABLE} WHERE openid = %s AND group_name = %s;",
-                    (openid, group_name),
+                    f"DELETE FROM {cls.USER_GROUPS_TABLE} "
+                    f"WHERE account = %s AND openid = %s AND group_name = %s;",
+                    (account, openid, group_name),
                 )
             cls.logger.info(f"用户 {openid} 成功离开群组 {group_name}")
+            cls.mark_write(openid)
             return True
         except aiomysql.IntegrityError as err:
             if err.args[0] == 1452:  # 外键约束错误
@@ -302,6 +664,8 @@ class MySQL:
         cls,
         conn: aiomysql.Connection,
         openid: str,
+        raise_errors: bool = False,
+        account: str = DEFAULT_ACCOUNT,
     ) -> dict:
         """
         获取用户信息 (异步版本)
@@ -309,6 +673,8 @@ class MySQL:
         Args:
             conn (aiomysql.Connection): aiomysql 数据库连接对象
             openid (str): 用户的openid
+            raise_errors (bool): 出错时抛出异常, 在副本上读取时用于回退到主库
+            account (str): 用户所属公众号
         Returns:
             dict: 用户加入群组的信息
         Raises:
@@ -318,17 +684,19 @@ class MySQL:
         try:
             async with conn.cursor() as cursor:
                 await cursor.execute(
-                    f"SELECT group_name FROM {cls.USER_GROUPS_TABLE} WHERE openid = %s;",
-                    (openid,),
+                    f"SELECT group_name FROM {cls.USER_GROUPS_TABLE} WHERE account = %s AND openid = %s;",
+                    (account, openid),
                 )
                 result["member"] = [row[0] for row in await cursor.fetchall()]
                 await cursor.execute(
-                    f"SELECT name FROM {cls.GROUPS_TABLE} WHERE owner_openid = %s;",
-                    (openid,),
+                    f"SELECT name FROM {cls.GROUPS_TABLE} WHERE account = %s AND owner_openid = %s;",
+                    (account, openid),
                 )
                 result["owner"] = [row[0] for row in await cursor.fetchall()]
         except aiomysql.Error as err:
             cls.logger.error(f"获取用户信息时出错: {err}")
+            if raise_errors:
+                raise
         return result
 
     @classmethod
@@ -337,6 +705,8 @@ class MySQL:
         conn: aiomysql.Connection,
         openid: str,
         group_name: str,
+        raise_errors: bool = False,
+        account: str = DEFAULT_ACCOUNT,
     ) -> list:
         """
         获取群组成员 (异步版本)
@@ -344,6 +714,8 @@ class MySQL:
             conn (aiomysql.Connection): aiomysql 数据库连接对象
             openid (str): 用户的openid
             group_name (str): 群组名称
+            raise_errors (bool): 出错时抛出异常, 在副本上读取时用于回退到主库
+            account (str): 群组所属公众号
         Returns:
             list: 群组成员列表
         Raises:
@@ -353,14 +725,15 @@ class MySQL:
         try:
             async with conn.cursor() as cursor:
                 await cursor.execute(
-                    f"SELECT * FROM {cls.GROUPS_TABLE} WHERE owner_openid = %s AND name = %s;",
-                    (openid, group_name),
+                    f"SELECT * FROM {cls.GROUPS_TABLE} "
+                    f"WHERE account = %s AND owner_openid = %s AND name = %s;",
+                    (account, openid, group_name),
                 )
                 if not await cursor.fetchone():
                     return result
                 await cursor.execute(
-                    f"SELECT * FROM {cls.USER_GROUPS_TABLE} WHERE group_name = %s;",
-                    (group_name,),
+                    f"SELECT openid FROM {cls.USER_GROUPS_TABLE} WHERE account = %s AND group_name = %s;",
+                    (account, group_name),
                 )
                 for i in await cursor.fetchall():
                     result.append(i[0])
@@ -369,9 +742,195 @@ class MySQL:
                 cls.logger.warning(f"用户 {openid} 或群组 {group_name} 不存在")
             else:
                 cls.logger.error(f"获取群组成员时出错: {err}")
+            if raise_errors:
+                raise
+        except aiomysql.Error as err:
+            cls.logger.error(f"获取群组成员时出错: {err}")
+            if raise_errors:
+                raise
+        cls.logger.debug(f"群组 {group_name} 成员: {result}")
+        return result
+
+    @classmethod
+    async def get_group_member_page(
+        cls,
+        conn: aiomysql.Connection,
+        openid: str,
+        group_name: str,
+        after: str = "",
+        limit: int = 100,
+        raise_errors: bool = True,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> list:
+        """
+        按 openid 顺序分页获取群组成员 (异步版本)
+        用于广播任务的游标遍历, 只有群主可以获取
+        Args:
+            conn (aiomysql.Connection): aiomysql 数据库连接对象
+            openid (str): 群主的openid
+            group_name (str): 群组名称
+            after (str): 游标, 返回 openid 大于该值的成员
+            limit (int): 每页数量
+            raise_errors (bool): 出错时抛出异常, 默认抛出以便广播任务重试
+            account (str): 群组所属公众号
+        Returns:
+            list: 群组成员openid列表
+        """
+        result = []
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"SELECT 1 FROM {cls.GROUPS_TABLE} "
+                    f"WHERE account = %s AND owner_openid = %s AND name = %s;",
+                    (account, openid, group_name),
+                )
+                if not await cursor.fetchone():
+                    return result
+                await cursor.execute(
+                    f"SELECT openid FROM {cls.USER_GROUPS_TABLE} "
+                    f"WHERE account = %s AND group_name = %s AND openid > %s ORDER BY openid LIMIT %s;",
+                    (account, group_name, after, limit),
+                )
+                result = [row[0] for row in await cursor.fetchall()]
         except aiomysql.Error as err:
             cls.logger.error(f"获取群组成员时出错: {err}")
-        print(result)
+            if raise_errors:
+                raise
+        return result
+
+    @classmethod
+    async def count_group_member(
+        cls,
+        conn: aiomysql.Connection,
+        group_name: str,
+        raise_errors: bool = False,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> int:
+        """
+        获取群组成员数量 (异步版本)
+        Args:
+            conn (aiomysql.Connection): aiomysql 数据库连接对象
+            group_name (str): 群组名称
+            raise_errors (bool): 出错时抛出异常, 在副本上读取时用于回退到主库
+            account (str): 群组所属公众号
+        Returns:
+            int: 群组成员数量
+        """
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"SELECT COUNT(*) FROM {cls.USER_GROUPS_TABLE} WHERE account = %s AND group_name = %s;",
+                    (account, group_name),
+                )
+                return (await cursor.fetchone())[0]
+        except aiomysql.Error as err:
+            cls.logger.error(f"获取群组成员数量时出错: {err}")
+            if raise_errors:
+                raise
+            return 0
+
+    @classmethod
+    async def update_group_members(
+        cls,
+        conn: aiomysql.Connection,
+        openid: str,
+        group_name: str,
+        add: list = (),
+        remove: list = (),
+        chunk_size: int = 500,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> Optional[dict]:
+        """
+        批量添加/移除群组成员 (异步版本)
+        对应公众号命令 /group add 和 /group remove, 只有群主可以操作。
+        按 chunk_size 分批执行多行 INSERT IGNORE 和 DELETE ... IN (...),
+        全部语句在同一个事务中提交, 失败时整体回滚。
+        已在群组中或未在该公众号注册的用户计入 skipped。
+        Args:
+            conn (aiomysql.Connection): aiomysql 数据库连接对象
+            openid (str): 群主的openid
+            group_name (str): 群组名称
+            add (list): 要添加的成员openid列表
+            remove (list): 要移除的成员openid列表
+            chunk_size (int): 每条语句包含的最大行数
+            account (str): 群组所属公众号
+        Returns:
+            dict: added/skipped/removed 数量, 群组不存在或不是群主时返回 None
+        Raises:
+            aiomysql.Error: 数据库操作错误
+        """
+        add = list(dict.fromkeys(add))
+        remove = list(dict.fromkeys(remove))
+        result = {"added": 0, "skipped": 0, "removed": 0}
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                f"SELECT 1 FROM {cls.GROUPS_TABLE} "
+                f"WHERE account = %s AND owner_openid = %s AND name = %s;",
+                (account, openid, group_name),
+            )
+            if not await cursor.fetchone():
+                return None
+            await conn.begin()
+            try:
+                for i in range(0, len(add), chunk_size):
+                    chunk = add[i : i + chunk_size]
+                    placeholders = ", ".join(["(%s, %s, %s)"] * len(chunk))
+                    # 重复的成员和外键不存在的用户被忽略
+                    await cursor.execute(
+                        f"INSERT IGNORE INTO {cls.USER_GROUPS_TABLE} (account, openid, group_name) "
+                        f"VALUES {placeholders};",
+                        [value for member in chunk for value in (account, member, group_name)],
+                    )
+                    result["added"] += cursor.rowcount
+                for i in range(0, len(remove), chunk_size):
+                    chunk = remove[i : i + chunk_size]
+                    placeholders = ", ".join(["%s"] * len(chunk))
+                    await cursor.execute(
+                        f"DELETE FROM {cls.USER_GROUPS_TABLE} "
+                        f"WHERE account = %s AND group_name = %s AND openid IN ({placeholders});",
+                        [account, group_name, *chunk],
+                    )
+                    result["removed"] += cursor.rowcount
+                await conn.commit()
+            except BaseException:
+                await conn.rollback()
+                raise
+        result["skipped"] = len(add) - result["added"]
+        cls.mark_write(openid)
+        cls.logger.info(f"群组 {group_name} 批量更新成员: {result}")
+        return result
+
+    @classmethod
+    async def filter_group_members(
+        cls,
+        conn: aiomysql.Connection,
+        group_name: str,
+        openids: list,
+        chunk_size: int = 500,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> list:
+        """
+        返回 openids 中属于群组成员的部分 (异步版本)
+        Args:
+            conn (aiomysql.Connection): aiomysql 数据库连接对象
+            group_name (str): 群组名称
+            openids (list): 待检查的openid列表
+            chunk_size (int): 每条语句包含的最大 openid 数量
+            account (str): 群组所属公众号
+        Returns:
+            list: 群组成员openid列表
+        """
+        result = []
+        async with conn.cursor() as cursor:
+            for i in range(0, len(openids), chunk_size):
+                chunk = openids[i : i + chunk_size]
+                placeholders = ", ".join(["%s"] * len(chunk))
+                await cursor.execute(
+                    f"SELECT openid FROM {cls.USER_GROUPS_TABLE} "
+                    f"WHERE account = %s AND group_name = %s AND openid IN ({placeholders});",
+                    [account, group_name, *chunk],
+                )
+                result.extend(row[0] for row in await cursor.fetchall())
         return result
 
 
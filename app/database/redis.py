@@ -1,11 +1,79 @@
+import asyncio
 from redis.asyncio import Redis as AsyncRedis
+from redis.asyncio.connection import Connection
+from app.core.logger import LOG
 from app.core.config import settings
 
 
 class Redis:
+    """
+    Redis异步客户端 (全局唯一连接池)
+    对读多写少的热点键提供客户端缓存: 独立的 RESP3 连接开启
+    CLIENT TRACKING BCAST, 键被修改时服务端推送失效消息, 本地缓存随之删除。
+    """
+
     _instance = None
     _initialized = False
 
+    logger = LOG().logger
+
+    # 开启客户端缓存的键前缀
+    CACHED_PREFIXES = ("access_token", "coalesce:window:")
+
+    # 预注册的 Lua 脚本, 用于需要原子执行的多步操作
+    SCRIPTS = {
+        # 将待发送列表 KEYS[1] 移入处理中列表 KEYS[2] 并返回处理中的全部元素,
+        # 同时在有序集合 KEYS[3] 中将 ARGV[1] 的重试时间设为 ARGV[2], 进程中断时可重新认领
+        "claim_pending": """
+            local items = redis.call('LRANGE', KEYS[1], 0, -1)
+            if #items > 0 then
+                redis.call('RPUSH', KEYS[2], unpack(items))
+                redis.call('DEL', KEYS[1])
+            end
+            redis.call('ZADD', KEYS[3], ARGV[2], ARGV[1])
+            return redis.call('LRANGE', KEYS[2], 0, -1)
+        """,
+        # 发送完成后删除处理中列表 KEYS[2], 待发送列表 KEYS[1] 为空时取消 ARGV[1] 的重试
+        "ack_pending": """
+            redis.call('DEL', KEYS[2])
+            if redis.call('LLEN', KEYS[1]) == 0 then
+                redis.call('ZREM', KEYS[3], ARGV[1])
+            end
+            return 1
+        """,
+        # 认领有序集合中已到期的成员: ARGV[1] 为当前时间, ARGV[2] 为最大数量
+        "claim_due": """
+            local due = redis.call('ZRANGEBYSCORE', KEYS[1], 0, ARGV[1], 'LIMIT', 0, ARGV[2])
+            if #due > 0 then
+                redis.call('ZREM', KEYS[1], unpack(due))
+            end
+            return due
+        """,
+        # 待同步集合 KEYS[3]/KEYS[4] 都为空时, 将 ARGV[1] 从 KEYS[1] 移到 KEYS[2]
+        "mark_synced": """
+            if redis.call('SCARD', KEYS[3]) + redis.call('SCARD', KEYS[4]) > 0 then
+                return 0
+            end
+            redis.call('SREM', KEYS[1], ARGV[1])
+            redis.call('SADD', KEYS[2], ARGV[1])
+            return 1
+        """,
+        # 租约 KEYS[1] 仍由 ARGV[1] 持有时续期 ARGV[2] 秒
+        "renew_lease": """
+            if redis.call('GET', KEYS[1]) == ARGV[1] then
+                return redis.call('EXPIRE', KEYS[1], ARGV[2])
+            end
+            return 0
+        """,
+        # 租约 KEYS[1] 仍由 ARGV[1] 持有时释放
+        "release_lease": """
+            if redis.call('GET', KEYS[1]) == ARGV[1] then
+                return redis.call('DEL', KEYS[1])
+            end
+            return 0
+        """,
+    }
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
@@ -34,25 +102,126 @@ class Redis:
             max_connections=100,
         )
 
+        # 注册 Lua 脚本 (首次执行时通过 EVALSHA 调用, 缺失时自动加载)
+        self._scripts = {
+            name: self._redis.register_script(lua) for name, lua in self.SCRIPTS.items()
+        }
+
+        # 客户端缓存
+        self._cache = {}
+        self._invalidations = 0  # 失效计数, 用于丢弃读取期间已失效的结果
+        self._tracking = False
+        self._tracking_task = None
+        if settings.redis_client_cache:
+            self._tracking_task = asyncio.create_task(self._track_invalidations())
+
         Redis._initialized = True
 
     async def close(self):
         """关闭连接池 (需在 FastAPI 关闭事件中调用)"""
+        if self._tracking_task:
+            self._tracking_task.cancel()
+            try:
+                await self._tracking_task
+            except asyncio.CancelledError:
+                pass
         await self._redis.close()
+        Redis._initialized = False
+
+    async def warm_up(self, size: int):
+        """预热连接池, 并发执行 PING 以提前建立 size 个连接"""
+        await asyncio.gather(*[self._redis.ping() for _ in range(size)])
+        self.logger.info(f"Redis连接池预热完成: {size} 个连接")
+
+    async def ping(self) -> bool:
+        """检查连接是否可用"""
+        try:
+            return await self._redis.ping()
+        except Exception:
+            return False
+
+    async def _on_invalidate(self, response):
+        """处理服务端推送的失效消息: ["invalidate", [keys] | None]"""
+        keys = response[1]
+        self._invalidations += 1
+        if keys is None:  # FLUSHDB 等操作会使全部缓存失效
+            self._cache.clear()
+        else:
+            for key in keys:
+                self._cache.pop(key.decode() if isinstance(key, bytes) else key, None)
+        return response
+
+    async def _track_invalidations(self):
+        """维护接收失效推送的 RESP3 连接, 断线时清空缓存并重连"""
+        prefixes = []
+        for prefix in self.CACHED_PREFIXES:
+            prefixes += ["PREFIX", prefix]
+        while True:
+            conn = Connection(
+                host=self.host,
+                port=self.port,
+                db=self.db,
+                protocol=3,
+                decode_responses=True,
+                socket_timeout=None,
+                socket_connect_timeout=40,
+            )
+            try:
+                await conn.connect()
+                conn._parser.set_invalidation_push_handler(self._on_invalidate)
+                await conn.send_command("CLIENT", "TRACKING", "ON", "BCAST", *prefixes)
+                await conn.read_response()
+                self._tracking = True
+                self.logger.info("Redis客户端缓存已开启")
+                while True:
+                    await conn.read_response(push_request=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Redis失效通知连接断开, 客户端缓存暂停: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self._tracking = False
+                self._cache.clear()
+                await conn.disconnect()
+
+    async def get_cached(self, key):
+        """
+        带客户端缓存的 GET, 仅对 CACHED_PREFIXES 中的键生效
+        失效通知连接不可用时直接读取 Redis
+        """
+        if not self._tracking or not key.startswith(self.CACHED_PREFIXES):
+            return await self._redis.get(key)
+        if key in self._cache:
+            return self._cache[key]
+        invalidations = self._invalidations
+        value = await self._redis.get(key)
+        # 读取期间收到过失效消息时不写入缓存, 避免缓存旧值
+        if self._tracking and invalidations == self._invalidations:
+            if len(self._cache) >= settings.redis_client_cache_size:
+                self._cache.clear()
+            self._cache[key] = value
+        return value
+
+    async def run_script(self, name, keys=(), args=()):
+        """执行预注册的 Lua 脚本"""
+        return await self._scripts[name](keys=list(keys), args=list(args))
+
+    async def scan_iter(self, match=None, count=1000):
+        """使用 SCAN 增量遍历匹配的键, 不会像 KEYS 一样阻塞服务端"""
+        async for key in self._redis.scan_iter(match=match, count=count):
+            yield key
 
     # 以下是异步方法实现
     async def get(self, key):
         return await self._redis.get(key)
 
-    async def set(self, key, value, ex=None):
-        return await self._redis.set(key, value, ex=ex)
+    async def set(self, key, value, ex=None, nx=False):
+        return await self._redis.set(key, value, ex=ex, nx=nx)
 
     async def delete(self, key):
         return await self._redis.delete(key)
 
-    async def keys(self, pattern):
-        return await self._redis.keys(pattern)
-
     async def exists(self, key):
         return await self._redis.exists(key) > 0
 
@@ -92,6 +261,103 @@ class Redis:
     async def lrange(self, key, start, end):
         return await self._redis.lrange(key, start, end)
 
+    async def expire(self, key, time):
+        return await self._redis.expire(key, time)
+
+    async def hincrby(self, key, field, amount=1):
+        return await self._redis.hincrby(key, field, amount)
+
+    async def hgetall(self, key):
+        return await self._redis.hgetall(key)
+
+    async def hget(self, key, field):
+        return await self._redis.hget(key, field)
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        return await self._redis.hset(key, field, value, mapping=mapping)
+
+    async def hsetnx(self, key, field, value):
+        return await self._redis.hsetnx(key, field, value)
+
+    async def hdel(self, key, *fields):
+        return await self._redis.hdel(key, *fields)
+
+    async def smismember(self, key, values):
+        return await self._redis.smismember(key, values)
+
+    async def srem(self, key, *values):
+        return await self._redis.srem(key, *values)
+
+    async def spop(self, key, count=None):
+        return await self._redis.spop(key, count)
+
+    async def smembers(self, key):
+        return await self._redis.smembers(key)
+
+    async def scard(self, key):
+        return await self._redis.scard(key)
+
+    async def zadd(self, key, mapping, nx=False):
+        return await self._redis.zadd(key, mapping, nx=nx)
+
+    async def zrangebyscore(self, key, min, max, start=None, num=None):
+        return await self._redis.zrangebyscore(key, min, max, start=start, num=num)
+
+    async def zrem(self, key, *values):
+        return await self._redis.zrem(key, *values)
+
+    async def pfadd(self, key, *values):
+        return await self._redis.pfadd(key, *values)
+
+    async def pfcount(self, *keys):
+        return await self._redis.pfcount(*keys)
+
+    async def zmscore(self, key, members):
+        return await self._redis.zmscore(key, members)
+
+    async def zremrangebyscore(self, key, min, max):
+        return await self._redis.zremrangebyscore(key, min, max)
+
+    async def zcard(self, key):
+        return await self._redis.zcard(key)
+
+    async def xadd(self, key, fields):
+        return await self._redis.xadd(key, fields)
+
+    async def xlen(self, key):
+        return await self._redis.xlen(key)
+
+    async def xgroup_create(self, key, group, id="$", mkstream=False):
+        return await self._redis.xgroup_create(key, group, id=id, mkstream=mkstream)
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        return await self._redis.xreadgroup(group, consumer, streams, count=count, block=block)
+
+    async def xautoclaim(self, key, group, consumer, min_idle_time, start_id="0-0", count=None):
+        return await self._redis.xautoclaim(
+            key, group, consumer, min_idle_time, start_id=start_id, count=count
+        )
+
+    async def xack(self, key, group, *ids):
+        return await self._redis.xack(key, group, *ids)
+
+    async def xinfo_consumers(self, key, group):
+        return await self._redis.xinfo_consumers(key, group)
+
+    async def xgroup_delconsumer(self, key, group, consumer):
+        return await self._redis.xgroup_delconsumer(key, group, consumer)
+
+    async def publish(self, channel, message):
+        return await self._redis.publish(channel, message)
+
+    def pubsub(self):
+        """创建 Pub/Sub 对象, 使用独立的连接"""
+        return self._redis.pubsub()
+
+    def ft(self, index_name):
+        """RediSearch 索引操作对象"""
+        return self._redis.ft(index_name)
+
     async def pipeline(self):
         """获取异步管道上下文"""
         return self._redis.pipeline()
@@ -1,5 +1,6 @@
 import os
 import sys
+import asyncio
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from dotenv import load_dotenv
@@ -9,34 +10,187 @@ from app.core.config import settings
 from motor.motor_asyncio import AsyncIOMotorClient
 import app.routers.wechat as wechat
 import app.routers.message as message
+import app.routers.health as health
+import app.routers.user as user
+import app.routers.group as group
 from app.database.redis import Redis
+from app.database.mongo import MongoDB
+from app.database.mysql import MySQL
 from app.services.mp import MPUtils
+from app.services.coalesce import Coalescer
+from app.services.page import MessagePages
+from app.services.broadcast import BroadcastRunner
+from app.services.tag import TagSync
+from app.services.user import UserRegistry
+from app.services.follower import FollowerSync
+from app.services.delivery import DeliveryScheduler
+from app.services.status import StatusHub
+from app.services.admission import AdmissionController
+from app.services.search import MessageSearch
+from app.services.archive import MessageArchive
+from app.services.mute import GroupMute
+from app.services.undeliverable import UndeliverableCache
+from app.services.stats import SendStats
+from app.services.stream import StreamDelivery
+
+
+# 准入控制, 需在创建应用时注册中间件
+admission = AdmissionController()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    app.state.admission = admission
+
     # 创建MongoDB客户端连接
     app.state.mongodb_client = AsyncIOMotorClient(
         host=settings.mongo_host,
         port=settings.mongo_port,
         username=settings.mongo_username,
         password=settings.mongo_password,
+        minPoolSize=settings.pool_warmup_size,
     )
 
     # 创建Redis客户端连接
     app.state.redis_client = Redis()
     await app.state.redis_client.initialize()
     app.state.mp_instance = MPUtils()
+    await app.state.mp_instance.start()
+    app.state.mute = GroupMute(redis=app.state.redis_client)
+    app.state.undeliverable = UndeliverableCache(redis=app.state.redis_client)
+
+    # 发送统计, 定时汇总到 MongoDB
+    app.state.send_stats = SendStats(
+        redis=app.state.redis_client,
+        mongodb=MongoDB(
+            client=app.state.mongodb_client, collection=settings.mongo_stats_collection
+        ),
+    )
+    await app.state.send_stats.start()
+
+    # 消息状态推送, 每个进程共用一个 Pub/Sub 连接
+    app.state.status = StatusHub(redis=app.state.redis_client)
+    await app.state.status.start()
+
+    # 启动按优先级发送的调度协程
+    app.state.delivery = DeliveryScheduler()
+    await app.state.delivery.start()
+
+    # delivery_mode=stream 时启动分区有序发送
+    app.state.streams = StreamDelivery(
+        redis=app.state.redis_client,
+        mp=app.state.mp_instance,
+        delivery=app.state.delivery,
+        status=app.state.status,
+        stats=app.state.send_stats,
+        undeliverable=app.state.undeliverable,
+    )
+    await app.state.streams.start()
+
+    # 启动消息合并后台任务
+    app.state.coalescer = Coalescer(
+        redis=app.state.redis_client,
+        mongodb=MongoDB(client=app.state.mongodb_client),
+        mp=app.state.mp_instance,
+        delivery=app.state.delivery,
+        status=app.state.status,
+        stats=app.state.send_stats,
+        undeliverable=app.state.undeliverable,
+        streams=app.state.streams,
+    )
+    await app.state.coalescer.start()
+
+    # 消息检索索引
+    app.state.search = MessageSearch(
+        redis=app.state.redis_client,
+        mongodb=MongoDB(client=app.state.mongodb_client),
+    )
+    await app.state.search.start()
+
+    # 启动历史消息归档任务
+    app.state.archive = MessageArchive(mongodb=MongoDB(client=app.state.mongodb_client))
+    await app.state.archive.start()
+
+    # 消息页面缓存
+    app.state.pages = MessagePages(
+        mongodb=MongoDB(client=app.state.mongodb_client),
+        archive=app.state.archive,
+    )
+
+    # 启动广播任务调度
+    app.state.broadcast = BroadcastRunner(
+        mongodb_client=app.state.mongodb_client,
+        mp=app.state.mp_instance,
+        coalescer=app.state.coalescer,
+        delivery=app.state.delivery,
+        status=app.state.status,
+        mute=app.state.mute,
+        undeliverable=app.state.undeliverable,
+        stats=app.state.send_stats,
+        streams=app.state.streams,
+        admission=admission,
+    )
+    await app.state.broadcast.start()
+
+    # 启动群组标签同步任务
+    app.state.tag_sync = TagSync(
+        redis=app.state.redis_client,
+        mp=app.state.mp_instance,
+        mute=app.state.mute,
+        admission=admission,
+    )
+    await app.state.tag_sync.start()
+
+    # 启动用户批量注册任务
+    app.state.users = UserRegistry(mp=app.state.mp_instance, admission=admission)
+    await app.state.users.start()
+
+    # 启动关注者同步任务调度
+    app.state.follower_sync = FollowerSync(
+        mongodb_client=app.state.mongodb_client,
+        redis=app.state.redis_client,
+        mp=app.state.mp_instance,
+        admission=admission,
+    )
+    await app.state.follower_sync.start()
+
+    # 预热连接池, 完成后就绪探针才返回成功
+    app.state.ready = False
+    await asyncio.gather(
+        MySQL.warm_up(settings.pool_warmup_size),
+        MongoDB(client=app.state.mongodb_client).warm_up(settings.pool_warmup_size),
+        app.state.redis_client.warm_up(settings.pool_warmup_size),
+        app.state.mp_instance.warm_up(),
+    )
+    app.state.ready = True
 
     yield
 
+    app.state.ready = False
+    await app.state.broadcast.stop()
+    await app.state.tag_sync.stop()
+    await app.state.users.stop()
+    await app.state.follower_sync.stop()
+    await app.state.coalescer.stop()
+    await app.state.streams.stop()
+    await app.state.delivery.stop()
+    await app.state.status.stop()
+    await app.state.search.stop()
+    await app.state.archive.stop()
+    await app.state.send_stats.stop()
+    await app.state.mp_instance.stop()
     app.state.mongodb_client.close()
     await app.state.redis_client.close()
+    await MySQL.close_pool()
 
 
 app = FastAPI(lifespan=lifespan)
+app.middleware("http")(admission.dispatch)
 app.include_router(wechat.router)
 app.include_router(message.router)
+app.include_router(user.router)
+app.include_router(group.router)
+app.include_router(health.router)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# app/routers/group.py
+
+import json
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from app.core.config import settings
+from app.services.group import GroupService
+from app.services.account import accounts
+
+router = APIRouter()
+
+
+@router.post(settings.main_path + "/group/{name}/members")
+async def update_group_members(
+    name: str,
+    request: Request,
+    service: GroupService = Depends(GroupService),
+):
+    """
+    批量添加/移除群组成员, 只有群主可以操作
+    请求体: {"openid": 群主openid, "add": [openid, ...], "remove": [openid, ...],
+            "account": 群组所属公众号, 可选}
+    """
+    body = json.loads(await request.body())
+    add, remove = body.get("add") or [], body.get("remove") or []
+    if (
+        "openid" not in body
+        or not isinstance(add, list)
+        or not isinstance(remove, list)
+        or not (add or remove)
+    ):
+        return Response(
+            status_code=400,
+            content=json.dumps({"code": 400, "msg": "Missing parameters."}),
+            media_type="application/json",
+        )
+    try:
+        account = accounts.get(body.get("account")).key
+        result = await service.update_members(
+            body["openid"], name, add=add, remove=remove, account=account
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(
+        content=json.dumps({"code": 200, "data": result}),
+        media_type="application/json",
+    )
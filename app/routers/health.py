@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# app/routers/health.py
+
+import json
+from fastapi import APIRouter, Request, Response
+from app.database.mysql import MySQL
+from app.database.mongo import MongoDB
+
+router = APIRouter()
+
+
+@router.get("/healthz")
+async def liveness():
+    """存活探针, 进程能处理请求即返回 200"""
+    return Response(
+        content=json.dumps({"status": "ok"}),
+        media_type="application/json",
+    )
+
+
+@router.get("/readyz")
+async def readiness(request: Request):
+    """就绪探针, 连接池预热完成且 access_token 有效时返回 200"""
+    state = request.app.state
+    checks = {"warmed_up": getattr(state, "ready", False)}
+    if checks["warmed_up"]:
+        checks["mysql"] = await MySQL.ping()
+        checks["mongodb"] = await MongoDB(client=state.mongodb_client).ping()
+        checks["redis"] = await state.redis_client.ping()
+        checks["access_token"] = bool(await state.mp_instance.get_access_token())
+    ready = all(checks.values())
+    return Response(
+        status_code=200 if ready else 503,
+        content=json.dumps({"status": "ok" if ready else "unavailable", "checks": checks}),
+        media_type="application/json",
+    )
@@ -1,7 +1,39 @@
 import json
+import html
+import zlib
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from datetime import datetime
+from fastapi.responses import HTMLResponse, StreamingResponse
 from app.core.config import settings
-from app.services.message import MessageService
+from app.core.dependencies import (
+    get_coalescer,
+    get_pages,
+    get_broadcast,
+    get_delivery,
+    get_status,
+    get_admission,
+    get_search,
+    get_mongodb,
+    get_send_stats,
+    get_streams,
+)
+from app.services.broadcast import BroadcastRunner
+from app.services.coalesce import Coalescer
+from app.services.delivery import DeliveryScheduler
+from app.services.status import StatusHub
+from app.services.admission import AdmissionController
+from app.services.search import MessageSearch
+from app.services.stats import SendStats
+from app.services.stream import StreamDelivery
+from app.services.page import (
+    MessagePages,
+    accepted_encodings,
+    accepts_encoding,
+    encoded_etag,
+)
+from app.database.mongo import MongoDB
+from app.services.message import MessageService, iter_export_messages
 
 router = APIRouter()
 
@@ -23,13 +55,26 @@ async def send_message(
             content=json.dumps({"code": 400, "msg": "Missing parameters."}),
             media_type="application/json",
         )
-    result = await service.send_message(
-        client_ip=client_ip,
-        openid=body["openid"],
-        title=body["title"],
-        content=body["content"],
-        group=body["group"] if "group" in body else None,
-    )
+    try:
+        result = await service.send_message(
+            client_ip=client_ip,
+            openid=body["openid"],
+            title=body["title"],
+            content=body["content"],
+            group=body["group"] if "group" in body else None,
+            msgtype=body.get("msgtype", "template"),
+            template=body.get("template"),
+            data=body.get("data"),
+            account=body.get("account"),
+            priority=body.get("priority"),
+            deadline=body.get("deadline"),
+        )
+    except ValueError as e:
+        return Response(
+            status_code=400,
+            content=json.dumps({"code": 400, "msg": str(e)}, ensure_ascii=False),
+            media_type="application/json",
+        )
     return Response(
         content=json.dumps(result),
         media_type="application/json",
@@ -52,3 +97,366 @@ async def get_message_endpoint(
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get(settings.main_path + "/status/stream")
+async def stream_status(
+    message_id: str = None,
+    openid: str = None,
+    status: StatusHub = Depends(get_status),
+):
+    """
+    消息状态 SSE 推送, 按 message_id 订阅单条消息或按 openid 订阅发送者的全部消息
+    事件类型为 queued/sent/delivered/failed, 每 15 秒发送一次注释保持连接
+    """
+    if not message_id and not openid:
+        raise HTTPException(status_code=400, detail="Missing parameters.")
+    if message_id:
+        channel = StatusHub.message_channel(message_id)
+    else:
+        channel = StatusHub.sender_channel(openid)
+
+    def format_event(event: dict) -> str:
+        data = json.dumps(event, ensure_ascii=False)
+        return f"event: {event['status']}\ndata: {data}\n\n"
+
+    async def events():
+        async with status.subscribe(channel) as queue:
+            # 订阅后再读取最新状态, 避免错过订阅前的状态变更
+            if message_id:
+                last = await status.get_last(message_id)
+                if last:
+                    yield format_event(last)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def parse_time(value: str):
+    """解析时间参数, 支持 unix 时间戳、YYYY-MM-DD 和 YYYY-MM-DD HH:MM:SS"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"时间格式错误: {value}")
+
+
+@router.get(settings.main_path + "/search")
+async def search_messages(
+    q: str = "",
+    openid: str = None,
+    start: str = None,
+    end: str = None,
+    offset: int = 0,
+    limit: int = 20,
+    order: str = "desc",
+    search: MessageSearch = Depends(get_search),
+):
+    """
+    历史消息检索: q 为全文检索词(以 * 结尾按前缀匹配), openid 过滤接收者,
+    start/end 为时间范围, 按发送时间排序(order=asc/desc)并分页
+    只访问 Redis, 不占用 MySQL 连接
+    """
+    try:
+        result = await search.search(
+            text=q,
+            openid=openid,
+            start=parse_time(start),
+            end=parse_time(end),
+            offset=max(offset, 0),
+            limit=max(limit, 1),
+            ascending=order == "asc",
+        )
+    except ValueError as e:
+        return Response(
+            status_code=400,
+            content=json.dumps({"code": 400, "msg": str(e)}, ensure_ascii=False),
+            media_type="application/json",
+        )
+    return Response(
+        content=json.dumps({"code": 200, "data": result}, ensure_ascii=False),
+        media_type="application/json",
+    )
+
+
+@router.post(settings.main_path + "/search/backfill")
+async def start_search_backfill(search: MessageSearch = Depends(get_search)):
+    """从 MongoDB 回填检索索引, 可重复调用查询进度"""
+    try:
+        result = await search.start_backfill()
+    except ValueError as e:
+        return Response(
+            status_code=400,
+            content=json.dumps({"code": 400, "msg": str(e)}, ensure_ascii=False),
+            media_type="application/json",
+        )
+    return Response(
+        content=json.dumps({"code": 200, "data": result}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/search/backfill")
+async def get_search_backfill(search: MessageSearch = Depends(get_search)):
+    """检索索引回填进度"""
+    return Response(
+        content=json.dumps({"code": 200, "data": await search.get_backfill()}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/messages/export")
+async def export_messages(
+    openid: str = None,
+    start: str = None,
+    end: str = None,
+    compress: str = None,
+    mongodb: MongoDB = Depends(get_mongodb),
+):
+    """
+    流式导出消息为 NDJSON, 每行一条消息, compress=gzip 时输出 gzip 压缩文件
+    start/end 格式为 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS
+    """
+    if end and len(end) == 10:
+        end += " 23:59:59"
+    docs = iter_export_messages(mongodb, openid=openid, start=start, end=end)
+    chunk_size = 64 * 1024
+
+    async def lines():
+        # 累积到 64KB 再写出, 内存占用与导出总量无关
+        gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress == "gzip" else None
+        buffer = []
+        size = 0
+        async for doc in docs:
+            line = json.dumps(doc, ensure_ascii=False, default=str).encode() + b"\n"
+            buffer.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                chunk = b"".join(buffer)
+                buffer, size = [], 0
+                chunk = gzip.compress(chunk) if gzip else chunk
+                if chunk:
+                    yield chunk
+        chunk = b"".join(buffer)
+        if gzip:
+            chunk = gzip.compress(chunk) + gzip.flush()
+        if chunk:
+            yield chunk
+
+    filename = "messages.ndjson.gz" if compress == "gzip" else "messages.ndjson"
+    return StreamingResponse(
+        lines(),
+        media_type="application/gzip" if compress == "gzip" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get(settings.main_path + "/weixin_msg/{message_id}")
+async def get_message_page(
+    message_id: str,
+    request: Request,
+    pages: MessagePages = Depends(get_pages),
+):
+    """消息详情页面, 模板消息的跳转链接指向此处"""
+    page = await pages.get(message_id)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+
+    encodings = accepted_encodings(request.headers.get("accept-encoding", ""))
+    if page.br is not None and accepts_encoding(encodings, "br"):
+        coding, content = "br", page.br
+    elif accepts_encoding(encodings, "gzip"):
+        coding, content = "gzip", page.gzip
+    else:
+        coding, content = None, page.identity
+
+    # 消息内容不会变化, 允许浏览器和 CDN 长期缓存; 每种编码使用各自的 ETag
+    headers = {
+        "ETag": encoded_etag(page.etag, coding),
+        "Cache-Control": f"public, max-age={settings.page_max_age}, immutable",
+        "Vary": "Accept-Encoding",
+    }
+    if coding:
+        headers["Content-Encoding"] = coding
+    if_none_match = request.headers.get("if-none-match", "")
+    if headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=content,
+        headers=headers,
+        media_type="text/html; charset=utf-8",
+    )
+
+
+@router.get(settings.main_path + "/digest/{digest_id}")
+async def get_digest_page(
+    digest_id: str,
+    service: MessageService = Depends(MessageService),
+):
+    """合并消息摘要页面, 列出窗口内的全部消息"""
+    try:
+        digest = await service.get_digest(digest_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    items = "".join(
+        f"<li><h3>{html.escape(message.get('title', ''))}</h3>"
+        f"<small>{html.escape(message.get('date', ''))}</small>"
+        f"<p>{html.escape(message.get('content', ''))}</p></li>"
+        for message in digest["messages"]
+    )
+    return HTMLResponse(
+        content=(
+            '<!DOCTYPE html><html><head><meta charset="utf-8">'
+            '<meta name="viewport" content="width=device-width, initial-scale=1">'
+            f"<title>{html.escape(digest['title'])}</title></head>"
+            f"<body><h2>{html.escape(digest['title'])}</h2><ol>{items}</ol></body></html>"
+        )
+    )
+
+
+@router.post(settings.main_path + "/coalesce")
+async def set_coalesce_window(
+    request: Request,
+    coalescer: Coalescer = Depends(get_coalescer),
+):
+    """设置发送者的消息合并窗口(秒), 0 表示关闭"""
+    body = json.loads(await request.body())
+    if "openid" not in body or "window" not in body:
+        return Response(
+            status_code=400,
+            content=json.dumps({"code": 400, "msg": "Missing parameters."}),
+            media_type="application/json",
+        )
+    window = await coalescer.set_window(body["openid"], body["window"])
+    return Response(
+        content=json.dumps({"code": 200, "data": {"window": window}}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/coalesce/stats")
+async def get_coalesce_stats(coalescer: Coalescer = Depends(get_coalescer)):
+    """消息合并统计, 用于观察突发流量下节省的微信接口调用次数"""
+    return Response(
+        content=json.dumps({"code": 200, "data": await coalescer.get_stats()}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/delivery/stats")
+async def get_delivery_stats(
+    delivery: DeliveryScheduler = Depends(get_delivery),
+    streams: StreamDelivery = Depends(get_streams),
+):
+    """各优先级队列的深度和排队等待时间直方图, stream 模式下包含分区持有和积压情况"""
+    data = {**delivery.get_stats(), "stream": await streams.get_stats()}
+    return Response(
+        content=json.dumps({"code": 200, "data": data}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/stats/send")
+async def get_send_stats_summary(
+    hours: int = 24,
+    group: str = None,
+    stats: SendStats = Depends(get_send_stats),
+):
+    """最近若干小时的发送数量、去重接收人数、错误码和群组分布, 按小时分桶"""
+    data = await stats.get(hours=hours, group=group)
+    return Response(
+        content=json.dumps({"code": 200, "data": data}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/stats/send/history")
+async def get_send_stats_history(
+    start: str,
+    end: str,
+    stats: SendStats = Depends(get_send_stats),
+):
+    """已汇总到 MongoDB 的小时统计, start/end 格式为 YYYYmmddHH"""
+    data = await stats.get_history(start, end)
+    return Response(
+        content=json.dumps({"code": 200, "data": data}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/admission/stats")
+async def get_admission_stats(
+    admission: AdmissionController = Depends(get_admission),
+    delivery: DeliveryScheduler = Depends(get_delivery),
+):
+    """准入控制统计: 进行中的请求、拒绝次数、MySQL 连接池和发送队列状态"""
+    data = {**admission.get_stats(), "delivery_queue": delivery.depth()}
+    return Response(
+        content=json.dumps({"code": 200, "data": data}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/broadcast/{job_id}")
+async def get_broadcast_progress(
+    job_id: str,
+    broadcast: BroadcastRunner = Depends(get_broadcast),
+):
+    """广播任务进度查询, 包含发送速率和预计剩余时间"""
+    try:
+        result = await broadcast.get_progress(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(
+        content=json.dumps({"code": 200, "data": result}),
+        media_type="application/json",
+    )
+
+
+@router.post(settings.main_path + "/broadcast/{job_id}/{action}")
+async def control_broadcast(
+    job_id: str,
+    action: str,
+    request: Request,
+    broadcast: BroadcastRunner = Depends(get_broadcast),
+):
+    """暂停(pause)/继续(resume)/取消(cancel)广播任务, 需提供发送者的openid"""
+    statuses = {
+        "pause": BroadcastRunner.PAUSED,
+        "resume": BroadcastRunner.RUNNING,
+        "cancel": BroadcastRunner.CANCELLED,
+    }
+    body = json.loads(await request.body())
+    if action not in statuses or "openid" not in body:
+        return Response(
+            status_code=400,
+            content=json.dumps({"code": 400, "msg": "Missing parameters."}),
+            media_type="application/json",
+        )
+    try:
+        result = await broadcast.set_status(job_id, body["openid"], statuses[action])
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(
+        content=json.dumps({"code": 200, "data": result}),
+        media_type="application/json",
+    )
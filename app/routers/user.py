@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# app/routers/user.py
+
+import json
+from fastapi import APIRouter, Depends, HTTPException, Response
+from app.core.config import settings
+from app.core.dependencies import get_follower_sync
+from app.services.follower import FollowerSync
+
+router = APIRouter()
+
+
+@router.post(settings.main_path + "/sync/followers")
+async def start_follower_sync(
+    account: str = None,
+    sync: FollowerSync = Depends(get_follower_sync),
+):
+    """创建公众号的关注者全量同步任务, 该公众号已有任务运行时返回该任务"""
+    try:
+        result = await sync.create_job(account)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(
+        content=json.dumps({"code": 200, "data": result}),
+        media_type="application/json",
+    )
+
+
+@router.get(settings.main_path + "/sync/followers/{job_id}")
+async def get_follower_sync_progress(
+    job_id: str,
+    sync: FollowerSync = Depends(get_follower_sync),
+):
+    """关注者同步任务进度, 包含每秒处理的行数"""
+    try:
+        result = await sync.get_progress(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(
+        content=json.dumps({"code": 200, "data": result}),
+        media_type="application/json",
+    )
@@ -1,43 +1,83 @@
 # -*- coding: utf-8 -*-
 # app/routers/wechat.py
 
+import asyncio
 import hashlib
 from fastapi import APIRouter, Depends, Request, Response
 
 from aiomysql import Connection
+from app.core.logger import LOG
 from app.core.config import settings
-from app.core.dependencies import get_mysql
+from app.core.dependencies import get_mysql, get_mp
 from app.database.mysql import MySQL
+from app.services.account import accounts
+from app.services.mp import MPUtils
 from app.services.wechat import WechatService
 
 router = APIRouter()
+logger = LOG().logger
 
+# 转入后台的回调处理任务, 保留引用避免被回收
+background_tasks = set()
 
-@router.get(settings.main_path)
-async def verify_server(request: Request):
-    """验证微信服务器有效性"""
+
+def check_signature(request: Request, verify_token: str) -> bool:
+    """校验微信服务器签名"""
     signature = request.query_params.get("signature", "")
     timestamp = request.query_params.get("timestamp", "")
     nonce = request.query_params.get("nonce", "")
-    echostr = request.query_params.get("echostr", "")
 
     # 计算签名
-    params = sorted([settings.verify_token, timestamp, nonce])
+    params = sorted([verify_token, timestamp, nonce])
     sign_str = "".join(params)
     hash_str = hashlib.sha1(sign_str.encode()).hexdigest()
+    return hash_str == signature
 
-    if hash_str == signature:
-        return Response(content=echostr)
+
+@router.get(settings.main_path)
+@router.get(settings.main_path + "/mp/{account}")
+async def verify_server(request: Request, account: str = None):
+    """验证微信服务器有效性, 多公众号时回调地址为 {main_path}/mp/{account}"""
+    try:
+        verify_token = accounts.get(account).verify_token
+    except ValueError:
+        return Response(content="Unknown account", status_code=404)
+
+    if check_signature(request, verify_token):
+        return Response(content=request.query_params.get("echostr", ""))
     else:
         return Response(content="Verification Failed", status_code=403)
 
 
+async def reply_later(mp: MPUtils, task: asyncio.Task, openid: str, account: str):
+    """回调超时后等待处理完成, 通过客服消息接口发送回复"""
+    try:
+        reply = await task
+        if reply:
+            result = await mp.send_custom_text(openid, reply, account=account)
+            if result.get("errcode", 0) != 0:
+                logger.warning(f"发送客服消息失败: {result}")
+    except Exception as e:
+        logger.exception(f"后台消息处理异常: {str(e)}")
+
+
 @router.post(settings.main_path)
+@router.post(settings.main_path + "/mp/{account}")
 async def handle_message(
     request: Request,
+    account: str = None,
     service: WechatService = Depends(WechatService),
+    mp: MPUtils = Depends(get_mp),
 ):
-    """处理用户消息 (POST 请求)"""
+    """
+    处理用户消息 (POST 请求)
+    处理时间超过 callback_reply_budget 时先回复 success 避免微信重试,
+    处理完成后通过客服消息接口发送回复
+    """
+    try:
+        accounts.get(account)
+    except ValueError:
+        return Response(content="Unknown account", status_code=404)
     try:
         # 解析原始消息
         msg_type, from_user, to_user, content = service.parse_message_body(
@@ -45,13 +85,37 @@ async def handle_message(
         )
 
         # 分发消息处理
-        if msg_type == "text":
-            reply = await service.process_text_message(
-                from_user=from_user,
-                content=content,
-            )
+        async def process() -> str:
+            if msg_type == "text":
+                return await service.process_text_message(
+                    from_user=from_user,
+                    content=content,
+                    account=account,
+                )
+            if msg_type == "event":
+                return await service.process_event(
+                    from_user=from_user, event=content, account=account
+                )
+            return "暂不支持此类型消息"
+
+        if settings.callback_reply_budget > 0:
+            task = asyncio.create_task(process())
+            # 数据库连接由处理任务结束后释放, 请求在等待期间被取消时任务仍在使用连接
+            request.state.background_task = task
+            done, _ = await asyncio.wait({task}, timeout=settings.callback_reply_budget)
+            if not done:
+                logger.warning(f"消息处理超过 {settings.callback_reply_budget} 秒, 转入后台: {content}")
+                background = asyncio.create_task(reply_later(mp, task, from_user, account))
+                background_tasks.add(background)
+                background.add_done_callback(background_tasks.discard)
+                return Response(content="success")
+            reply = task.result()
         else:
-            reply = "暂不支持此类型消息"
+            reply = await process()
+
+        # 无需回复时返回 success, 微信服务器不会重试
+        if not reply:
+            return Response(content="success")
 
         # 构造响应
         return Response(
@@ -62,5 +126,5 @@ async def handle_message(
     # except WeChatException as e:
     #     return Response(content=str(e), status_code=e.status_code)
     except Exception as e:
-        print(f"消息处理异常: {str(e)}")
+        logger.exception(f"消息处理异常: {str(e)}")
         return Response(content="服务暂时不可用", status_code=500)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# app/services/account.py
+
+import os
+import json
+from typing import Dict, List, NamedTuple
+from app.core.logger import LOG
+from app.core.config import settings
+
+
+class Account(NamedTuple):
+    key: str  # 路由中使用的公众号标识
+    appid: str
+    appsecret: str
+    verify_token: str
+    template_id: str  # 默认模板使用的模板ID
+    templates: Dict[str, str] = {}  # 模板名称 -> 该公众号的模板ID
+
+    def resolve_template_id(self, name: str, template_id: str) -> str:
+        """
+        返回模板在该公众号下的模板ID
+        Args:
+            name: 模板名称
+            template_id: 模板注册表中的模板ID
+        """
+        if name in self.templates:
+            return self.templates[name]
+        if name == AccountRegistry.DEFAULT:
+            return self.template_id
+        return template_id
+
+
+class AccountRegistry:
+    """
+    公众号配置注册表
+    默认公众号 default 使用 APPID/APPSECRET 等原有配置, 其他公众号来自
+    ACCOUNTS (JSON) 或 ACCOUNTS_FILE 指定的 JSON 文件。配置缓存在内存中,
+    文件修改后由 access_token 刷新任务调用 reload 重新加载, 无需重启进程。
+    """
+
+    logger = LOG().logger
+
+    DEFAULT = "default"
+
+    def __init__(self):
+        self._accounts = {}
+        self._mtime = None
+        self._load({})
+        self.reload()
+
+    def get(self, key: str = None) -> Account:
+        key = key or self.DEFAULT
+        if key not in self._accounts:
+            raise ValueError(f"公众号 {key} 不存在")
+        return self._accounts[key]
+
+    def all(self) -> List[Account]:
+        return list(self._accounts.values())
+
+    def reload(self) -> bool:
+        """
+        配置文件修改后重新加载
+        Returns:
+            bool: 是否重新加载
+        """
+        if not settings.accounts_file:
+            return False
+        try:
+            mtime = os.stat(settings.accounts_file).st_mtime
+        except OSError as e:
+            self.logger.warning(f"读取公众号配置文件失败: {e}")
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            with open(settings.accounts_file, encoding="utf-8") as f:
+                self._load(json.load(f))
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            # 配置有误时保留原有配置
+            self.logger.error(f"加载公众号配置文件失败: {e}")
+            return False
+        self._mtime = mtime
+        self.logger.info(f"已加载公众号配置: {', '.join(self._accounts)}")
+        return True
+
+    def _load(self, extra: dict):
+        """
+        加载公众号配置, 格式:
+        {"key": {"appid": "...", "appsecret": "...", "verify_token": "...",
+                 "template_id": "...", "templates": {"name": "..."}}}
+        """
+        accounts = {
+            self.DEFAULT: Account(
+                key=self.DEFAULT,
+                appid=settings.appid,
+                appsecret=settings.appsecret,
+                verify_token=settings.verify_token,
+                template_id=settings.template_id,
+            )
+        }
+        for key, config in {**settings.accounts, **extra}.items():
+            accounts[key] = Account(
+                key=key,
+                appid=config["appid"],
+                appsecret=config["appsecret"],
+                verify_token=config["verify_token"],
+                template_id=config["template_id"],
+                templates=config.get("templates", {}),
+            )
+        # 整体替换, 读取方不会看到加载了一半的配置
+        self._accounts = accounts
+
+
+# 单例公众号注册表
+accounts = AccountRegistry()
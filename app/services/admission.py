@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# app/services/admission.py
+
+import json
+import asyncio
+from fastapi import Request, Response
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mysql import MySQL
+
+
+class AdmissionController:
+    """
+    准入控制
+    统计进行中的请求、MySQL 连接等待时间和发送队列长度, 资源饱和时 /send
+    直接返回 503 和 Retry-After, 不再无限排队。微信回调必须在 5 秒内响应,
+    不参与拒绝, 并保留一部分 MySQL 连接, 接口请求和后台任务(广播、关注者同步、
+    用户写入、标签镜像)最多只能占用其余的连接。
+    """
+
+    logger = LOG().logger
+
+    CALLBACK = "callback"
+    API = "api"
+
+    def __init__(self):
+        self.inflight = {self.CALLBACK: 0, self.API: 0}
+        self.sending = 0  # 进行中的 /send 请求
+        self.shed = 0
+        self._shared_connections = asyncio.Semaphore(
+            max(1, settings.mysql_pool_maxsize - settings.admission_reserved_connections)
+        )
+
+    @staticmethod
+    def classify(path: str) -> str:
+        """微信回调(含多公众号回调)为 callback, 其他请求为 api"""
+        if path == settings.main_path or path.startswith(settings.main_path + "/mp/"):
+            return AdmissionController.CALLBACK
+        return AdmissionController.API
+
+    def overload_reason(self, delivery=None) -> str:
+        """资源饱和时返回原因, 否则返回空字符串"""
+        if self.sending >= settings.admission_max_inflight:
+            return "too many requests in flight"
+        pool = MySQL.pool_stats()
+        if pool["waiting"] and pool["wait_ewma"] > settings.admission_max_pool_wait:
+            return "database pool saturated"
+        if delivery is not None and delivery.depth() > settings.admission_max_delivery_queue:
+            return "delivery queue saturated"
+        return ""
+
+    def rejection(self, reason: str) -> Response:
+        self.shed += 1
+        return Response(
+            status_code=503,
+            content=json.dumps({"code": 503, "msg": reason}),
+            media_type="application/json",
+            headers={"Retry-After": str(settings.admission_retry_after)},
+        )
+
+    async def dispatch(self, request: Request, call_next):
+        """HTTP 中间件: 统计进行中的请求并拒绝超出容量的 /send 请求"""
+        kind = self.classify(request.url.path)
+        send = (
+            kind == self.API
+            and request.method == "POST"
+            and request.url.path == settings.main_path + "/send"
+        )
+        if send:
+            reason = self.overload_reason(getattr(request.app.state, "delivery", None))
+            if reason:
+                self.logger.warning(f"拒绝 /send 请求: {reason}")
+                return self.rejection(reason)
+
+        self.inflight[kind] += 1
+        self.sending += send
+        try:
+            return await call_next(request)
+        finally:
+            self.inflight[kind] -= 1
+            self.sending -= send
+
+    async def get_api_connection(self):
+        """
+        接口请求获取 MySQL 连接, 只能使用未保留给回调的连接
+        Raises:
+            asyncio.TimeoutError: 等待超过 admission_max_pool_wait
+        """
+        await asyncio.wait_for(
+            self._shared_connections.acquire(), timeout=settings.admission_max_pool_wait
+        )
+        try:
+            return await MySQL.get_connection()
+        except BaseException:
+            self._shared_connections.release()
+            raise
+
+    async def release_api_connection(self, conn):
+        try:
+            await MySQL.release_connection(conn)
+        finally:
+            self._shared_connections.release()
+
+    async def get_worker_connection(self):
+        """后台任务获取 MySQL 连接, 与接口请求共用未保留给回调的连接, 等待不超时"""
+        await self._shared_connections.acquire()
+        try:
+            return await MySQL.get_connection()
+        except BaseException:
+            self._shared_connections.release()
+            raise
+
+    async def release_worker_connection(self, conn):
+        """释放后台任务的连接, conn 为空(获取失败)时不做处理"""
+        if conn is not None:
+            await self.release_api_connection(conn)
+
+    def get_stats(self) -> dict:
+        return {
+            "inflight": dict(self.inflight),
+            "sending": self.sending,
+            "shed": self.shed,
+            "mysql": MySQL.pool_stats(),
+            "mysql_replicas": MySQL.replica_stats(),
+        }
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# app/services/archive.py
+
+import os
+import json
+import mmap
+import zlib
+import fcntl
+import asyncio
+import threading
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from bson.objectid import ObjectId
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mongo import MongoDB
+
+try:
+    import zstandard
+except ImportError:  # zstandard 为可选依赖, 未安装时使用 zlib
+    zstandard = None
+
+
+class _IndexView:
+    """索引文件的只读内存映射, 按 ObjectId 二分查找"""
+
+    def __init__(self, path: str):
+        self.size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._count = self.size // MessageArchive.ENTRY_SIZE
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i: int) -> bytes:
+        # 只比较前 12 字节的 ObjectId
+        start = i * MessageArchive.ENTRY_SIZE
+        return self._mmap[start : start + 12]
+
+    def find(self, oid: bytes) -> Optional[tuple]:
+        i = bisect_left(self, oid)
+        if i == self._count or self[i] != oid:
+            return None
+        start = i * MessageArchive.ENTRY_SIZE + 12
+        offset = int.from_bytes(self._mmap[start : start + 8], "big")
+        length = int.from_bytes(self._mmap[start + 8 : start + 12], "big")
+        return offset, length
+
+    def close(self):
+        self._mmap.close()
+
+
+class MessageArchive:
+    """
+    历史消息冷存储
+    超过 archive_after_days 的消息按月写入只追加的本地归档段 {YYYY-MM}.seg,
+    每条记录单独压缩(zstd 或 zlib), 读取时只需解压一条记录。
+    {YYYY-MM}.idx 由定长的 (ObjectId, 偏移, 长度) 组成, 按 ObjectId 升序排列,
+    查询时内存映射索引文件并二分查找。归档按 _id 顺序进行, 每批写入归档并同步到
+    磁盘后才从 MongoDB 删除; 删除失败时下一轮重新读取这些消息, 跳过已写入索引的部分后再删除。
+    多台主机部署时 archive_dir 需要使用共享存储。
+    """
+
+    logger = LOG().logger
+
+    ENTRY_SIZE = 24  # ObjectId(12) + 偏移(8) + 长度(4)
+    CODEC_ZLIB = b"z"
+    CODEC_ZSTD = b"s"
+
+    def __init__(self, mongodb: MongoDB, directory: str = None):
+        self.mongodb = mongodb
+        self.directory = directory or settings.archive_dir
+        self._views = {}  # 月份 -> _IndexView
+        self._views_lock = threading.Lock()
+        self._task = None
+
+    async def start(self):
+        """启动定时归档任务 (需在 FastAPI 启动事件中调用)"""
+        os.makedirs(self.directory, exist_ok=True)
+        if settings.archive_after_days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止定时归档任务"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        with self._views_lock:
+            for view in self._views.values():
+                view.close()
+            self._views.clear()
+
+    def _path(self, month: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{month}.{suffix}")
+
+    @staticmethod
+    def _compress(data: bytes) -> bytes:
+        if zstandard is not None:
+            return MessageArchive.CODEC_ZSTD + zstandard.ZstdCompressor(level=10).compress(data)
+        return MessageArchive.CODEC_ZLIB + zlib.compress(data, 9)
+
+    @staticmethod
+    def _decompress(record: bytes) -> bytes:
+        codec, data = record[:1], record[1:]
+        if codec == MessageArchive.CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("读取 zstd 归档需要安装 zstandard")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    async def get(self, message_id: str) -> Optional[dict]:
+        """从归档中读取消息, 不存在时返回 None"""
+        try:
+            oid = ObjectId(message_id)
+        except Exception:
+            return None
+        return await asyncio.to_thread(self._lookup, oid)
+
+    def _lookup(self, oid: ObjectId) -> Optional[dict]:
+        month = oid.generation_time.strftime("%Y-%m")
+        index_path = self._path(month, "idx")
+        if not os.path.exists(index_path):
+            return None
+        with self._views_lock:
+            view = self._views.get(month)
+            # 索引追加后重新映射
+            if view is None or view.size != os.path.getsize(index_path):
+                if view is not None:
+                    view.close()
+                view = self._views[month] = _IndexView(index_path)
+            found = view.find(oid.binary)
+        if found is None:
+            return None
+        offset, length = found
+        with open(self._path(month, "seg"), "rb") as f:
+            record = os.pread(f.fileno(), length, offset)
+        return json.loads(self._decompress(record))
+
+    async def run_once(self) -> int:
+        """
+        归档一轮超过期限的消息
+        Returns:
+            int: 本轮归档的消息数量, 其他进程正在归档时返回 0
+        """
+        cutoff = ObjectId.from_datetime(
+            datetime.now(timezone.utc) - timedelta(days=settings.archive_after_days)
+        )
+        lock = open(os.path.join(self.directory, "archive.lock"), "w")
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            archived = 0
+            while True:
+                # 已归档的消息随即删除, 每批都从最早的消息开始读取
+                docs = await self.mongodb.find(
+                    {"_id": {"$lt": cutoff}},
+                    limit=settings.archive_batch_size,
+                    sort=[("_id", 1)],
+                )
+                if not docs:
+                    break
+                await asyncio.to_thread(self._append, docs)
+                await self.mongodb.delete_many(
+                    {"_id": {"$in": [ObjectId(doc["_id"]) for doc in docs]}}
+                )
+                archived += len(docs)
+            if archived:
+                self.logger.info(f"已归档 {archived} 条消息")
+            return archived
+        finally:
+            lock.close()
+
+    def _last_id(self, month: str) -> bytes:
+        """索引中最后一条记录的 ObjectId, 索引为空时返回空字节串"""
+        try:
+            with open(self._path(month, "idx"), "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size < self.ENTRY_SIZE:
+                    return b""
+                f.seek(size - size % self.ENTRY_SIZE - self.ENTRY_SIZE)
+                return f.read(12)
+        except FileNotFoundError:
+            return b""
+
+    def _append(self, docs: list):
+        """
+        按月追加记录和索引, 同步到磁盘后返回
+        已在索引中的消息(上次归档后未来得及删除)跳过, 保持索引有序且无重复
+        """
+        months = {}
+        for doc in docs:
+            oid = ObjectId(doc["_id"])
+            months.setdefault(oid.generation_time.strftime("%Y-%m"), []).append((oid, doc))
+        for month, items in months.items():
+            last = self._last_id(month)
+            items = [(oid, doc) for oid, doc in items if oid.binary > last]
+            if not items:
+                continue
+            with open(self._path(month, "seg"), "ab") as seg, open(
+                self._path(month, "idx"), "ab"
+            ) as idx:
+                # 丢弃中断时写了一半的索引项
+                size = idx.seek(0, os.SEEK_END)
+                if size % self.ENTRY_SIZE:
+                    idx.truncate(size - size % self.ENTRY_SIZE)
+                offset = seg.seek(0, os.SEEK_END)
+                entries = []
+                for oid, doc in items:
+                    record = self._compress(
+                        json.dumps(doc, ensure_ascii=False, default=str).encode()
+                    )
+                    seg.write(record)
+                    entries.append(
+                        oid.binary
+                        + offset.to_bytes(8, "big")
+                        + len(record).to_bytes(4, "big")
+                    )
+                    offset += len(record)
+                seg.flush()
+                os.fsync(seg.fileno())
+                # 记录写入磁盘后再写索引, 索引中的记录一定可读
+                idx.write(b"".join(entries))
+                idx.flush()
+                os.fsync(idx.fileno())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"消息归档失败: {e}")
+            await asyncio.sleep(settings.archive_interval)
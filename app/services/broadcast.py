@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# app/services/broadcast.py
+
+import os
+import time
+import socket
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mysql import MySQL
+from app.database.mongo import MongoDB
+from app.services.mp import MPUtils
+from app.services.coalesce import Coalescer
+from app.services.template import templates
+from app.services.account import accounts
+from app.services.delivery import DeliveryScheduler
+from app.services.status import StatusHub
+from app.services.mute import GroupMute
+from app.services.undeliverable import UndeliverableCache
+from app.services.stats import SendStats
+from app.services.stream import StreamDelivery
+from app.services.admission import AdmissionController
+
+
+class BroadcastRunner:
+    """
+    群组广播任务
+    任务保存在 MongoDB 中, 按 openid 顺序分批遍历群组成员, 每批发送完成后
+    记录游标(最后一个成员的 openid)。进程重启后其他进程会在心跳超时后接管任务,
+    从游标处继续发送, 最多重复发送中断时所在的一批。开启免打扰的成员跳过并计入 muted,
+    无法送达(未关注、拒收等)的成员跳过并计入 skipped。
+    """
+
+    logger = LOG().logger
+
+    # 任务状态
+    RUNNING = "running"
+    PAUSED = "paused"
+    CANCELLED = "cancelled"
+    EXPIRED = "expired"
+    DONE = "done"
+
+    def __init__(
+        self,
+        mongodb_client: AsyncIOMotorClient,
+        mp: MPUtils,
+        coalescer: Coalescer,
+        delivery: DeliveryScheduler,
+        status: StatusHub,
+        mute: GroupMute,
+        undeliverable: UndeliverableCache,
+        stats: SendStats,
+        streams: StreamDelivery,
+        admission: AdmissionController,
+        poll_interval: float = 1.0,
+    ):
+        self.mongodb_client = mongodb_client
+        self.jobs = MongoDB(client=mongodb_client, collection=settings.mongo_job_collection)
+        self.mp = mp
+        self.coalescer = coalescer
+        self.delivery = delivery
+        self.status = status
+        self.mute = mute
+        self.undeliverable = undeliverable
+        self.stats = stats
+        self.streams = streams
+        self.admission = admission
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._task = None
+        self._running = {}
+
+    async def start(self):
+        """启动任务调度 (需在 FastAPI 启动事件中调用)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止任务调度, 正在执行的任务由其他进程或下次启动时接管"""
+        job_ids = list(self._running)
+        tasks = list(self._running.values())
+        if self._task:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 释放任务, 重启后无需等待心跳超时
+        for job_id in job_ids:
+            await self._release(job_id)
+
+    async def create_job(
+        self,
+        conn,
+        sender: str,
+        group: str,
+        message_id: str,
+        title: str,
+        client_ip: str,
+        time_now: str,
+        template: str = None,
+        values: dict = None,
+        account: str = None,
+        priority: str = DeliveryScheduler.BULK,
+        deadline: float = None,
+    ) -> dict:
+        """创建广播任务, 由后台调度执行, 超过截止时间后剩余成员不再发送"""
+        now = time.time()
+        job = {
+            "sender": sender,
+            "group": group,
+            "message_id": message_id,
+            "title": title,
+            "ip": client_ip,
+            "date": time_now,
+            "template": template,
+            "values": values or {},
+            "account": account,
+            "priority": priority,
+            "deadline": deadline,
+            "status": self.RUNNING,
+            "cursor": "",
+            "total": await MySQL.read(
+                MySQL.count_group_member,
+                group,
+                account=accounts.get(account).key,
+                sticky=sender,
+                primary=conn,
+            ),
+            "sent": 0,
+            "failed": 0,
+            "muted": 0,
+            "skipped": 0,
+            "run_seconds": 0.0,
+            "owner": None,
+            "heartbeat": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        result = await self.jobs.insert(job)
+        return {
+            "job_id": result["inserted_id"],
+            "status": self.RUNNING,
+            "total": job["total"],
+            "muted": await self.mute.count(group, account),
+        }
+
+    async def get_progress(self, job_id: str) -> dict:
+        """任务进度, 包含发送速率(条/秒)和预计剩余时间(秒)"""
+        job = await self.jobs.find_one({"_id": job_id})
+        if not job:
+            raise ValueError("Job not found")
+        done = job["sent"] + job["failed"] + job.get("muted", 0) + job.get("skipped", 0)
+        rate = done / job["run_seconds"] if job["run_seconds"] > 0 else 0.0
+        remaining = max(job["total"] - done, 0)
+        return {
+            "job_id": job["_id"],
+            "group": job["group"],
+            "message_id": job["message_id"],
+            "status": job["status"],
+            "total": job["total"],
+            "sent": job["sent"],
+            "failed": job["failed"],
+            "muted": job.get("muted", 0),
+            "skipped": job.get("skipped", 0),
+            "rate": round(rate, 2),
+            "eta": round(remaining / rate, 1) if rate > 0 and job["status"] == self.RUNNING else None,
+        }
+
+    async def set_status(self, job_id: str, sender: str, status: str) -> dict:
+        """暂停/继续/取消任务, 只有发送者可以操作, 在当前批次结束后生效"""
+        allowed = {
+            self.PAUSED: [self.RUNNING],
+            self.RUNNING: [self.PAUSED],
+            self.CANCELLED: [self.RUNNING, self.PAUSED],
+        }
+        job = await self.jobs.find_one_and_update(
+            {"_id": job_id, "sender": sender, "status": {"$in": allowed[status]}},
+            {"$set": {"status": status, "updated_at": time.time()}},
+        )
+        if not job:
+            raise ValueError("Job not found or status cannot be changed")
+        return await self.get_progress(job_id)
+
+    async def _run(self):
+        while True:
+            try:
+                while len(self._running) < settings.broadcast_concurrency:
+                    job = await self._claim()
+                    if not job:
+                        break
+                    self._running[job["_id"]] = asyncio.create_task(self._execute(job))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"广播任务调度失败: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _claim(self):
+        """认领一个无人执行或心跳超时的任务"""
+        now = time.time()
+        return await self.jobs.find_one_and_update(
+            {
+                "status": self.RUNNING,
+                "$or": [
+                    {"owner": None},
+                    {"heartbeat": {"$lt": now - settings.broadcast_heartbeat_timeout}},
+                ],
+            },
+            {"$set": {"owner": self.worker_id, "heartbeat": now}},
+        )
+
+    async def _release(self, job_id: str):
+        """释放本进程持有的任务"""
+        await self.jobs.find_one_and_update(
+            {"_id": job_id, "owner": self.worker_id}, {"$set": {"owner": None}}
+        )
+
+    async def _publish_finished(self, job: dict):
+        """任务结束时推送消息状态, 暂停不推送"""
+        counts = {
+            "job_id": job["_id"],
+            "sent": job["sent"],
+            "failed": job["failed"],
+            "muted": job.get("muted", 0),
+            "skipped": job.get("skipped", 0),
+        }
+        if job["status"] == self.DONE:
+            await self.status.publish(
+                job["message_id"], job["sender"], StatusHub.SENT, **counts
+            )
+        elif job["status"] in (self.CANCELLED, self.EXPIRED):
+            await self.status.publish(
+                job["message_id"], job["sender"], StatusHub.FAILED, error=job["status"], **counts
+            )
+
+    async def _execute(self, job: dict):
+        # 延迟导入, 避免与 MessageService 的依赖形成循环
+        from app.services.message import MessageService
+
+        job_id = job["_id"]
+        self.logger.info(f"开始执行广播任务 {job_id}, 游标: {job['cursor'] or '起点'}")
+        try:
+            account = accounts.get(job.get("account"))
+            # 消息只序列化一次, 每个成员只替换 touser
+            prepared = templates.get(job["template"]).prepare(
+                settings.main_path + "/weixin_msg/" + job["message_id"],
+                job["values"],
+                account,
+            )
+            while True:
+                if job.get("deadline") and time.time() > job["deadline"]:
+                    await self.jobs.find_one_and_update(
+                        {"_id": job_id, "owner": self.worker_id, "status": self.RUNNING},
+                        {"$set": {"status": self.EXPIRED, "updated_at": time.time()}},
+                    )
+                    self.logger.info(f"广播任务 {job_id} 已超过截止时间")
+                    await self._publish_finished({**job, "status": self.EXPIRED})
+                    await self._release(job_id)
+                    return
+                started = time.perf_counter()
+                # 连接只用于读取成员, 发送期间不占用共享连接
+                conn = await self.admission.get_worker_connection()
+                try:
+                    # 成员分页读取副本, 发送者刚修改过成员时读取主库
+                    members = await MySQL.read(
+                        MySQL.get_group_member_page,
+                        job["sender"],
+                        job["group"],
+                        after=job["cursor"],
+                        limit=settings.broadcast_batch_size,
+                        account=account.key,
+                        sticky=job["sender"],
+                        primary=conn,
+                    )
+                finally:
+                    await self.admission.release_worker_connection(conn)
+                # 一次往返过滤整批成员中的免打扰用户
+                recipients, muted = await self.mute.filter(
+                    job["group"], members, account.key
+                )
+                recipients, skipped = await self.undeliverable.filter(
+                    account.key, recipients
+                )
+                # 逐个发送不访问 MySQL
+                service = MessageService(
+                    mysql_conn=None,
+                    mongodb=MongoDB(client=self.mongodb_client),
+                    mp=self.mp,
+                    coalescer=self.coalescer,
+                    broadcast=self,
+                    tag_sync=None,
+                    delivery=self.delivery,
+                    status=self.status,
+                    search=None,
+                    archive=None,
+                    mute=self.mute,
+                    undeliverable=self.undeliverable,
+                    stats=self.stats,
+                    streams=self.streams,
+                )
+                window = await self.coalescer.get_window(job["sender"])
+                results = await asyncio.gather(
+                    *[
+                        service._send_single_message(
+                            member,
+                            job["title"],
+                            job["ip"],
+                            job["date"],
+                            job["message_id"],
+                            window,
+                            template=job["template"],
+                            prepared=prepared,
+                            account=job.get("account"),
+                            priority=job.get("priority", DeliveryScheduler.BULK),
+                            deadline=job.get("deadline"),
+                            group=job["group"],
+                        )
+                        for member in recipients
+                    ],
+                    return_exceptions=True,
+                )
+
+                failed = sum(
+                    1
+                    for result in results
+                    if isinstance(result, BaseException) or result.get("errcode", 0) != 0
+                )
+                # 检查点: 只有任务仍由本进程持有时才更新
+                update = {
+                    "$set": {
+                        "cursor": members[-1] if members else job["cursor"],
+                        "heartbeat": time.time(),
+                        "updated_at": time.time(),
+                    },
+                    "$inc": {
+                        "sent": len(recipients) - failed,
+                        "failed": failed,
+                        "muted": muted,
+                        "skipped": skipped,
+                        "run_seconds": time.perf_counter() - started,
+                    },
+                }
+                job = await self.jobs.find_one_and_update(
+                    {"_id": job_id, "owner": self.worker_id}, update
+                )
+                if not job:
+                    self.logger.warning(f"广播任务 {job_id} 已被其他进程接管")
+                    return
+                if job["status"] == self.RUNNING and len(members) < settings.broadcast_batch_size:
+                    # 最后一批发送期间被暂停或取消的任务保持原状态
+                    job = await self.jobs.find_one_and_update(
+                        {"_id": job_id, "owner": self.worker_id, "status": self.RUNNING},
+                        {"$set": {"status": self.DONE, "updated_at": time.time()}},
+                    ) or await self.jobs.find_one({"_id": job_id})
+                    if not job or job["owner"] != self.worker_id:
+                        return
+                if job["status"] != self.RUNNING:
+                    self.logger.info(f"广播任务 {job_id} 状态: {job['status']}")
+                    await self._publish_finished(job)
+                    await self._release(job_id)
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 释放任务, 稍后重新认领并从游标处继续
+            self.logger.error(f"广播任务 {job_id} 执行失败: {e}")
+            await self._release(job_id)
+        finally:
+            self._running.pop(job_id, None)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# app/services/coalesce.py
+
+import json
+import time
+import asyncio
+from datetime import datetime
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mongo import MongoDB
+from app.database.redis import Redis
+from app.services.mp import MPUtils
+from app.services.account import accounts
+from app.services.template import templates, PreparedMessage
+from app.services.delivery import DeliveryScheduler
+from app.services.status import StatusHub
+from app.services.stats import SendStats
+from app.services.undeliverable import UndeliverableCache
+from app.services.stream import StreamDelivery
+
+
+class Coalescer:
+    """
+    按接收者合并消息
+    同一接收者在合并窗口内收到的多条消息会合并成一条摘要模板消息发送,
+    摘要链接打开后列出窗口内的全部消息。窗口按发送者配置, 0 表示不合并。
+    待发送消息保存在 Redis 中, 到期时间记录在有序集合里, 多个进程同时运行时
+    通过 Lua 脚本原子认领到期的接收者, 保证每个接收者只会被一个进程发送。
+    认领后消息移入处理中列表, 发送完成才删除; 发送异常或进程中断时
+    在 coalesce_retry_delay 秒后重新认领并发送, 消息不会丢失。
+    """
+
+    logger = LOG().logger
+
+    PENDING_KEY = "coalesce:pending:"  # 接收者待合并的消息列表
+    PROCESSING_KEY = "coalesce:processing:"  # 已认领、尚未发送完成的消息列表
+    DUE_KEY = "coalesce:due"  # 接收者 -> 发送时间 的有序集合
+    WINDOW_KEY = "coalesce:window:"  # 发送者的合并窗口(秒)
+    STATS_KEY = "coalesce:stats"  # received: 收到的消息数, sent: 实际调用接口数
+
+    def __init__(
+        self,
+        redis: Redis,
+        mongodb: MongoDB,
+        mp: MPUtils,
+        delivery: DeliveryScheduler,
+        status: StatusHub,
+        stats: SendStats,
+        undeliverable: UndeliverableCache,
+        streams: StreamDelivery,
+        poll_interval: float = 0.5,
+    ):
+        self.redis = redis
+        self.mongodb = mongodb
+        self.mp = mp
+        self.delivery = delivery
+        self.status = status
+        self.stats = stats
+        self.undeliverable = undeliverable
+        self.streams = streams
+        self.poll_interval = poll_interval
+        self._task = None
+
+    async def start(self):
+        """启动后台发送任务 (需在 FastAPI 启动事件中调用)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台发送任务 (需在 FastAPI 关闭事件中调用)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def get_window(self, sender: str) -> int:
+        """获取发送者的合并窗口, 未单独配置时使用默认值"""
+        window = await self.redis.get_cached(self.WINDOW_KEY + sender)
+        if window is None:
+            return settings.coalesce_window
+        return int(window)
+
+    async def set_window(self, sender: str, window: int) -> int:
+        """设置发送者的合并窗口, 0 表示关闭合并"""
+        window = max(0, min(int(window), settings.coalesce_max_window))
+        if window:
+            await self.redis.set(self.WINDOW_KEY + sender, window)
+        else:
+            await self.redis.delete(self.WINDOW_KEY + sender)
+        return window
+
+    async def enqueue(self, openid: str, message: dict, window: int) -> dict:
+        """
+        将消息加入接收者的合并队列
+        Args:
+            openid: 接收者的openid
+            message: 消息摘要, 包含 id/title/ip/date/template/account/deadline,
+                     message 为预序列化的消息(PreparedMessage.suffix), 只有一条时直接发送,
+                     包含 sender 时发送后推送消息状态
+            window: 合并窗口(秒)
+        Returns:
+            与模板消息接口相同结构的结果
+        """
+        pipe = await self.redis.pipeline()
+        pipe.rpush(self.PENDING_KEY + openid, json.dumps(message))
+        # nx: 窗口从第一条消息开始计算, 后续消息不会推迟发送
+        pipe.zadd(self.DUE_KEY, {openid: time.time() + window}, nx=True)
+        pipe.hincrby(self.STATS_KEY, "received", 1)
+        await pipe.execute()
+        return {"errcode": 0, "errmsg": "coalesced", "window": window}
+
+    async def get_stats(self) -> dict:
+        """合并统计, saved 为节省的微信接口调用次数"""
+        stats = await self.redis.hgetall(self.STATS_KEY)
+        received = int(stats.get("received", 0))
+        sent = int(stats.get("sent", 0))
+        return {"received": received, "sent": sent, "saved": received - sent}
+
+    async def _run(self):
+        while True:
+            try:
+                # 原子认领到期的接收者, 每个接收者只会被一个进程发送
+                due = await self.redis.run_script(
+                    "claim_due", keys=[self.DUE_KEY], args=[time.time(), 100]
+                )
+                for openid in due:
+                    try:
+                        await self._flush(openid)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        # 消息保留在处理中列表, 到重试时间后重新发送
+                        self.logger.error(f"向 {openid} 发送合并消息失败, 稍后重试: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"合并消息发送失败: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _flush(self, openid: str):
+        """发送接收者窗口内的全部消息, 包括上次未发送完成的消息"""
+        keys = [self.PENDING_KEY + openid, self.PROCESSING_KEY + openid, self.DUE_KEY]
+        items = await self.redis.run_script(
+            "claim_pending",
+            keys=keys,
+            args=[openid, time.time() + settings.coalesce_retry_delay],
+        )
+        messages = [json.loads(item) for item in items]
+        if not messages:
+            await self.redis.run_script("ack_pending", keys=keys, args=[openid])
+            return
+
+        account = messages[-1].get("account")
+        account_key = accounts.get(account).key
+        # 合并期间被记为无法送达的用户不再调用接口
+        if not (await self.undeliverable.filter(account_key, [openid]))[0]:
+            await self.redis.run_script("ack_pending", keys=keys, args=[openid])
+            self.logger.info(f"{openid} 无法送达, 跳过合并消息 {len(messages)} 条")
+            await self._record_status(messages, {**UndeliverableCache.SKIPPED, "skipped": 1})
+            return
+
+        prepared = None
+        template = None  # 摘要使用默认模板
+        if len(messages) == 1:
+            message = messages[0]
+            title = message["title"]
+            template = message.get("template")
+            date = message["date"]
+            redirect_url = settings.main_path + "/weixin_msg/" + message["id"]
+            if message.get("message"):
+                # 入队时已预序列化, 保留自定义模板的全部字段
+                prepared = PreparedMessage.from_suffix(message["message"])
+        else:
+            title = f"您有{len(messages)}条新消息"
+            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            digest = await self.mongodb.insert(
+                {
+                    "openid": openid,
+                    "title": title,
+                    "digest": [message["id"] for message in messages],
+                    "date": date,
+                }
+            )
+            redirect_url = settings.main_path + "/digest/" + digest["inserted_id"]
+        if prepared is None:
+            prepared = templates.get(template).prepare(
+                redirect_url,
+                {"title": title, "ip": messages[-1]["ip"], "date": date},
+                accounts.get(account),
+            )
+
+        # 全部消息都设置了截止时间时, 以最晚的截止时间为准
+        deadlines = [message.get("deadline") for message in messages]
+        deadline = max(deadlines) if None not in deadlines else None
+        if self.streams.enabled:
+            # stream 模式下与接收者的其他消息一起按顺序发送, 结果由持有分区的节点记录
+            await self.streams.enqueue(
+                openid,
+                prepared,
+                account=account,
+                deadline=deadline,
+                notify=self._senders(messages),
+            )
+            await self.redis.run_script("ack_pending", keys=keys, args=[openid])
+            await self.redis.hincrby(self.STATS_KEY, "sent", 1)
+            self.logger.info(f"向 {openid} 的合并消息 {len(messages)} 条已写入发送分区")
+            return
+
+        result = await self.delivery.submit(
+            lambda: self.mp.send_prepared(openid, prepared, account=account),
+            DeliveryScheduler.NORMAL,
+            deadline,
+        )
+        await self.redis.run_script("ack_pending", keys=keys, args=[openid])
+        await self.redis.hincrby(self.STATS_KEY, "sent", 1)
+        await self.stats.record(openid, result)
+        await self.undeliverable.record(account_key, openid, result)
+        self.logger.info(f"向 {openid} 发送合并消息 {len(messages)} 条: {result}")
+        await self._record_status(messages, result)
+
+    @staticmethod
+    def _senders(messages: list) -> dict:
+        """发送者 -> 消息ID列表"""
+        senders = {}
+        for message in messages:
+            if message.get("sender"):
+                senders.setdefault(message["sender"], []).append(message["id"])
+        return senders
+
+    async def _record_status(self, messages: list, result: dict):
+        """按发送者推送合并消息的发送结果"""
+        for sender, message_ids in self._senders(messages).items():
+            await self.status.record_result(message_ids, sender, result)
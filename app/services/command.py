@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# app/services/command.py
+
+import re
+from typing import Callable, List, NamedTuple, Optional
+
+
+class Argument(NamedTuple):
+    name: str
+    pattern: Optional[re.Pattern] = None  # 预编译的校验正则
+    error: str = ""  # 校验失败时的回复
+    many: bool = False  # 最后一个参数可接收多个值, 传给处理方法的是列表
+
+
+class Command(NamedTuple):
+    path: tuple  # 命令路径, 如 ("/group", "create")
+    handler: Callable  # 处理方法, 签名为 handler(service, openid, *args)
+    args: List[Argument]
+    help: str
+    ok: str  # 处理方法返回 True 时的回复模板, 可使用参数名占位
+    fail: str  # 处理方法返回 False 时的回复模板
+    usage: str
+
+
+class CommandRouter:
+    """
+    公众号命令路由
+    命令及子命令在导入时注册一次, 分发时按 (命令, 子命令) 查表,
+    参数校验使用预编译的正则, 处理结果统一格式化为文本回复。
+    帮助等静态回复的 XML Content 片段预先渲染, 动态回复每次渲染, 不做缓存。
+    """
+
+    UNKNOWN = "未知指令，请输入/help查看帮助"
+
+    def __init__(self):
+        self._commands = {}
+        self._help = {}  # 命令组 -> 帮助文本
+        self._rendered = {}  # 静态回复 -> Content 片段
+        self.prerender(self.UNKNOWN)
+
+    def register(
+        self,
+        path: str,
+        args: List[Argument] = (),
+        help: str = "",
+        ok: str = "",
+        fail: str = "",
+    ):
+        """注册命令的装饰器, path 如 "/group create" """
+
+        def decorator(handler):
+            parts = tuple(path.split())
+            usage = " ".join(
+                parts
+                + tuple(f"<{arg.name}...>" if arg.many else f"<{arg.name}>" for arg in args)
+            )
+            self._commands[parts] = Command(
+                parts, handler, list(args), help, ok, fail, usage
+            )
+            self._help.clear()
+            return handler
+
+        return decorator
+
+    def help(self, prefix: tuple = ()) -> str:
+        """生成命令帮助文本, prefix 为空时列出顶层命令"""
+        if prefix not in self._help:
+            lines = []
+            for parts, command in self._commands.items():
+                if parts[: len(prefix)] != prefix or len(parts) != len(prefix) + 1:
+                    continue
+                lines.append(f"{command.usage} - {command.help}")
+            self._help[prefix] = "\n".join(lines)
+            self.prerender(self._help[prefix])
+        return self._help[prefix]
+
+    def prerender(self, *replies: str):
+        """预先渲染静态回复的 Content 片段"""
+        for reply in replies:
+            self._rendered[reply] = render_content(reply)
+
+    def render(self, content: str) -> str:
+        """生成回复的 Content 片段, 静态回复直接使用预先渲染的结果"""
+        fragment = self._rendered.get(content)
+        return fragment if fragment is not None else render_content(content)
+
+    def resolve(self, content: str):
+        """
+        查找命令并解析参数
+        Returns:
+            (command, args): 未找到命令时 command 为 None
+        """
+        tokens = content.split()
+        # 优先匹配子命令
+        for size in (2, 1):
+            command = self._commands.get(tuple(tokens[:size]))
+            if command:
+                return command, tokens[size:]
+        return None, tokens
+
+    async def dispatch(self, service, openid: str, content: str) -> str:
+        """分发命令并格式化回复"""
+        command, args = self.resolve(content)
+        if command is None:
+            return self.UNKNOWN
+
+        if len(args) < len(command.args):
+            return f"用法: {command.usage}"
+        values = {}
+        for i, arg in enumerate(command.args):
+            value = args[i:] if arg.many else [args[i]]
+            for item in value:
+                if arg.pattern and not arg.pattern.fullmatch(item):
+                    return arg.error or f"参数 {arg.name} 格式错误"
+            values[arg.name] = value if arg.many else value[0]
+
+        result = await command.handler(service, openid, *values.values())
+        if isinstance(result, bool):
+            return (command.ok if result else command.fail).format(**values)
+        return result
+
+
+def render_content(content: str) -> str:
+    """生成 XML 回复中的 Content 片段"""
+    # CDATA 中不能出现 "]]>", 需要拆分为两段
+    escaped = content.replace("]]>", "]]]]><![CDATA[>")
+    return f"<Content><![CDATA[{escaped}]]></Content>"
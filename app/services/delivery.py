@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# app/services/delivery.py
+
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable
+from app.core.logger import LOG
+from app.core.config import settings
+
+
+class DeliveryScheduler:
+    """
+    按优先级调度微信接口调用
+    消息进入 critical/normal/bulk 三个队列, 固定数量的发送协程按权重轮流从
+    非空队列中取出消息(平滑加权轮询), 紧急消息优先发送, 批量消息仍能按比例得到发送机会。
+    超过截止时间(unix 时间戳)的消息直接丢弃, 不再延迟发送。
+    """
+
+    logger = LOG().logger
+
+    CRITICAL = "critical"
+    NORMAL = "normal"
+    BULK = "bulk"
+    LANES = {CRITICAL: 8, NORMAL: 4, BULK: 1}  # 队列 -> 权重
+
+    # 排队等待时间直方图的分桶上限(秒)
+    BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    EXPIRED = {"errcode": -1, "errmsg": "deadline exceeded"}
+
+    def __init__(self, concurrency: int = None):
+        self.concurrency = concurrency or settings.delivery_concurrency
+        self._queues = {lane: deque() for lane in self.LANES}
+        self._credits = {lane: 0 for lane in self.LANES}
+        self._stats = {
+            lane: {"sent": 0, "dropped": 0, "waits": [0] * (len(self.BUCKETS) + 1)}
+            for lane in self.LANES
+        }
+        self._wakeup = asyncio.Event()
+        self._workers = []
+
+    @classmethod
+    def check_priority(cls, priority: str) -> str:
+        """校验优先级, 返回队列名称"""
+        if priority not in cls.LANES:
+            raise ValueError(f"优先级 {priority} 不存在, 可选: {', '.join(cls.LANES)}")
+        return priority
+
+    async def start(self):
+        """启动发送协程 (需在 FastAPI 启动事件中调用)"""
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+            ]
+
+    async def stop(self):
+        """停止发送协程, 队列中未发送的消息返回失败"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for queue in self._queues.values():
+            while queue:
+                future = queue.popleft()[3]
+                if not future.done():
+                    future.set_result({"errcode": -1, "errmsg": "scheduler stopped"})
+
+    async def submit(
+        self,
+        send: Callable[[], Awaitable[dict]],
+        priority: str = NORMAL,
+        deadline: float = None,
+    ) -> dict:
+        """
+        加入发送队列并等待发送结果
+        Args:
+            send: 调用微信接口的协程函数
+            priority: 优先级 critical/normal/bulk
+            deadline: 截止时间(unix 时间戳), 超过后不再发送
+        Returns:
+            微信接口的返回结果, 超过截止时间时为 EXPIRED
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queues[self.check_priority(priority)].append(
+            (time.monotonic(), deadline, send, future)
+        )
+        self._wakeup.set()
+        return await future
+
+    def depth(self) -> int:
+        """全部队列中等待发送的消息数量"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def get_stats(self) -> dict:
+        """各队列的深度、发送/丢弃数量和排队等待时间直方图(本进程)"""
+        labels = [f"le_{bucket}" for bucket in self.BUCKETS] + ["inf"]
+        return {
+            lane: {
+                "depth": len(self._queues[lane]),
+                "sent": stats["sent"],
+                "dropped": stats["dropped"],
+                "wait_seconds": dict(zip(labels, stats["waits"])),
+            }
+            for lane, stats in self._stats.items()
+        }
+
+    def _next_lane(self):
+        """平滑加权轮询选择下一个非空队列"""
+        selected, total = None, 0
+        for lane, weight in self.LANES.items():
+            if not self._queues[lane]:
+                continue
+            self._credits[lane] += weight
+            total += weight
+            if selected is None or self._credits[lane] > self._credits[selected]:
+                selected = lane
+        if selected is not None:
+            self._credits[selected] -= total
+        return selected
+
+    def _observe_wait(self, lane: str, wait: float):
+        waits = self._stats[lane]["waits"]
+        for i, bucket in enumerate(self.BUCKETS):
+            if wait <= bucket:
+                waits[i] += 1
+                return
+        waits[-1] += 1
+
+    async def _worker(self):
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            enqueued, deadline, send, future = self._queues[lane].popleft()
+            if future.done():
+                # 调用方已取消
+                continue
+            self._observe_wait(lane, time.monotonic() - enqueued)
+            if deadline is not None and time.time() > deadline:
+                self._stats[lane]["dropped"] += 1
+                future.set_result(dict(self.EXPIRED))
+                continue
+
+            try:
+                result = await send()
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self._stats[lane]["sent"] += 1
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+# app/services/follower.py
+
+import os
+import time
+import socket
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mysql import MySQL
+from app.database.mongo import MongoDB
+from app.database.redis import Redis
+from app.services.mp import MPUtils
+from app.services.account import accounts
+from app.services.admission import AdmissionController
+
+
+class FollowerSync:
+    """
+    关注者全量同步任务
+    第一阶段逐页拉取关注者列表(每页最多 10000 个), 按块与 users 表比对,
+    只写入新增或重新关注的用户, 已处理的 openid 记录在 Redis 集合中;
+    第二阶段按 openid 顺序遍历 users 表中已关注的用户, 不在集合中且在任务创建后
+    没有更新过的标记为取消关注, 同步期间新关注的用户不受影响。集合在
+    sync_seen_ttl 内未完成同步会过期, 此时任务失败, 不会把全部用户标记为取消关注。
+    每页/每块结束后记录检查点, 进程重启后从检查点继续, 内存占用与关注者总数无关。
+    每个公众号单独同步, 只处理该公众号的用户。
+    """
+
+    logger = LOG().logger
+
+    # 任务状态与阶段
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    FOLLOWERS = "followers"
+    UNSUBSCRIBE = "unsubscribe"
+
+    SEEN_KEY = "follower_sync:seen:"  # 本次同步中出现过的关注者
+
+    def __init__(
+        self,
+        mongodb_client: AsyncIOMotorClient,
+        redis: Redis,
+        mp: MPUtils,
+        admission: AdmissionController,
+        poll_interval: float = 5.0,
+    ):
+        self.jobs = MongoDB(client=mongodb_client, collection=settings.mongo_sync_collection)
+        self.redis = redis
+        self.mp = mp
+        self.admission = admission
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._task = None
+
+    async def start(self):
+        """启动任务调度, 接管中断的同步任务 (需在 FastAPI 启动事件中调用)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止任务调度, 正在执行的任务在心跳超时后由其他进程接管"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def create_job(self, account: str = None) -> dict:
+        """
+        创建同步任务, 同一公众号同一时间只允许一个任务运行
+        Raises:
+            ValueError: 公众号不存在
+        """
+        account = accounts.get(account).key
+        running = await self.jobs.find_one({"status": self.RUNNING, "account": account})
+        if running:
+            return {"job_id": running["_id"], "status": self.RUNNING}
+        now = time.time()
+        result = await self.jobs.insert(
+            {
+                "account": account,
+                "status": self.RUNNING,
+                "phase": self.FOLLOWERS,
+                "next_openid": "",
+                "mysql_cursor": "",
+                "followers": 0,
+                "inserted": 0,
+                "resubscribed": 0,
+                "unsubscribed": 0,
+                "rows": 0,
+                "run_seconds": 0.0,
+                "owner": None,
+                "heartbeat": 0,
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+        return {"job_id": result["inserted_id"], "status": self.RUNNING}
+
+    async def get_progress(self, job_id: str) -> dict:
+        """任务进度, rate 为每秒处理的行数"""
+        job = await self.jobs.find_one({"_id": job_id})
+        if not job:
+            raise ValueError("Job not found")
+        rate = job["rows"] / job["run_seconds"] if job["run_seconds"] > 0 else 0.0
+        return {
+            "job_id": job["_id"],
+            "account": job.get("account", MySQL.DEFAULT_ACCOUNT),
+            "status": job["status"],
+            "phase": job["phase"],
+            "followers": job["followers"],
+            "inserted": job["inserted"],
+            "resubscribed": job["resubscribed"],
+            "unsubscribed": job["unsubscribed"],
+            "rate": round(rate, 2),
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                job = await self.jobs.find_one_and_update(
+                    {
+                        "status": self.RUNNING,
+                        "$or": [
+                            {"owner": None},
+                            {"heartbeat": {"$lt": time.time() - settings.broadcast_heartbeat_timeout}},
+                        ],
+                    },
+                    {"$set": {"owner": self.worker_id, "heartbeat": time.time()}},
+                )
+                if job:
+                    await self._execute(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"关注者同步任务调度失败: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _checkpoint(self, job_id: str, fields: dict, counters: dict) -> dict:
+        """记录检查点, 任务已被其他进程接管时返回 None"""
+        fields.update({"heartbeat": time.time(), "updated_at": time.time()})
+        return await self.jobs.find_one_and_update(
+            {"_id": job_id, "owner": self.worker_id},
+            {"$set": fields, "$inc": counters},
+        )
+
+    async def _execute(self, job: dict):
+        job_id = job["_id"]
+        seen_key = self.SEEN_KEY + job_id
+        account = job.get("account", MySQL.DEFAULT_ACCOUNT)  # 多公众号前创建的任务属于默认公众号
+        chunk_size = settings.sync_chunk_size
+        self.logger.info(f"开始关注者同步任务 {job_id}, 阶段: {job['phase']}")
+        try:
+            if job["phase"] == self.FOLLOWERS:
+                async for openids, next_openid in self.mp.iter_followers(
+                    job["next_openid"], account=account
+                ):
+                    started = time.perf_counter()
+                    inserted = resubscribed = 0
+                    conn = await self.admission.get_worker_connection()
+                    try:
+                        for i in range(0, len(openids), chunk_size):
+                            chunk = openids[i : i + chunk_size]
+                            existing = await MySQL.get_subscription(conn, chunk, account=account)
+                            changes = [
+                                (account, openid, None, 1)
+                                for openid in chunk
+                                if existing.get(openid) != 1
+                            ]
+                            await MySQL.upsert_users(conn, changes)
+                            inserted += sum(1 for openid in chunk if openid not in existing)
+                            resubscribed += sum(1 for openid in chunk if existing.get(openid) == 0)
+                            await self.redis.sadd(seen_key, *chunk)
+                    finally:
+                        await self.admission.release_worker_connection(conn)
+                    await self.redis.expire(seen_key, settings.sync_seen_ttl)
+                    job = await self._checkpoint(
+                        job_id,
+                        {"next_openid": next_openid},
+                        {
+                            "followers": len(openids),
+                            "inserted": inserted,
+                            "resubscribed": resubscribed,
+                            "rows": len(openids),
+                            "run_seconds": time.perf_counter() - started,
+                        },
+                    )
+                    if not job:
+                        return
+                job = await self._checkpoint(job_id, {"phase": self.UNSUBSCRIBE}, {})
+                if not job:
+                    return
+
+            # 第二阶段: 标记不在关注者列表中的用户为取消关注
+            cursor = job["mysql_cursor"]
+            while True:
+                started = time.perf_counter()
+                conn = await self.admission.get_worker_connection()
+                try:
+                    openids = await MySQL.get_subscribed_page(
+                        conn, after=cursor, limit=chunk_size, account=account
+                    )
+                    if not openids:
+                        break
+                    if job["followers"] and not await self.redis.expire(
+                        seen_key, settings.sync_seen_ttl
+                    ):
+                        # 集合已过期, 继续执行会把全部用户标记为取消关注
+                        self.logger.error(f"关注者同步任务 {job_id} 的已处理集合不存在")
+                        await self._checkpoint(
+                            job_id,
+                            {"status": self.FAILED, "owner": None, "error": "seen set missing"},
+                            {},
+                        )
+                        return
+                    seen = await self.redis.smismember(seen_key, openids)
+                    gone = [openid for openid, flag in zip(openids, seen) if not flag]
+                    await MySQL.set_unsubscribed(
+                        conn, gone, before=job["created_at"], account=account
+                    )
+                finally:
+                    await self.admission.release_worker_connection(conn)
+                cursor = openids[-1]
+                job = await self._checkpoint(
+                    job_id,
+                    {"mysql_cursor": cursor},
+                    {
+                        "unsubscribed": len(gone),
+                        "rows": len(openids),
+                        "run_seconds": time.perf_counter() - started,
+                    },
+                )
+                if not job:
+                    return
+
+            await self.redis.delete(seen_key)
+            await self._checkpoint(job_id, {"status": self.DONE, "owner": None}, {})
+            self.logger.info(f"关注者同步任务 {job_id} 完成")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 释放任务, 稍后从检查点重试
+            self.logger.error(f"关注者同步任务 {job_id} 失败: {e}")
+            await self._checkpoint(job_id, {"owner": None, "error": str(e)}, {})
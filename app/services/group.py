@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# app/services/group.py
+
+from fastapi import Depends
+from aiomysql import Connection
+from app.core.config import settings
+from app.core.logger import LOG
+from app.core.dependencies import get_api_mysql, get_tag_sync, get_mute
+from app.database.mysql import MySQL
+from app.services.tag import TagSync
+from app.services.mute import GroupMute
+
+
+class GroupService:
+    """群组成员批量管理, 供接口和公众号命令 /group add、/group remove 使用"""
+
+    logger = LOG().logger
+
+    def __init__(
+        self,
+        mysql_conn: Connection = Depends(get_api_mysql),
+        tag_sync: TagSync = Depends(get_tag_sync),
+        mute: GroupMute = Depends(get_mute),
+    ):
+        self.mysql_conn = mysql_conn
+        self.tag_sync = tag_sync
+        self.mute = mute
+
+    async def update_members(
+        self,
+        owner: str,
+        group: str,
+        add: list = (),
+        remove: list = (),
+        account: str = MySQL.DEFAULT_ACCOUNT,
+    ) -> dict:
+        """
+        批量添加/移除群组成员, 在一个事务中完成, 只能添加群组所属公众号的用户
+        Returns:
+            dict: added/skipped/removed 数量
+        Raises:
+            ValueError: 群组不存在或不是群主
+        """
+        result = await MySQL.update_group_members(
+            self.mysql_conn,
+            owner,
+            group,
+            add=add,
+            remove=remove,
+            chunk_size=settings.group_member_chunk_size,
+            account=account,
+        )
+        if result is None:
+            raise ValueError("Group not found or not owner")
+
+        # 同时出现在两个列表中的用户最终被移除
+        left = list(dict.fromkeys(remove))
+        removed = set(left)
+        joined = [openid for openid in dict.fromkeys(add) if openid not in removed]
+        if result["skipped"] and joined:
+            # 未注册的用户没有写入, 不能打标签
+            joined = await MySQL.filter_group_members(
+                self.mysql_conn,
+                group,
+                joined,
+                settings.group_member_chunk_size,
+                account=account,
+            )
+        # 群组标签只镜像到默认公众号
+        if account == MySQL.DEFAULT_ACCOUNT:
+            await self.tag_sync.track_many(group, joined, joined=True)
+            await self.tag_sync.track_many(group, left, joined=False)
+        await self.mute.remove(group, left, account)
+        return result
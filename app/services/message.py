@@ -3,24 +3,110 @@
 
 from fastapi import Depends
 from datetime import datetime
+from bson.objectid import ObjectId
 from aiomysql import Connection
 from app.database.mysql import MySQL
 from app.database.mongo import MongoDB
 from app.services.mp import MPUtils
+from app.services.coalesce import Coalescer
+from app.services.broadcast import BroadcastRunner
+from app.services.tag import TagSync
+from app.services.template import templates, PreparedMessage
+from app.services.account import accounts
+from app.services.delivery import DeliveryScheduler
+from app.services.status import StatusHub
+from app.services.search import MessageSearch
+from app.services.archive import MessageArchive
+from app.services.mute import GroupMute
+from app.services.undeliverable import UndeliverableCache
+from app.services.stats import SendStats
+from app.services.stream import StreamDelivery
+from app.services.page import render_message_page, page_etag
 from app.core.config import settings
-from app.core.dependencies import get_mysql, get_mongodb, get_mp
+from app.core.dependencies import (
+    get_api_mysql,
+    get_mongodb,
+    get_mp,
+    get_coalescer,
+    get_broadcast,
+    get_tag_sync,
+    get_delivery,
+    get_status,
+    get_search,
+    get_archive,
+    get_mute,
+    get_undeliverable,
+    get_send_stats,
+    get_streams,
+)
+
+
+def iter_export_messages(
+    mongodb: MongoDB,
+    openid: str = None,
+    start: str = None,
+    end: str = None,
+    batch_size: int = 1000,
+):
+    """
+    按 _id 顺序逐批导出消息, 不含页面 HTML, 不包含已归档的消息
+    只访问 MongoDB, 不依赖 MessageService, 导出时不占用 MySQL 连接
+    Args:
+        openid: 接收者的openid
+        start/end: 发送时间范围, 格式 YYYY-MM-DD HH:MM:SS (包含边界)
+    Returns:
+        消息的异步迭代器
+    """
+    query = {"content": {"$exists": True}}
+    if openid:
+        query["openid"] = openid
+    if start or end:
+        # date 字段为定长字符串, 字典序与时间顺序一致
+        query["date"] = {}
+        if start:
+            query["date"]["$gte"] = start
+        if end:
+            query["date"]["$lte"] = end
+    return mongodb.iter_find(
+        query,
+        projection={"html": 0, "etag": 0},
+        sort=[("_id", 1)],
+        batch_size=batch_size,
+    )
 
 
 class MessageService:
     def __init__(
         self,
-        mysql_conn: Connection = Depends(get_mysql),
+        mysql_conn: Connection = Depends(get_api_mysql),
         mongodb: MongoDB = Depends(get_mongodb),
         mp: MPUtils = Depends(get_mp),
+        coalescer: Coalescer = Depends(get_coalescer),
+        broadcast: BroadcastRunner = Depends(get_broadcast),
+        tag_sync: TagSync = Depends(get_tag_sync),
+        delivery: DeliveryScheduler = Depends(get_delivery),
+        status: StatusHub = Depends(get_status),
+        search: MessageSearch = Depends(get_search),
+        archive: MessageArchive = Depends(get_archive),
+        mute: GroupMute = Depends(get_mute),
+        undeliverable: UndeliverableCache = Depends(get_undeliverable),
+        stats: SendStats = Depends(get_send_stats),
+        streams: StreamDelivery = Depends(get_streams),
     ):
         self.mysql_conn = mysql_conn
         self.mongodb = mongodb
         self.mp = mp
+        self.coalescer = coalescer
+        self.broadcast = broadcast
+        self.tag_sync = tag_sync
+        self.delivery = delivery
+        self.status = status
+        self.search = search
+        self.archive = archive
+        self.mute = mute
+        self.undeliverable = undeliverable
+        self.stats = stats
+        self.streams = streams
 
     async def send_message(
         self,
@@ -29,10 +115,42 @@ class MessageService:
         title: str,
         content: str,
         group: str = None,
+        msgtype: str = "template",
+        template: str = None,
+        data: dict = None,
+        account: str = None,
+        priority: str = None,
+        deadline: float = None,
     ):
-        """核心消息发送逻辑"""
+        """
+        核心消息发送逻辑
+        msgtype 为 text 且群组成员数量达到阈值时, 使用按标签群发代替逐个发送模板消息
+        template 选择注册的模板, data 提供模板字段的额外取值
+        account 选择发送消息的公众号, 默认为 default
+        priority 为 critical/normal/bulk, 单用户默认 normal, 群组默认 bulk;
+        deadline 为截止时间(unix 时间戳), 超过后消息不再发送
+        Raises:
+            ValueError: 公众号、模板或优先级不存在, 或字段校验失败
+        """
         time_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+        # 请求时校验公众号和模板字段, 避免发送时才被微信拒绝
+        sender_account = accounts.get(account)
+        message_template = templates.get(template)
+        if priority is None:
+            priority = DeliveryScheduler.BULK if group else DeliveryScheduler.NORMAL
+        DeliveryScheduler.check_priority(priority)
+        if deadline is not None:
+            deadline = float(deadline)
+        values = {
+            **(data or {}),
+            "title": title,
+            "content": content,
+            "ip": client_ip,
+            "date": time_now,
+        }
+        message_template.render(values)
+
         # MongoDB 操作
         mongo_doc = {
             "openid": openid,
@@ -40,43 +158,108 @@ class MessageService:
             "content": content,
             "ip": client_ip,
             "date": time_now,
+            "account": sender_account.key,
         }
+        # 写入时渲染消息页面, 读取时无需再次渲染
+        mongo_doc["html"] = render_message_page(title, content, time_now)
+        mongo_doc["etag"] = page_etag(mongo_doc["html"])
         mongo_result = await self.mongodb.insert(mongo_doc)
+        message_id = mongo_result["inserted_id"]
+        await self.search.index(message_id, mongo_doc)
+        redirect_url = settings.main_path + "/weixin_msg/" + message_id
+        await self.status.publish(message_id, openid, StatusHub.QUEUED)
 
-        # 处理群组发送
+        # 处理群组发送: 创建可断点续发的广播任务, 由后台分批发送
         if group:
-            group_list = await self._get_group_members(openid, group)
-            if not group_list:
+            if not await MySQL.read(
+                MySQL.get_group_member_page,
+                openid=openid,
+                group_name=group,
+                limit=1,
+                account=sender_account.key,
+                sticky=openid,
+                primary=self.mysql_conn,
+            ):
+                await self.status.publish(
+                    message_id, openid, StatusHub.FAILED, error="nobody in group"
+                )
                 return {"msg": "nobody in group"}
 
-            results = []
-            for member_openid in group_list:
-                result = await self._send_single_message(
-                    member_openid,
-                    title,
-                    client_ip,
-                    time_now,
-                    mongo_result["inserted_id"],
-                )
-                results.append(result)
-            return {"group_results": results}
+            # 群组标签只镜像到默认公众号
+            if (
+                msgtype == "text"
+                and sender_account.key == accounts.DEFAULT
+                and await self._use_mass_send(openid, group)
+            ):
+                result = await self._mass_send(group, title, content, message_id)
+                await self.status.record_result([message_id], openid, result)
+                return result
+
+            return await self.broadcast.create_job(
+                conn=self.mysql_conn,
+                sender=openid,
+                group=group,
+                message_id=message_id,
+                title=title,
+                client_ip=client_ip,
+                time_now=time_now,
+                template=message_template.name,
+                values=values,
+                account=sender_account.key,
+                priority=priority,
+                deadline=deadline,
+            )
+
+        # 单用户发送, 已知无法送达的用户不再调用接口
+        if not (await self.undeliverable.filter(sender_account.key, [openid]))[0]:
+            result = {**UndeliverableCache.SKIPPED, "skipped": 1}
+            await self.status.record_result([message_id], openid, result)
+            return result
 
-        # 单用户发送
-        return await self._send_single_message(
+        # 发送者开启合并时消息先进入接收者的合并队列
+        window = await self.coalescer.get_window(openid)
+        result = await self._send_single_message(
             openid,
             title,
             client_ip,
             time_now,
-            mongo_result["inserted_id"],
+            message_id,
+            window,
+            template=message_template.name,
+            prepared=message_template.prepare(redirect_url, values, sender_account),
+            account=sender_account.key,
+            priority=priority,
+            deadline=deadline,
+            sender=openid,
         )
+        await self.status.record_result([message_id], openid, result)
+        return result
 
-    async def _get_group_members(self, openid: str, group: str) -> list:
-        """获取群组成员"""
-        return await MySQL.get_group_member(
-            conn=self.mysql_conn,
-            openid=openid,
-            group_name=group,
+    async def _use_mass_send(self, openid: str, group: str) -> bool:
+        """
+        判断群组是否使用按标签群发
+        成员数量达到阈值但标签尚未同步完成时, 记录待镜像的群组并本次仍逐个发送
+        """
+        if not settings.mass_send_threshold:
+            return False
+        size = await MySQL.read(
+            MySQL.count_group_member, group, sticky=openid, primary=self.mysql_conn
         )
+        if size < settings.mass_send_threshold:
+            return False
+        if await self.tag_sync.get_ready_tag(group) is not None:
+            return True
+        await self.tag_sync.request_mirror(openid, group)
+        return False
+
+    async def _mass_send(self, group: str, title: str, content: str, mongo_id: str):
+        """按群组对应的标签群发文本消息"""
+        tag_id = await self.tag_sync.get_ready_tag(group)
+        url = settings.domain + settings.main_path + "/weixin_msg/" + mongo_id
+        result = await self.mp.mass_send_text(tag_id, f"{title}\n{content}\n{url}")
+        # 免打扰成员已从标签中移除
+        muted = await self.mute.count(group)
+        return {"mode": "mass", "tag_id": tag_id, "muted": muted, **result}
 
     async def _send_single_message(
         self,
@@ -85,23 +268,100 @@ class MessageService:
         client_ip: str,
         time_now: str,
         mongo_id: str,
+        window: int = 0,
+        template: str = None,
+        prepared: PreparedMessage = None,
+        account: str = None,
+        priority: str = DeliveryScheduler.NORMAL,
+        deadline: float = None,
+        sender: str = None,
+        group: str = None,
     ):
-        """发送单个消息"""
-        redirect_url = settings.main_path + "/weixin_msg/" + mongo_id
-        return await self.mp.send_message(
-            openid=openid,
-            title=title,
-            ip=client_ip,
-            date=time_now,
-            redirect_url=redirect_url,
+        """
+        发送单个消息, 群发时传入预序列化的消息避免重复序列化
+        消息按优先级进入发送队列, 紧急消息不参与合并;
+        传入 sender 时合并发送后推送消息状态。返回永久性错误的接收者记入无法送达缓存,
+        发送结果按群组计入发送统计。stream 模式下写入接收者所在的分区后立即返回,
+        由持有分区的节点按顺序发送并记录结果
+        """
+        if window > 0 and priority != DeliveryScheduler.CRITICAL:
+            return await self.coalescer.enqueue(
+                openid,
+                {
+                    "id": mongo_id,
+                    "title": title,
+                    "ip": client_ip,
+                    "date": time_now,
+                    "template": template,
+                    "message": prepared.suffix if prepared is not None else None,
+                    "account": account,
+                    "deadline": deadline,
+                    "sender": sender,
+                },
+                window,
+            )
+        if prepared is None:
+            prepared = templates.get(template).prepare(
+                settings.main_path + "/weixin_msg/" + mongo_id,
+                {"title": title, "ip": client_ip, "date": time_now},
+                accounts.get(account),
+            )
+        if self.streams.enabled:
+            return await self.streams.enqueue(
+                openid,
+                prepared,
+                account=account,
+                priority=priority,
+                deadline=deadline,
+                message_id=mongo_id,
+                sender=sender,
+                group=group,
+            )
+        result = await self.delivery.submit(
+            lambda: self.mp.send_prepared(openid, prepared, account=account),
+            priority,
+            deadline,
         )
+        await self.undeliverable.record(accounts.get(account).key, openid, result)
+        await self.stats.record(openid, result, group)
+        return result
 
     async def get_message(self, message_id: str):
-        """消息内容查询逻辑"""
+        """消息内容查询逻辑, MongoDB 中不存在时从归档中读取"""
         doc = await self.mongodb.find_one({"_id": message_id})
+        if not doc and self.archive is not None:
+            doc = await self.archive.get(message_id)
         if not doc:
             raise ValueError("Message not found")
 
         # 敏感字段过滤
         doc.pop("openid", None)
+        doc.pop("html", None)
+        doc.pop("etag", None)
         return doc
+
+    async def get_digest(self, digest_id: str) -> dict:
+        """合并消息摘要查询逻辑, 返回摘要及其包含的全部消息"""
+        digest = await self.mongodb.find_one({"_id": digest_id})
+        if not digest and self.archive is not None:
+            digest = await self.archive.get(digest_id)
+        if not digest or "digest" not in digest:
+            raise ValueError("Digest not found")
+
+        ids = [ObjectId(message_id) for message_id in digest["digest"]]
+        messages = await self.mongodb.find({"_id": {"$in": ids}}, limit=len(ids))
+        if self.archive is not None and len(messages) < len(ids):
+            found = {message["_id"] for message in messages}
+            for message_id in digest["digest"]:
+                if message_id not in found:
+                    message = await self.archive.get(message_id)
+                    if message:
+                        messages.append(message)
+        # 保持消息到达顺序
+        order = {message_id: i for i, message_id in enumerate(digest["digest"])}
+        messages.sort(key=lambda message: order.get(message["_id"], 0))
+        for message in messages:
+            message.pop("openid", None)
+        digest.pop("openid", None)
+        digest["messages"] = messages
+        return digest
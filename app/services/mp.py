@@ -1,17 +1,45 @@
 import time
-import requests
-import threading
-from aiohttp import ClientSession
+import asyncio
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from app.core.logger import LOG
 from app.core.config import settings
-from app.database.redis_sync import Redis
+from app.database.redis import Redis
+from app.services.account import Account, accounts
+from app.services.template import templates, PreparedMessage
+
+
+class RateLimiter:
+    """令牌桶限流, rate 为每秒允许的调用次数, 0 表示不限制"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
 
 
 class MPUtils:
+    """
+    微信公众号接口
+    多个公众号共用同一个 HTTP 连接池, 每个公众号的 access_token 和限流状态
+    分别保存, 所有公众号的 access_token 由同一个后台任务刷新。
+    """
     logger = LOG(level=LOG.DEBUG).logger
     _instance = None
     _initialized = False
-    stop_event = threading.Event()
 
     def __new__(cls):
         # 如果实例不存在，则创建新实例
@@ -23,74 +51,206 @@ class MPUtils:
         if self._initialized:
             return
         self.redis_client = Redis()
-        self.access_token = (
-            self.redis_client.get("access_token")
-            if self.redis_client.exists("access_token")
-            else None
-        )
-        self.stop_event = threading.Event()  # 使用本地事件
-        self.thread_refresh_access_token = threading.Thread(
-            target=self.refresh_access_token,
-            daemon=True,
-        )
-        self.thread_refresh_access_token.start()
-        self.logger.info(f"access_token: {self.access_token}")
+        self.session = None
+        self._refresh_task = None
+        self._limiters = {}  # 公众号 -> 限流器
 
         self._initialized = True
 
-    def __del__(self):
+    async def start(self):
+        """创建共享的 HTTP 会话并启动access_token刷新任务 (需在 FastAPI 启动事件中调用)"""
+        if self.session is None:
+            self.session = ClientSession(
+                connector=TCPConnector(
+                    limit=settings.wechat_http_pool_size,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60,
+                ),
+                timeout=ClientTimeout(total=10),
+            )
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self.refresh_access_token())
+        for account in accounts.all():
+            self.logger.info(f"{account.key} access_token: {await self.get_access_token(account.key)}")
+
+    async def stop(self):
+        """停止access_token刷新任务并关闭 HTTP 会话 (需在 FastAPI 关闭事件中调用)"""
+        if self._refresh_task:
+            self.logger.info("正在停止access_token刷新任务...")
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+            self.logger.info("access_token刷新任务已停止")
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def warm_up(self):
+        """预先完成 DNS 解析和 TLS 握手, 连接保留在会话的连接池中"""
         try:
-            self.logger.info("正在停止access_token刷新线程...")
+            async with self.session.get("https://api.weixin.qq.com/") as response:
+                await response.read()
+            self.logger.info("微信接口连接预热完成")
+        except Exception as e:
+            self.logger.warning(f"微信接口连接预热失败: {e}")
 
-            # 使用事件通知线程停止
-            self.stop_event.set()
+    @staticmethod
+    def _token_key(account: Account) -> str:
+        """access_token 的 Redis 键, 默认公众号沿用原有的键"""
+        if account.key == accounts.DEFAULT:
+            return "access_token"
+        return f"access_token:{account.key}"
 
-            # 设置join超时，防止永久阻塞
-            self.thread_refresh_access_token.join(timeout=2.0)
+    async def get_access_token(self, account: str = None):
+        """读取access_token, 命中客户端缓存时无需访问Redis"""
+        return await self.redis_client.get_cached(self._token_key(accounts.get(account)))
 
-            if self.thread_refresh_access_token.is_alive():
-                self.logger.warning("线程未能在超时时间内完成，但程序会继续退出")
-            else:
-                self.logger.info("access_token刷新线程已成功停止")
-        except Exception as e:
-            self.logger.error(f"停止线程时出错: {e}")
+    async def _params(self, account: str = None) -> dict:
+        """等待公众号的限流令牌并返回接口的 access_token 参数"""
+        key = account or accounts.DEFAULT
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = self._limiters[key] = RateLimiter(settings.wechat_rate_limit)
+        await limiter.acquire()
+        return {"access_token": await self.get_access_token(account)}
 
-    def get_access_token(self) -> None:
+    async def fetch_access_token(self, account: Account = None) -> str:
+        account = account or accounts.get()
         url = "https://api.weixin.qq.com/cgi-bin/token"
         params = {
             "grant_type": "client_credential",
-            "appid": settings.appid,
-            "secret": settings.appsecret,
+            "appid": account.appid,
+            "secret": account.appsecret,
         }
-        response = requests.get(url, params=params)
-        self.access_token = response.json()["access_token"]
-
-    def refresh_access_token(self):
-        while not self.stop_event.is_set():
-            if not self.redis_client.exists("access_token_valid"):
-                self.get_access_token()
-                self.redis_client.set("access_token", self.access_token, 720)
-                self.redis_client.set("access_token_valid", 1, 700)
-                self.logger.info("刷新access_token成功")
-            else:
-                time.sleep(1)
-
-    async def send_message(self, openid, title, ip, date, redirect_url):
+        async with self.session.get(url, params=params) as response:
+            return (await response.json(content_type=None))["access_token"]
+
+    async def refresh_access_token(self):
+        """单个后台任务刷新全部公众号的access_token, 并重新加载修改过的公众号配置"""
+        while True:
+            accounts.reload()
+            for account in accounts.all():
+                key = self._token_key(account)
+                try:
+                    # 多个进程同时运行时只由取得锁的进程刷新
+                    if not await self.redis_client.exists(
+                        key + "_valid"
+                    ) and await self.redis_client.set(
+                        key + "_lock", 1, ex=30, nx=True
+                    ):
+                        access_token = await self.fetch_access_token(account)
+                        pipe = await self.redis_client.pipeline()
+                        pipe.set(key, access_token, ex=720)
+                        pipe.set(key + "_valid", 1, ex=700)
+                        pipe.delete(key + "_lock")
+                        await pipe.execute()
+                        self.logger.info(f"刷新 {account.key} access_token成功")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.logger.error(f"刷新 {account.key} access_token失败: {e}")
+            await asyncio.sleep(1)
+
+    async def send_message(
+        self, openid, title, ip, date, redirect_url, template=None, account=None
+    ):
+        prepared = templates.get(template).prepare(
+            redirect_url,
+            {"title": title, "ip": ip, "date": date},
+            account=accounts.get(account),
+        )
+        return await self.send_prepared(openid, prepared, account=account)
+
+    async def send_prepared(
+        self, openid: str, prepared: PreparedMessage, account: str = None
+    ) -> dict:
+        """发送预序列化的模板消息, 群发时同一消息只序列化一次"""
         url = "https://api.weixin.qq.com/cgi-bin/message/template/send"
-        params = {"access_token": self.access_token}
-        data = {
-            "touser": openid,
-            "template_id": settings.template_id,
-            "url": redirect_url,
-            "data": {
-                "thing18": {"value": title},
-                "character_string12": {"value": ip},
-                "thing3": {"value": date},
+        params = await self._params(account)
+        async with self.session.post(
+            url,
+            params=params,
+            data=prepared.for_recipient(openid),
+            headers={"Content-Type": "application/json"},
+        ) as response:
+            return await response.json(content_type=None)
+
+    async def post_api(self, path: str, data: dict, account: str = None) -> dict:
+        """调用微信公众号 POST 接口, path 为 /cgi-bin/ 之后的部分"""
+        url = "https://api.weixin.qq.com/cgi-bin/" + path
+        params = await self._params(account)
+        async with self.session.post(url, params=params, json=data) as response:
+            return await response.json(content_type=None)
+
+    async def send_custom_text(self, openid: str, content: str, account: str = None) -> dict:
+        """通过客服消息接口发送文本消息, 用于超时后补发回调的回复"""
+        return await self.post_api(
+            "message/custom/send",
+            {"touser": openid, "msgtype": "text", "text": {"content": content}},
+            account=account,
+        )
+
+    async def batch_get_user_info(self, openids: list, account: str = None) -> dict:
+        """批量获取用户基本信息, 每次最多 100 个"""
+        return await self.post_api(
+            "user/info/batchget",
+            {"user_list": [{"openid": openid, "lang": "zh_CN"} for openid in openids]},
+            account=account,
+        )
+
+    async def iter_followers(self, next_openid: str = "", account: str = None):
+        """
+        分页遍历关注者列表, 每页最多 10000 个
+        Yields:
+            (openids, next_openid): 当前页的 openid 列表及下一页的起始 openid
+        """
+        url = "https://api.weixin.qq.com/cgi-bin/user/get"
+        while True:
+            params = {**await self._params(account), "next_openid": next_openid}
+            async with self.session.get(url, params=params) as response:
+                result = await response.json(content_type=None)
+            if result.get("errcode", 0) != 0:
+                raise RuntimeError(f"获取关注者列表失败: {result}")
+            if not result.get("count"):
+                return
+            next_openid = result.get("next_openid", "")
+            yield result["data"]["openid"], next_openid
+            if not next_openid:
+                return
+
+    async def create_tag(self, name: str) -> dict:
+        """创建用户标签, 返回 {"tag": {"id": ..., "name": ...}}"""
+        return await self.post_api("tags/create", {"tag": {"name": name}})
+
+    async def delete_tag(self, tag_id: int) -> dict:
+        """删除用户标签"""
+        return await self.post_api("tags/delete", {"tag": {"id": tag_id}})
+
+    async def batch_tagging(self, tag_id: int, openids: list) -> dict:
+        """批量为用户打标签, 每次最多 50 个"""
+        return await self.post_api(
+            "tags/members/batchtagging", {"openid_list": openids, "tagid": tag_id}
+        )
+
+    async def batch_untagging(self, tag_id: int, openids: list) -> dict:
+        """批量为用户取消标签, 每次最多 50 个"""
+        return await self.post_api(
+            "tags/members/batchuntagging", {"openid_list": openids, "tagid": tag_id}
+        )
+
+    async def mass_send_text(self, tag_id: int, content: str) -> dict:
+        """按标签群发文本消息"""
+        return await self.post_api(
+            "message/mass/sendall",
+            {
+                "filter": {"is_to_all": False, "tag_id": tag_id},
+                "text": {"content": content},
+                "msgtype": "text",
             },
-        }
-        async with ClientSession() as session:
-            async with session.post(url, params=params, json=data) as response:
-                return await response.json()
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# app/services/mute.py
+
+from app.core.logger import LOG
+from app.database.redis import Redis
+from app.services.account import accounts
+
+
+class GroupMute:
+    """
+    群组免打扰
+    每个群组的免打扰成员保存在 Redis 集合 group_mute:{group} 中,
+    其他公众号的群组使用 group_mute:{公众号}:{group}。
+    广播时用一次 SMISMEMBER 过滤整批成员, 不再逐个查询。
+    """
+
+    logger = LOG().logger
+
+    KEY = "group_mute:"
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+
+    @classmethod
+    def _key(cls, group: str, account: str = None) -> str:
+        # 默认公众号沿用原有键名
+        if not account or account == accounts.DEFAULT:
+            return cls.KEY + group
+        return f"{cls.KEY}{account}:{group}"
+
+    async def mute(self, group: str, openid: str, account: str = None):
+        await self.redis.sadd(self._key(group, account), openid)
+
+    async def unmute(self, group: str, openid: str, account: str = None) -> bool:
+        """取消免打扰, 返回之前是否处于免打扰状态"""
+        return bool(await self.redis.srem(self._key(group, account), openid))
+
+    async def remove(self, group: str, openids: list, account: str = None):
+        """成员被移出群组时清除免打扰记录"""
+        if openids:
+            await self.redis.srem(self._key(group, account), *openids)
+
+    async def count(self, group: str, account: str = None) -> int:
+        """群组中开启免打扰的成员数量"""
+        return await self.redis.scard(self._key(group, account))
+
+    async def filter(self, group: str, openids: list, account: str = None) -> tuple:
+        """
+        过滤开启免打扰的成员
+        Returns:
+            tuple: (需要发送的成员, 免打扰的成员数量)
+        """
+        if not openids:
+            return [], 0
+        flags = await self.redis.smismember(self._key(group, account), openids)
+        active = [openid for openid, muted in zip(openids, flags) if not muted]
+        return active, len(openids) - len(active)
+
+    async def drop(self, group: str, account: str = None):
+        """群组删除时清除免打扰记录"""
+        await self.redis.delete(self._key(group, account))
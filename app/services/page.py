@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# app/services/page.py
+
+import gzip
+import html
+import asyncio
+import hashlib
+from typing import NamedTuple, Optional
+from collections import OrderedDict
+from markdown_it import MarkdownIt
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mongo import MongoDB
+from app.services.archive import MessageArchive
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖, 未安装时只提供 gzip
+    brotli = None
+
+
+# 不允许消息内容中的原始 HTML, 避免注入
+markdown = MarkdownIt("commonmark", {"html": False, "linkify": False})
+
+PAGE_TEMPLATE = (
+    "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+    "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">"
+    "<title>{title}</title></head>"
+    "<body><h2>{title}</h2><small>{date}</small><article>{body}</article></body></html>"
+)
+
+
+def render_message_page(title: str, content: str, date: str) -> str:
+    """将消息渲染为完整的 HTML 页面, 内容按 Markdown 解析"""
+    return PAGE_TEMPLATE.format(
+        title=html.escape(title),
+        date=html.escape(date),
+        body=markdown.render(content),
+    )
+
+
+def accepted_encodings(header: str) -> dict:
+    """
+    解析 Accept-Encoding, 返回 编码 -> q 值, q=0 表示明确拒绝
+    例如 "gzip;q=0.8, br;q=0" -> {"gzip": 0.8, "br": 0.0}
+    """
+    encodings = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encodings[coding] = q
+    return encodings
+
+
+def accepts_encoding(encodings: dict, coding: str) -> bool:
+    """客户端是否接受该编码, 未列出时按 * 的 q 值判断"""
+    return encodings.get(coding, encodings.get("*", 0.0)) > 0
+
+
+def page_etag(page: str) -> str:
+    """根据页面内容生成强 ETag"""
+    return '"' + hashlib.sha256(page.encode()).hexdigest()[:32] + '"'
+
+
+def encoded_etag(etag: str, coding: str = None) -> str:
+    """压缩后的页面使用各自的强 ETag, 在原 ETag 后加上 -br 或 -gz"""
+    if not coding:
+        return etag
+    suffix = "gz" if coding == "gzip" else coding
+    return f'{etag[:-1]}-{suffix}"'
+
+
+class Page(NamedTuple):
+    etag: str
+    identity: bytes
+    gzip: bytes
+    br: Optional[bytes]
+
+
+class MessagePages:
+    """
+    消息页面缓存
+    页面在写入时渲染并保存到 MongoDB, 首次读取时压缩一次并缓存在进程内,
+    同一消息的并发冷请求只会触发一次 MongoDB 查询。
+    """
+
+    logger = LOG().logger
+
+    def __init__(
+        self,
+        mongodb: MongoDB,
+        archive: MessageArchive = None,
+        max_entries: int = None,
+    ):
+        self.mongodb = mongodb
+        self.archive = archive
+        self.max_entries = max_entries or settings.page_cache_size
+        self._cache = OrderedDict()
+        self._inflight = {}
+
+    async def get(self, message_id: str) -> Optional[Page]:
+        """获取消息页面, 消息不存在时返回 None"""
+        page = self._cache.get(message_id)
+        if page is not None:
+            self._cache.move_to_end(message_id)
+            return page
+
+        # 合并并发的冷请求
+        future = self._inflight.get(message_id)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # 当前请求被取消
+                # 发起查询的请求被取消, 重新查询
+                return await self.get(message_id)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[message_id] = future
+        try:
+            page = await self._load(message_id)
+        except asyncio.CancelledError:
+            # 等待中的请求收到取消后自行重新查询, 不会一直等待
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时避免 "never retrieved" 警告
+            raise
+        else:
+            future.set_result(page)
+            if page is not None:
+                self._cache[message_id] = page
+                if len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            return page
+        finally:
+            del self._inflight[message_id]
+
+    async def _load(self, message_id: str) -> Optional[Page]:
+        doc = await self.mongodb.find_one({"_id": message_id})
+        if not doc and self.archive is not None:
+            doc = await self.archive.get(message_id)
+        if not doc:
+            return None
+
+        content = doc.get("html")
+        if content is None:  # 兼容写入时未渲染的旧消息
+            content = render_message_page(
+                doc.get("title", ""), doc.get("content", ""), doc.get("date", "")
+            )
+        identity = content.encode()
+        return Page(
+            etag=doc.get("etag") or page_etag(content),
+            identity=identity,
+            gzip=gzip.compress(identity, compresslevel=9),
+            br=brotli.compress(identity) if brotli else None,
+        )
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# app/services/search.py
+
+import re
+import asyncio
+from datetime import datetime
+from bson.objectid import ObjectId
+from redis.exceptions import ResponseError
+from redis.commands.search.field import NumericField, TagField, TextField
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mongo import MongoDB
+from app.database.redis import Redis
+
+
+class MessageSearch:
+    """
+    消息全文检索
+    消息写入 MongoDB 时同时写入 Redis 哈希 msg:{id}, 由 RediSearch 索引
+    标题、内容、openid 和发送时间。查询只访问倒排索引, 不再扫描 MongoDB。
+    Redis 未加载 RediSearch 模块时检索功能自动关闭, 不影响消息发送。
+    """
+
+    logger = LOG().logger
+
+    PREFIX = "msg:"
+    BACKFILL_KEY = "search:backfill"  # 回填任务状态: status/cursor/indexed
+    BACKFILL_LOCK = "search:backfill:lock"
+
+    # 查询语法中需要转义的字符
+    ESCAPE = re.compile(r"([,.<>{}\[\]\"':;!@#$%^&*()\-+=~|/\\ ])")
+
+    def __init__(self, redis: Redis, mongodb: MongoDB):
+        self.redis = redis
+        self.mongodb = mongodb
+        self.index_name = settings.search_index
+        self.enabled = False
+        self._backfill_task = None
+
+    async def start(self):
+        """创建索引并继续未完成的回填任务 (需在 FastAPI 启动事件中调用)"""
+        if not settings.search_enabled:
+            return
+        index = self.redis.ft(self.index_name)
+        try:
+            await index.info()
+        except ResponseError as e:
+            if "unknown command" in str(e).lower():
+                self.logger.warning("Redis 未加载 RediSearch 模块, 消息检索已关闭")
+                return
+            await index.create_index(
+                [
+                    TextField("title", weight=2.0),
+                    TextField("content"),
+                    TagField("openid"),
+                    NumericField("ts", sortable=True),
+                ],
+                definition=IndexDefinition(
+                    prefix=[self.PREFIX],
+                    index_type=IndexType.HASH,
+                    language=settings.search_language,
+                ),
+            )
+            self.logger.info(f"已创建消息检索索引 {self.index_name}")
+        self.enabled = True
+        if await self.redis.hget(self.BACKFILL_KEY, "status") == "running":
+            self._start_backfill()
+
+    async def stop(self):
+        """停止回填任务, 下次启动时从游标处继续"""
+        if self._backfill_task:
+            self._backfill_task.cancel()
+            try:
+                await self._backfill_task
+            except asyncio.CancelledError:
+                pass
+            self._backfill_task = None
+
+    @staticmethod
+    def _timestamp(date: str) -> float:
+        return datetime.strptime(date, "%Y-%m-%d %H:%M:%S").timestamp()
+
+    @classmethod
+    def _fields(cls, doc: dict) -> dict:
+        return {
+            "title": doc.get("title", ""),
+            "content": doc.get("content", ""),
+            "openid": doc.get("openid", ""),
+            "date": doc.get("date", ""),
+            "ts": cls._timestamp(doc["date"]),
+        }
+
+    async def index(self, message_id: str, doc: dict):
+        """写入单条消息的索引, 失败时只记录日志"""
+        if not self.enabled:
+            return
+        try:
+            await self.redis.hset(self.PREFIX + message_id, mapping=self._fields(doc))
+        except Exception as e:
+            self.logger.warning(f"消息 {message_id} 写入检索索引失败: {e}")
+
+    @classmethod
+    def build_query(
+        cls,
+        text: str = "",
+        openid: str = None,
+        start: float = None,
+        end: float = None,
+    ) -> str:
+        """
+        生成查询语句
+        text 中的词按 AND 匹配标题和内容, 以 * 结尾的词按前缀匹配
+        """
+        parts = []
+        for word in text.split():
+            prefix = word.endswith("*") and len(word) > 1
+            word = cls.ESCAPE.sub(r"\\\1", word.rstrip("*") if prefix else word)
+            parts.append(word + "*" if prefix else word)
+        if openid:
+            tag = cls.ESCAPE.sub(r"\\\1", openid)
+            parts.append(f"@openid:{{{tag}}}")
+        if start is not None or end is not None:
+            low = start if start is not None else "-inf"
+            high = end if end is not None else "+inf"
+            parts.append(f"@ts:[{low} {high}]")
+        return " ".join(parts) or "*"
+
+    async def search(
+        self,
+        text: str = "",
+        openid: str = None,
+        start: float = None,
+        end: float = None,
+        offset: int = 0,
+        limit: int = 20,
+        ascending: bool = False,
+    ) -> dict:
+        """
+        检索消息, 按发送时间排序并分页
+        Raises:
+            ValueError: 检索未开启或查询语句无效
+        """
+        if not self.enabled:
+            raise ValueError("消息检索未开启")
+        query = (
+            Query(self.build_query(text, openid, start, end))
+            .sort_by("ts", asc=ascending)
+            .paging(offset, min(limit, 100))
+            .return_fields("title", "openid", "date")
+        )
+        try:
+            result = await self.redis.ft(self.index_name).search(query)
+        except ResponseError as e:
+            raise ValueError(f"查询语句无效: {e}")
+        return {
+            "total": result.total,
+            "messages": [
+                {
+                    "message_id": doc.id[len(self.PREFIX) :],
+                    "title": doc.title,
+                    "openid": doc.openid,
+                    "date": doc.date,
+                }
+                for doc in result.docs
+            ],
+        }
+
+    async def start_backfill(self) -> dict:
+        """从 MongoDB 回填全部消息的索引, 已有任务运行时返回其进度"""
+        if not self.enabled:
+            raise ValueError("消息检索未开启")
+        if await self.redis.hget(self.BACKFILL_KEY, "status") != "running":
+            pipe = await self.redis.pipeline()
+            pipe.delete(self.BACKFILL_KEY)
+            pipe.hset(self.BACKFILL_KEY, mapping={"status": "running", "cursor": "", "indexed": 0})
+            await pipe.execute()
+        self._start_backfill()
+        return await self.get_backfill()
+
+    async def get_backfill(self) -> dict:
+        state = await self.redis.hgetall(self.BACKFILL_KEY)
+        return {
+            "status": state.get("status", "idle"),
+            "cursor": state.get("cursor", ""),
+            "indexed": int(state.get("indexed", 0)),
+        }
+
+    def _start_backfill(self):
+        if self._backfill_task is None or self._backfill_task.done():
+            self._backfill_task = asyncio.create_task(self._backfill())
+
+    async def _backfill(self):
+        """按 _id 顺序分批读取消息并写入索引, 每批记录游标, 多个进程中只有一个执行"""
+        while True:
+            if await self.redis.set(self.BACKFILL_LOCK, 1, ex=60, nx=True):
+                break
+            await asyncio.sleep(30)
+        try:
+            cursor = await self.redis.hget(self.BACKFILL_KEY, "cursor")
+            while True:
+                query = {"content": {"$exists": True}}
+                if cursor:
+                    query["_id"] = {"$gt": ObjectId(cursor)}
+                docs = await self.mongodb.find(
+                    query, limit=settings.search_backfill_batch, sort=[("_id", 1)]
+                )
+                if not docs:
+                    break
+                pipe = await self.redis.pipeline()
+                for doc in docs:
+                    if doc.get("date"):
+                        pipe.hset(self.PREFIX + doc["_id"], mapping=self._fields(doc))
+                cursor = docs[-1]["_id"]
+                pipe.hset(self.BACKFILL_KEY, "cursor", cursor)
+                pipe.hincrby(self.BACKFILL_KEY, "indexed", len(docs))
+                pipe.expire(self.BACKFILL_LOCK, 60)
+                await pipe.execute()
+            await self.redis.hset(self.BACKFILL_KEY, "status", "done")
+            self.logger.info("消息检索索引回填完成")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"消息检索索引回填失败, 重启后从游标处继续: {e}")
+        finally:
+            await self.redis.delete(self.BACKFILL_LOCK)
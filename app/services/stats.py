@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# app/services/stats.py
+
+import asyncio
+from datetime import datetime, timedelta
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mongo import MongoDB
+from app.database.redis import Redis
+
+
+class SendStats:
+    """
+    发送统计
+    每次调用模板消息接口后, 在按小时分桶的 Redis 哈希 send_stats:{YYYYmmddHH} 中
+    累加 sent/failed、各错误码和各群组的数量, 接收者写入 HyperLogLog 统计去重人数。
+    查询只读取时间范围内的分桶, 不扫描 MongoDB。Redis 中的分桶保留 stats_retention_hours,
+    已结束的小时由后台任务汇总写入 MongoDB, 用于长期查询。
+    """
+
+    logger = LOG().logger
+
+    KEY = "send_stats:"  # 计数哈希
+    USERS_KEY = "send_stats:users:"  # 去重接收者
+    GROUP_USERS_KEY = "send_stats:group_users:"  # 各群组的去重接收者
+    ROLLUP_KEY = "send_stats:rollup"  # 已汇总到的小时
+    ROLLUP_LOCK = "send_stats:rollup:lock"
+
+    HOUR_FORMAT = "%Y%m%d%H"
+
+    def __init__(self, redis: Redis, mongodb: MongoDB):
+        self.redis = redis
+        self.history = mongodb
+        self._task = None
+
+    async def start(self):
+        """启动定时汇总任务 (需在 FastAPI 启动事件中调用)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @classmethod
+    def _hour(cls, when: datetime = None) -> str:
+        return (when or datetime.now()).strftime(cls.HOUR_FORMAT)
+
+    async def record(self, openid: str, result, group: str = None):
+        """记录一次发送结果, 失败时只记录日志"""
+        if not isinstance(result, dict):
+            result = {"errcode": -1}
+        errcode = result.get("errcode", 0)
+        outcome = "sent" if errcode == 0 else "failed"
+        hour = self._hour()
+        ttl = settings.stats_retention_hours * 3600
+        try:
+            pipe = await self.redis.pipeline()
+            pipe.hincrby(self.KEY + hour, outcome, 1)
+            if errcode:
+                pipe.hincrby(self.KEY + hour, f"errcode:{errcode}", 1)
+            pipe.pfadd(self.USERS_KEY + hour, openid)
+            pipe.expire(self.KEY + hour, ttl)
+            pipe.expire(self.USERS_KEY + hour, ttl)
+            if group:
+                pipe.hincrby(self.KEY + hour, f"group:{group}:{outcome}", 1)
+                pipe.pfadd(f"{self.GROUP_USERS_KEY}{hour}:{group}", openid)
+                pipe.expire(f"{self.GROUP_USERS_KEY}{hour}:{group}", ttl)
+            await pipe.execute()
+        except Exception as e:
+            self.logger.warning(f"记录发送统计失败: {e}")
+
+    @staticmethod
+    def _parse(counts: dict) -> dict:
+        """将计数哈希拆分为 sent/failed、errcodes 和 groups"""
+        stats = {"sent": 0, "failed": 0, "errcodes": {}, "groups": {}}
+        for field, value in counts.items():
+            value = int(value)
+            if field.startswith("errcode:"):
+                stats["errcodes"][field[len("errcode:") :]] = value
+            elif field.startswith("group:"):
+                group, _, outcome = field[len("group:") :].rpartition(":")
+                stats["groups"].setdefault(group, {"sent": 0, "failed": 0})[outcome] = value
+            elif field in ("sent", "failed"):
+                stats[field] = value
+        return stats
+
+    async def get(self, hours: int = 24, group: str = None) -> dict:
+        """
+        最近若干小时的发送统计, 每小时一个分桶, 一次管道读取全部分桶
+        Args:
+            hours: 小时数, 不超过 stats_retention_hours
+            group: 只返回该群组的数量和去重人数
+        """
+        hours = max(1, min(hours, settings.stats_retention_hours))
+        now = datetime.now()
+        buckets = [self._hour(now - timedelta(hours=i)) for i in reversed(range(hours))]
+        if group:
+            users_keys = [f"{self.GROUP_USERS_KEY}{hour}:{group}" for hour in buckets]
+        else:
+            users_keys = [self.USERS_KEY + hour for hour in buckets]
+
+        pipe = await self.redis.pipeline()
+        for hour, users_key in zip(buckets, users_keys):
+            pipe.hgetall(self.KEY + hour)
+            pipe.pfcount(users_key)
+        pipe.pfcount(*users_keys)
+        results = await pipe.execute()
+
+        series = []
+        for i, hour in enumerate(buckets):
+            stats = self._parse(results[2 * i])
+            if group:
+                counts = stats["groups"].get(group, {"sent": 0, "failed": 0})
+                stats = {"sent": counts["sent"], "failed": counts["failed"]}
+            series.append({"hour": hour, "users": results[2 * i + 1], **stats})
+        return {
+            "group": group,
+            "sent": sum(bucket["sent"] for bucket in series),
+            "failed": sum(bucket["failed"] for bucket in series),
+            "users": results[-1],  # 多个 HyperLogLog 合并计数, 跨小时去重
+            "hours": series,
+        }
+
+    async def get_history(self, start: str, end: str) -> list:
+        """
+        已汇总到 MongoDB 的小时统计
+        Args:
+            start, end: 小时, 格式 YYYYmmddHH, 包含两端
+        """
+        return await self.history.find(
+            {"_id": {"$gte": start, "$lte": end}}, sort=[("_id", 1)]
+        )
+
+    async def rollup(self) -> int:
+        """
+        将已结束且未汇总的小时写入 MongoDB, 多个进程中只有一个执行
+        Returns:
+            int: 本次汇总的小时数
+        """
+        if not await self.redis.set(self.ROLLUP_LOCK, 1, ex=300, nx=True):
+            return 0
+        try:
+            current = datetime.now().replace(minute=0, second=0, microsecond=0)
+            oldest = current - timedelta(hours=settings.stats_retention_hours - 1)
+            last = await self.redis.get(self.ROLLUP_KEY)
+            hour = datetime.strptime(last, self.HOUR_FORMAT) + timedelta(hours=1) if last else oldest
+            hour = max(hour, oldest)
+            count = 0
+            while hour < current:
+                key = self._hour(hour)
+                pipe = await self.redis.pipeline()
+                pipe.hgetall(self.KEY + key)
+                pipe.pfcount(self.USERS_KEY + key)
+                counts, users = await pipe.execute()
+                if counts:
+                    stats = self._parse(counts)
+                    for group in stats["groups"]:
+                        stats["groups"][group]["users"] = await self.redis.pfcount(
+                            f"{self.GROUP_USERS_KEY}{key}:{group}"
+                        )
+                    await self.history.update({"_id": key}, {**stats, "users": users})
+                    count += 1
+                await self.redis.set(self.ROLLUP_KEY, key)
+                hour += timedelta(hours=1)
+            return count
+        finally:
+            await self.redis.delete(self.ROLLUP_LOCK)
+
+    async def _run(self):
+        while True:
+            try:
+                count = await self.rollup()
+                if count:
+                    self.logger.info(f"已汇总 {count} 小时的发送统计")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"发送统计汇总失败: {e}")
+            await asyncio.sleep(settings.stats_rollup_interval)
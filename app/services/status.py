@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# app/services/status.py
+
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from app.core.logger import LOG
+from app.database.redis import Redis
+
+
+class StatusHub:
+    """
+    消息状态推送
+    状态变更(queued/sent/delivered/failed)通过 Redis 发布到消息和发送者两个频道,
+    多个进程的订阅者都能收到。每个进程只使用一个 Pub/Sub 连接和一个读取任务,
+    频道在本进程第一个订阅者出现时订阅, 最后一个订阅者离开时取消订阅,
+    收到的事件分发到各订阅者的内存队列中。
+    """
+
+    logger = LOG().logger
+
+    QUEUED = "queued"
+    SENT = "sent"
+    DELIVERED = "delivered"
+    FAILED = "failed"
+
+    CHANNEL = "message_status:"
+    LAST_KEY = "message_status:last:"  # 消息的最新状态, 供后来的订阅者读取
+    MSGID_KEY = "message_status:msgid:"  # 微信 msgid -> 消息ID, 用于送达事件
+    CONTROL_CHANNEL = "message_status:control"  # 启动时订阅, 保持连接可读
+
+    TTL = 24 * 3600
+    QUEUE_SIZE = 100  # 每个订阅者缓存的事件数量, 超出时丢弃最早的事件
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self._pubsub = None
+        self._subscribers = {}  # 频道 -> 订阅者队列集合
+        self._task = None
+
+    async def start(self):
+        """建立 Pub/Sub 连接并启动读取任务 (需在 FastAPI 启动事件中调用)"""
+        if self._task is None:
+            self._pubsub = self.redis.pubsub()
+            await self._pubsub.subscribe(self.CONTROL_CHANNEL)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止读取任务并关闭 Pub/Sub 连接 (需在 FastAPI 关闭事件中调用)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pubsub:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    @classmethod
+    def message_channel(cls, message_id: str) -> str:
+        return f"{cls.CHANNEL}message:{message_id}"
+
+    @classmethod
+    def sender_channel(cls, sender: str) -> str:
+        return f"{cls.CHANNEL}sender:{sender}"
+
+    async def publish(self, message_id: str, sender: str, status: str, **extra):
+        """发布状态变更, 同时记录消息的最新状态"""
+        event = json.dumps(
+            {
+                "message_id": message_id,
+                "sender": sender,
+                "status": status,
+                "time": time.time(),
+                **extra,
+            },
+            ensure_ascii=False,
+        )
+        pipe = await self.redis.pipeline()
+        pipe.set(self.LAST_KEY + message_id, event, ex=self.TTL)
+        pipe.publish(self.message_channel(message_id), event)
+        pipe.publish(self.sender_channel(sender), event)
+        await pipe.execute()
+
+    async def record_result(self, message_ids: list, sender: str, result: dict):
+        """
+        根据模板消息接口的返回结果发布 sent/failed, 合并发送时一次调用对应多条消息
+        发送成功时记录微信返回的 msgid, 收到送达事件后发布 delivered
+        """
+        if not isinstance(result, dict):
+            result = {"errcode": -1, "errmsg": str(result)}
+        if result.get("errmsg") == "coalesced":
+            status, extra = self.QUEUED, {"coalesced": True}
+        elif result.get("errmsg") == "queued":
+            # 已写入分区发送队列, 发送结果由持有分区的节点推送
+            status, extra = self.QUEUED, {"stream_id": result.get("stream_id")}
+        elif result.get("errcode", 0) == 0:
+            status, extra = self.SENT, {}
+            if "msgid" in result:
+                await self.redis.set(
+                    self.MSGID_KEY + str(result["msgid"]),
+                    json.dumps({"message_ids": message_ids, "sender": sender}),
+                    ex=self.TTL,
+                )
+        else:
+            status, extra = self.FAILED, {"error": result.get("errmsg")}
+        for message_id in message_ids:
+            await self.publish(message_id, sender, status, **extra)
+
+    async def record_delivery(self, msgid: str, status: str):
+        """处理模板消息送达事件, status 为 success 或失败原因"""
+        found = await self.redis.get(self.MSGID_KEY + str(msgid))
+        if not found:
+            return
+        found = json.loads(found)
+        for message_id in found["message_ids"]:
+            if status == "success":
+                await self.publish(message_id, found["sender"], self.DELIVERED)
+            else:
+                await self.publish(message_id, found["sender"], self.FAILED, error=status)
+
+    async def get_last(self, message_id: str):
+        """消息的最新状态, 不存在时返回 None"""
+        event = await self.redis.get(self.LAST_KEY + message_id)
+        return json.loads(event) if event else None
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        """
+        订阅频道, 返回接收事件的队列
+        Example:
+            async with hub.subscribe(StatusHub.sender_channel(openid)) as queue:
+                event = await queue.get()
+        """
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        queues = self._subscribers.setdefault(channel, set())
+        first = not queues
+        queues.add(queue)
+        try:
+            if first:
+                await self._pubsub.subscribe(channel)
+            yield queue
+        finally:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[channel]
+                if self._pubsub:
+                    await self._pubsub.unsubscribe(channel)
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def _run(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=None
+                )
+                if not message or message["channel"] == self.CONTROL_CHANNEL:
+                    continue
+                event = json.loads(message["data"])
+                for queue in self._subscribers.get(message["channel"], ()):
+                    if queue.full():
+                        # 订阅者处理过慢时丢弃最早的事件
+                        queue.get_nowait()
+                    queue.put_nowait(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"消息状态订阅连接异常: {e}")
+                await asyncio.sleep(1)
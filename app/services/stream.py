@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+# app/services/stream.py
+
+import os
+import json
+import math
+import time
+import zlib
+import random
+import socket
+import asyncio
+from redis.exceptions import ResponseError
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.redis import Redis
+from app.services.mp import MPUtils
+from app.services.account import accounts
+from app.services.template import PreparedMessage
+from app.services.delivery import DeliveryScheduler
+from app.services.status import StatusHub
+from app.services.stats import SendStats
+from app.services.undeliverable import UndeliverableCache
+
+
+class StreamDelivery:
+    """
+    基于 Redis Streams 的分区有序发送 (delivery_mode=stream)
+    消息按接收者 openid 的哈希分到 stream_partitions 个分区, 每个分区按优先级
+    写入 delivery:stream:{priority}:{n} 三个流, 紧急消息不会排在批量消息之后。
+    每个分区同一时间只由一个节点持有(租约), 节点用一个读取协程通过消费组读取
+    全部持有分区的新消息, 不同接收者的消息并发发送(最多 stream_concurrency 条),
+    同一接收者的消息按读取顺序逐条发送。节点定期心跳, 分区按存活节点数量均分,
+    增加节点后原有节点在发送完已读取的消息后释放多余的分区, 吞吐随节点数量增加。
+    节点宕机后租约过期, 接管的节点先用 XAUTOCLAIM 认领上一个持有者未确认的消息
+    并按顺序发送, 同时删除没有待确认消息的消费者; 消息不会丢失, 宕机时正在发送的
+    消息可能重复发送。所有节点的 stream_partitions 必须相同。
+    """
+
+    logger = LOG().logger
+
+    STREAM_KEY = "delivery:stream:"
+    LEASE_KEY = "delivery:stream:lease:"
+    NODES_KEY = "delivery:stream:nodes"  # 节点 -> 心跳时间 的有序集合
+    GROUP = "delivery"
+
+    # 读取顺序, 紧急消息优先
+    PRIORITIES = (DeliveryScheduler.CRITICAL, DeliveryScheduler.NORMAL, DeliveryScheduler.BULK)
+
+    QUEUED = "queued"
+    BLOCK_MS = 1000
+
+    def __init__(
+        self,
+        redis: Redis,
+        mp: MPUtils,
+        delivery: DeliveryScheduler,
+        status: StatusHub,
+        stats: SendStats,
+        undeliverable: UndeliverableCache,
+    ):
+        self.redis = redis
+        self.mp = mp
+        self.delivery = delivery
+        self.status = status
+        self.stats = stats
+        self.undeliverable = undeliverable
+        self.partitions = settings.stream_partitions
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._owned = set()  # 持有租约的分区
+        self._ready = set()  # 已认领未确认消息、正在读取新消息的分区
+        self._claiming = {}  # 分区 -> 认领未确认消息的任务
+        self._releasing = set()  # 发送完已读取的消息后释放的分区
+        self._inflight = {}  # 分区 -> 已读取未完成的消息数量
+        self._chains = {}  # 接收者 -> 最后一条消息的发送任务
+        self._tasks = set()
+        self._slots = asyncio.Semaphore(settings.stream_concurrency)
+        self._nodes = 0
+        self._task = None
+        self._reader = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.delivery_mode == "stream"
+
+    async def start(self):
+        """启动分区调度和读取协程 (需在 FastAPI 启动事件中调用), 仅 stream 模式生效"""
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._reader = asyncio.create_task(self._read())
+
+    async def stop(self):
+        """停止读取并释放全部分区, 未确认的消息由其他节点接管"""
+        for task in (self._task, self._reader, *self._claiming.values()):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._reader = None
+        self._claiming.clear()
+        self._ready.clear()
+        # 等待已读取的消息发送完成, 超时后取消, 未确认的消息由接管的节点重新发送
+        tasks = list(self._tasks)
+        if tasks:
+            await asyncio.wait(tasks, timeout=settings.stream_lease_seconds)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for p in list(self._owned):
+            await self._release(p)
+        if self.enabled:
+            await self.redis.zrem(self.NODES_KEY, self.worker_id)
+
+    def partition(self, openid: str) -> int:
+        return zlib.crc32(openid.encode()) % self.partitions
+
+    def _key(self, priority: str, p: int) -> str:
+        return f"{self.STREAM_KEY}{priority}:{p}"
+
+    def _keys(self, p: int) -> list:
+        return [self._key(priority, p) for priority in self.PRIORITIES]
+
+    async def enqueue(
+        self,
+        openid: str,
+        prepared: PreparedMessage,
+        account: str = None,
+        priority: str = DeliveryScheduler.NORMAL,
+        deadline: float = None,
+        message_id: str = "",
+        sender: str = None,
+        group: str = None,
+        notify: dict = None,
+    ) -> dict:
+        """
+        写入接收者所在分区的对应优先级流, 发送结果由持有分区的节点记录
+        Args:
+            notify: 发送者 -> 消息ID列表, 合并消息发送后按发送者推送状态, 代替 message_id/sender
+        """
+        priority = DeliveryScheduler.check_priority(priority)
+        entry_id = await self.redis.xadd(
+            self._key(priority, self.partition(openid)),
+            {
+                "openid": openid,
+                "message": prepared.suffix,
+                "account": account or "",
+                "priority": priority,
+                "deadline": deadline or "",
+                "message_id": message_id,
+                "sender": sender or "",
+                "group": group or "",
+                "notify": json.dumps(notify) if notify else "",
+            },
+        )
+        return {"errcode": 0, "errmsg": self.QUEUED, "stream_id": entry_id}
+
+    async def get_stats(self) -> dict:
+        """本节点持有的分区、进行中的消息数量、存活节点数量和各优先级积压的消息数量"""
+        if not self.enabled:
+            return {"enabled": False}
+        pipe = await self.redis.pipeline()
+        for priority in self.PRIORITIES:
+            for p in range(self.partitions):
+                pipe.xlen(self._key(priority, p))
+        lengths = await pipe.execute()
+        return {
+            "enabled": True,
+            "worker_id": self.worker_id,
+            "nodes": self._nodes,
+            "owned": sorted(self._owned),
+            "inflight": len(self._tasks),
+            "backlog": {
+                priority: sum(lengths[i * self.partitions : (i + 1) * self.partitions])
+                for i, priority in enumerate(self.PRIORITIES)
+            },
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                await self._rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"发送分区调度失败: {e}")
+            await asyncio.sleep(settings.stream_lease_seconds / 3)
+
+    async def _rebalance(self):
+        """心跳、续租, 并按存活节点数量释放或认领分区"""
+        lease = settings.stream_lease_seconds
+        now = time.time()
+        pipe = await self.redis.pipeline()
+        pipe.zadd(self.NODES_KEY, {self.worker_id: now})
+        pipe.zremrangebyscore(self.NODES_KEY, "-inf", now - lease)
+        pipe.zcard(self.NODES_KEY)
+        self._nodes = (await pipe.execute())[-1]
+        target = math.ceil(self.partitions / max(self._nodes, 1))
+
+        for p in list(self._owned):
+            renewed = await self.redis.run_script(
+                "renew_lease", keys=[self.LEASE_KEY + str(p)], args=[self.worker_id, lease]
+            )
+            if not renewed:
+                # 已读取的消息继续发送, 新的持有者认领后可能重复发送
+                self.logger.warning(f"发送分区 {p} 的租约已丢失")
+                self._owned.discard(p)
+                self._ready.discard(p)
+                self._releasing.discard(p)
+
+        # 释放多余的分区: 停止读取, 已读取的消息发送完成后释放租约
+        active = [p for p in self._owned if p not in self._releasing]
+        for p in active[target:]:
+            self._releasing.add(p)
+            self._ready.discard(p)
+        for p in list(self._releasing):
+            if not self._inflight.get(p) and p not in self._claiming:
+                await self._release(p)
+
+        if len(active) < target:
+            offset = random.randrange(self.partitions)
+            for i in range(self.partitions):
+                p = (offset + i) % self.partitions
+                if p in self._owned:
+                    continue
+                if await self.redis.set(self.LEASE_KEY + str(p), self.worker_id, ex=lease, nx=True):
+                    # 认领可能等待发送并发数量, 在独立任务中执行, 不影响续租
+                    self._owned.add(p)
+                    self._claiming[p] = asyncio.create_task(self._claim(p))
+                    active.append(p)
+                    if len(active) >= target:
+                        break
+
+    async def _claim(self, p: int):
+        try:
+            await self._recover(p)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"认领发送分区 {p} 失败, 稍后重试: {e}")
+            if p in self._owned:
+                await self._release(p)
+        finally:
+            self._claiming.pop(p, None)
+
+    async def _recover(self, p: int):
+        """认领上一个持有者未确认的消息并按顺序发送, 之后开始读取分区的新消息"""
+        for key in self._keys(p):
+            try:
+                await self.redis.xgroup_create(key, self.GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+            start = "0-0"
+            while True:
+                result = await self.redis.xautoclaim(
+                    key, self.GROUP, self.worker_id, min_idle_time=0, start_id=start, count=100
+                )
+                start = result[0]
+                if start == "0-0":
+                    break
+            # 待确认的消息已全部转移到本节点, 其他消费者不再需要
+            for consumer in await self.redis.xinfo_consumers(key, self.GROUP):
+                if consumer["name"] != self.worker_id and not consumer["pending"]:
+                    await self.redis.xgroup_delconsumer(key, self.GROUP, consumer["name"])
+
+        for key in self._keys(p):
+            last = "0"
+            while True:
+                entries = await self.redis.xreadgroup(
+                    self.GROUP, self.worker_id, {key: last}, count=settings.stream_batch_size
+                )
+                messages = entries[0][1] if entries else []
+                if not messages:
+                    break
+                for entry_id, fields in messages:
+                    if p not in self._owned:
+                        return  # 认领期间租约丢失
+                    await self._dispatch(p, key, entry_id, fields)
+                    last = entry_id
+        if p in self._owned and p not in self._releasing:
+            self._ready.add(p)
+            self.logger.info(f"开始消费发送分区 {p}")
+
+    async def _release(self, p: int):
+        self._owned.discard(p)
+        self._ready.discard(p)
+        self._releasing.discard(p)
+        await self.redis.run_script(
+            "release_lease", keys=[self.LEASE_KEY + str(p)], args=[self.worker_id]
+        )
+        self.logger.info(f"已释放发送分区 {p}")
+
+    async def _read(self):
+        """一次读取全部持有分区的新消息, 紧急消息优先分发"""
+        while True:
+            try:
+                streams = {
+                    self._key(priority, p): ">"
+                    for priority in self.PRIORITIES
+                    for p in sorted(self._ready)
+                }
+                if not streams:
+                    await asyncio.sleep(self.BLOCK_MS / 1000)
+                    continue
+                entries = await self.redis.xreadgroup(
+                    self.GROUP,
+                    self.worker_id,
+                    streams,
+                    count=settings.stream_batch_size,
+                    block=self.BLOCK_MS,
+                )
+                order = {key: i for i, key in enumerate(streams)}
+                for key, messages in sorted(entries or [], key=lambda item: order[item[0]]):
+                    p = int(key.rsplit(":", 1)[1])
+                    for entry_id, fields in messages:
+                        await self._dispatch(p, key, entry_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"读取发送分区失败: {e}")
+                await asyncio.sleep(self.BLOCK_MS / 1000)
+
+    async def _dispatch(self, p: int, key: str, entry_id: str, fields: dict):
+        """分发一条消息, 排在同一接收者的上一条消息之后, 并发数量已满时等待"""
+        if not fields:
+            # 消息已被删除, 只需确认
+            await self.redis.xack(key, self.GROUP, entry_id)
+            return
+        await self._slots.acquire()
+        openid = fields["openid"]
+        task = asyncio.create_task(
+            self._send_after(self._chains.get(openid), key, entry_id, fields)
+        )
+        self._chains[openid] = task
+        self._tasks.add(task)
+        self._inflight[p] = self._inflight.get(p, 0) + 1
+        task.add_done_callback(lambda task: self._done(p, openid, task))
+
+    def _done(self, p: int, openid: str, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._inflight[p] -= 1
+        if not self._inflight[p]:
+            del self._inflight[p]
+        if self._chains.get(openid) is task:
+            del self._chains[openid]
+
+    async def _send_after(self, previous, key: str, entry_id: str, fields: dict):
+        try:
+            if previous is not None and not previous.done():
+                await asyncio.wait([previous])
+            await self._deliver(key, entry_id, fields)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 未确认的消息在分区被接管时重新发送
+            self.logger.error(f"发送分区消息 {entry_id} 失败: {e}")
+        finally:
+            self._slots.release()
+
+    async def _deliver(self, key: str, entry_id: str, fields: dict):
+        """发送一条消息, 接口异常时重试, 确认后记录发送结果"""
+        openid = fields["openid"]
+        account = fields["account"] or None
+        deadline = float(fields["deadline"]) if fields["deadline"] else None
+        prepared = PreparedMessage.from_suffix(fields["message"])
+        for attempt in range(settings.stream_max_retries + 1):
+            try:
+                result = await self.delivery.submit(
+                    lambda: self.mp.send_prepared(openid, prepared, account=account),
+                    fields["priority"],
+                    deadline,
+                )
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = {"errcode": -1, "errmsg": str(e)}
+                if attempt < settings.stream_max_retries:
+                    await asyncio.sleep(min(2**attempt, 30))
+
+        pipe = await self.redis.pipeline()
+        pipe.xack(key, self.GROUP, entry_id)
+        pipe.xdel(key, entry_id)
+        await pipe.execute()
+
+        if fields.get("notify"):
+            for sender, message_ids in json.loads(fields["notify"]).items():
+                await self.status.record_result(message_ids, sender, result)
+        elif fields["sender"]:
+            await self.status.record_result([fields["message_id"]], fields["sender"], result)
+        await self.stats.record(openid, result, fields["group"] or None)
+        await self.undeliverable.record(accounts.get(account).key, openid, result)
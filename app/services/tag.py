@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# app/services/tag.py
+
+import asyncio
+from typing import Optional
+from app.core.logger import LOG
+from app.database.mysql import MySQL
+from app.database.redis import Redis
+from app.services.mp import MPUtils
+from app.services.mute import GroupMute
+from app.services.admission import AdmissionController
+
+
+class TagSync:
+    """
+    群组与微信用户标签的镜像
+    成员数量超过阈值的群组会创建同名标签, 之后的加入/退出操作先记录到 Redis,
+    由后台任务通过批量打标签接口(每次最多 50 个)同步。创建标签和读取全部成员
+    同样由后台任务完成, 发送接口只记录待镜像的群组。标签全量同步完成且没有
+    待同步的变更时, 群组才可以使用按标签群发。开启免打扰的成员不打标签。
+    """
+
+    logger = LOG().logger
+
+    TAGS_KEY = "group_tags"  # 群组 -> 标签ID
+    READY_KEY = "group_tags:ready"  # 全量同步完成的群组
+    ADD_KEY = "tag_sync:add:"  # 待打标签的 openid
+    REMOVE_KEY = "tag_sync:remove:"  # 待取消标签的 openid
+    DIRTY_KEY = "tag_sync:groups"  # 有待同步变更的群组
+    MIRROR_KEY = "tag_sync:mirror"  # 待镜像的群组 -> 群主openid
+    LOCK_KEY = "tag_sync:lock:"
+
+    BATCH_SIZE = 50  # 微信批量打标签接口的上限
+    TAG_NAME_LIMIT = 30  # 微信标签名称长度上限
+
+    def __init__(
+        self,
+        redis: Redis,
+        mp: MPUtils,
+        mute: GroupMute,
+        admission: AdmissionController,
+        poll_interval: float = 1.0,
+    ):
+        self.redis = redis
+        self.mp = mp
+        self.mute = mute
+        self.admission = admission
+        self.poll_interval = poll_interval
+        self._task = None
+
+    async def start(self):
+        """启动后台同步任务 (需在 FastAPI 启动事件中调用)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台同步任务 (需在 FastAPI 关闭事件中调用)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def track(self, group: str, openid: str, joined: bool):
+        """记录已镜像群组的成员变更, 未镜像的群组忽略"""
+        if not await self.redis.hget(self.TAGS_KEY, group):
+            return
+        add, remove = self.ADD_KEY + group, self.REMOVE_KEY + group
+        pipe = await self.redis.pipeline()
+        pipe.sadd(add if joined else remove, openid)
+        pipe.srem(remove if joined else add, openid)
+        pipe.sadd(self.DIRTY_KEY, group)
+        await pipe.execute()
+
+    async def track_many(self, group: str, openids: list, joined: bool):
+        """批量记录已镜像群组的成员变更"""
+        if not openids or not await self.redis.hget(self.TAGS_KEY, group):
+            return
+        add, remove = self.ADD_KEY + group, self.REMOVE_KEY + group
+        pipe = await self.redis.pipeline()
+        pipe.sadd(add if joined else remove, *openids)
+        pipe.srem(remove if joined else add, *openids)
+        pipe.sadd(self.DIRTY_KEY, group)
+        await pipe.execute()
+
+    async def get_ready_tag(self, group: str) -> Optional[int]:
+        """返回可用于群发的标签ID, 镜像未完成或仍有待同步变更时返回 None"""
+        pipe = await self.redis.pipeline()
+        pipe.hget(self.TAGS_KEY, group)
+        pipe.sismember(self.READY_KEY, group)
+        pipe.sismember(self.DIRTY_KEY, group)
+        tag_id, ready, dirty = await pipe.execute()
+        if tag_id and ready and not dirty:
+            return int(tag_id)
+        return None
+
+    async def request_mirror(self, owner: str, group: str):
+        """记录待镜像的群组, 由后台任务创建标签并加入全部成员"""
+        if not await self.redis.hget(self.TAGS_KEY, group):
+            await self.redis.hsetnx(self.MIRROR_KEY, group, owner)
+
+    async def mirror(self, conn, owner: str, group: str):
+        """
+        为群组创建标签并加入全部成员, 由后台任务分批同步
+        Args:
+            conn: aiomysql 数据库连接对象
+            owner: 群主的openid
+            group: 群组名称
+        """
+        if await self.redis.hget(self.TAGS_KEY, group):
+            return
+        if not await self.redis.set(self.LOCK_KEY + group, 1, ex=60, nx=True):
+            return
+        try:
+            result = await self.mp.create_tag(f"group_{group}"[: self.TAG_NAME_LIMIT])
+            if "tag" not in result:
+                self.logger.error(f"为群组 {group} 创建标签失败: {result}")
+                return
+            await self.redis.hset(self.TAGS_KEY, group, result["tag"]["id"])
+
+            cursor = ""
+            while True:
+                # 标签只创建在默认公众号下, 镜像的都是默认公众号的群组
+                members = await MySQL.get_group_member_page(
+                    conn, owner, group, after=cursor, limit=1000
+                )
+                if not members:
+                    break
+                cursor = members[-1]
+                members, _ = await self.mute.filter(group, members)
+                if members:
+                    await self.redis.sadd(self.ADD_KEY + group, *members)
+            await self.redis.sadd(self.DIRTY_KEY, group)
+            self.logger.info(f"群组 {group} 已镜像为标签 {result['tag']['id']}")
+        finally:
+            await self.redis.delete(self.LOCK_KEY + group)
+
+    async def drop(self, group: str):
+        """群组删除时删除对应标签"""
+        await self.redis.hdel(self.MIRROR_KEY, group)
+        tag_id = await self.redis.hget(self.TAGS_KEY, group)
+        if not tag_id:
+            return
+        pipe = await self.redis.pipeline()
+        pipe.hdel(self.TAGS_KEY, group)
+        pipe.srem(self.READY_KEY, group)
+        pipe.srem(self.DIRTY_KEY, group)
+        pipe.delete(self.ADD_KEY + group, self.REMOVE_KEY + group)
+        await pipe.execute()
+        await self.mp.delete_tag(int(tag_id))
+
+    async def _run(self):
+        while True:
+            try:
+                mirrors = await self.redis.hgetall(self.MIRROR_KEY)
+                for group, owner in mirrors.items():
+                    await self._mirror(owner, group)
+                for group in await self.redis.smembers(self.DIRTY_KEY):
+                    await self._flush(group)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"标签同步失败: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _mirror(self, owner: str, group: str):
+        """镜像一个待镜像的群组, 失败时等待下一次发送重新记录"""
+        await self.redis.hdel(self.MIRROR_KEY, group)
+        conn = await self.admission.get_worker_connection()
+        try:
+            await self.mirror(conn, owner, group)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"镜像群组 {group} 失败: {e}")
+        finally:
+            await self.admission.release_worker_connection(conn)
+
+    async def _flush(self, group: str):
+        """分批同步群组的成员变更, 失败的批次放回集合等待重试"""
+        tag_id = await self.redis.hget(self.TAGS_KEY, group)
+        if not tag_id:
+            await self.redis.srem(self.DIRTY_KEY, group)
+            return
+
+        for key, call in (
+            (self.ADD_KEY + group, self.mp.batch_tagging),
+            (self.REMOVE_KEY + group, self.mp.batch_untagging),
+        ):
+            while True:
+                # SPOP 是原子操作, 多个进程同时同步时不会重复处理
+                openids = await self.redis.spop(key, self.BATCH_SIZE)
+                if not openids:
+                    break
+                result = await call(int(tag_id), list(openids))
+                if result.get("errcode", 0) != 0:
+                    self.logger.warning(f"同步群组 {group} 标签失败: {result}")
+                    await self.redis.sadd(key, *openids)
+                    return
+
+        # 变更全部同步后群组才可以按标签群发, 同步期间有新变更时等待下一轮
+        await self.redis.run_script(
+            "mark_synced",
+            keys=[
+                self.DIRTY_KEY,
+                self.READY_KEY,
+                self.ADD_KEY + group,
+                self.REMOVE_KEY + group,
+            ],
+            args=[group],
+        )
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# app/services/template.py
+
+import json
+from typing import Dict, NamedTuple
+from app.core.config import settings
+from app.services.account import Account
+
+
+class TemplateField(NamedTuple):
+    source: str  # 取值来源, 如 title/content/ip/date 或请求中 data 的键
+    max_length: int = 0  # 最大长度, 0 表示不限制
+    truncate: bool = True  # 超长时截断, False 时拒绝请求
+
+
+class PreparedMessage:
+    """
+    预序列化的模板消息
+    除 touser 外的内容只序列化一次, 群发时每个接收者只需拼接 openid
+    """
+
+    PREFIX = b'{"touser":'
+
+    def __init__(self, template_id: str, url: str, data: dict):
+        body = json.dumps(
+            {"template_id": template_id, "url": url, "data": data},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+        self._suffix = b"," + body[1:]
+
+    def for_recipient(self, openid: str) -> bytes:
+        return self.PREFIX + json.dumps(openid).encode() + self._suffix
+
+    @property
+    def suffix(self) -> str:
+        """除 touser 外的部分, 用于写入发送队列"""
+        return self._suffix.decode()
+
+    @classmethod
+    def from_suffix(cls, suffix: str) -> "PreparedMessage":
+        """从发送队列中恢复预序列化的消息"""
+        prepared = cls.__new__(cls)
+        prepared._suffix = suffix.encode()
+        return prepared
+
+
+class Template:
+    """模板消息定义, 声明模板字段与取值来源的映射和长度限制"""
+
+    ELLIPSIS = "…"
+
+    def __init__(self, name: str, template_id: str, fields: Dict[str, TemplateField]):
+        self.name = name
+        self.template_id = template_id
+        self.fields = fields
+
+    def render(self, values: dict) -> dict:
+        """
+        校验并生成模板的 data 字段
+        Args:
+            values: 字段取值来源
+        Returns:
+            模板消息的 data 字段
+        Raises:
+            ValueError: 缺少字段或字段超长且不允许截断
+        """
+        data = {}
+        for key, field in self.fields.items():
+            if values.get(field.source) is None:
+                raise ValueError(f"模板 {self.name} 缺少字段 {field.source}")
+            value = str(values[field.source])
+            if field.max_length and len(value) > field.max_length:
+                if not field.truncate:
+                    raise ValueError(
+                        f"模板 {self.name} 字段 {field.source} 超过 {field.max_length} 个字符"
+                    )
+                value = value[: field.max_length - 1] + self.ELLIPSIS
+            data[key] = {"value": value}
+        return data
+
+    def prepare(self, url: str, values: dict, account: Account = None) -> PreparedMessage:
+        """校验字段并预序列化消息, 指定公众号时使用该公众号下的模板ID"""
+        template_id = self.template_id
+        if account is not None:
+            template_id = account.resolve_template_id(self.name, template_id)
+        return PreparedMessage(template_id, url, self.render(values))
+
+
+class TemplateRegistry:
+    """模板注册表, 默认模板 default 使用 TEMPLATE_ID 及原有字段映射"""
+
+    DEFAULT = "default"
+
+    def __init__(self):
+        self._templates = {}
+
+    def register(self, template: Template) -> None:
+        self._templates[template.name] = template
+
+    def get(self, name: str = None) -> Template:
+        name = name or self.DEFAULT
+        if name not in self._templates:
+            raise ValueError(f"模板 {name} 不存在")
+        return self._templates[name]
+
+    @classmethod
+    def from_settings(cls) -> "TemplateRegistry":
+        """
+        从配置加载模板, TEMPLATES 格式:
+        {"name": {"template_id": "...", "fields": {"thing1": {"source": "title", "max_length": 20}}}}
+        """
+        registry = cls()
+        registry.register(
+            Template(
+                name=cls.DEFAULT,
+                template_id=settings.template_id,
+                fields={
+                    "thing18": TemplateField("title", 20),
+                    "character_string12": TemplateField("ip", 32),
+                    "thing3": TemplateField("date", 20),
+                },
+            )
+        )
+        for name, config in settings.templates.items():
+            registry.register(
+                Template(
+                    name=name,
+                    template_id=config["template_id"],
+                    fields={
+                        key: TemplateField(**field)
+                        for key, field in config["fields"].items()
+                    },
+                )
+            )
+        return registry
+
+
+# 单例模板注册表
+templates = TemplateRegistry.from_settings()
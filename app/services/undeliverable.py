@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# app/services/undeliverable.py
+
+import time
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.redis import Redis
+
+
+class UndeliverableCache:
+    """
+    无法送达的 openid
+    模板消息返回永久性错误(未关注、拒收、拉黑、openid 无效)的用户记录在
+    有序集合 undeliverable:{公众号} 中, 分数为过期时间。发送前用一次 ZMSCORE
+    过滤整批接收者, 跳过的用户不再调用微信接口; 用户重新关注时清除记录。
+    """
+
+    logger = LOG().logger
+
+    KEY = "undeliverable:"
+
+    # 永久性失败的错误码
+    PERMANENT_ERRCODES = {
+        40003,  # openid 无效
+        43004,  # 需要接收者关注
+        43019,  # 需要将接收者从黑名单中移除
+        43101,  # 用户拒绝接受消息
+    }
+
+    SKIPPED = {"errcode": 43004, "errmsg": "recipient undeliverable, skipped"}
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+
+    @classmethod
+    def is_permanent(cls, result) -> bool:
+        return isinstance(result, dict) and result.get("errcode") in cls.PERMANENT_ERRCODES
+
+    async def add(self, account: str, openid: str):
+        """记录无法送达的用户, 同时清理已过期的记录"""
+        now = time.time()
+        pipe = await self.redis.pipeline()
+        pipe.zadd(self.KEY + account, {openid: now + settings.undeliverable_ttl})
+        pipe.zremrangebyscore(self.KEY + account, "-inf", now)
+        await pipe.execute()
+
+    async def clear(self, account: str, openid: str):
+        """用户重新关注时清除记录"""
+        await self.redis.zrem(self.KEY + account, openid)
+
+    async def filter(self, account: str, openids: list) -> tuple:
+        """
+        过滤无法送达的用户
+        Returns:
+            tuple: (需要发送的用户, 跳过的用户数量)
+        """
+        if not openids:
+            return [], 0
+        now = time.time()
+        expires = await self.redis.zmscore(self.KEY + account, openids)
+        active = [
+            openid
+            for openid, expire in zip(openids, expires)
+            if expire is None or expire <= now
+        ]
+        return active, len(openids) - len(active)
+
+    async def record(self, account: str, openid: str, result):
+        """根据发送结果记录无法送达的用户, 失败时只记录日志"""
+        if not self.is_permanent(result):
+            return
+        try:
+            await self.add(account, openid)
+        except Exception as e:
+            self.logger.warning(f"记录无法送达的用户 {openid} 失败: {e}")
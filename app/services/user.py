@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# app/services/user.py
+
+import asyncio
+from collections import OrderedDict
+from app.core.logger import LOG
+from app.core.config import settings
+from app.database.mysql import MySQL
+from app.services.mp import MPUtils
+from app.services.admission import AdmissionController
+
+
+class UserRegistry:
+    """
+    用户自动注册
+    关注/取消关注事件和首次发来的消息先写入内存缓冲区, 由后台任务合并后
+    通过多行 INSERT ... ON DUPLICATE KEY UPDATE 批量写入 users 表。
+    用户按 (公众号, openid) 区分, 同一用户在不同公众号下的 openid 不同。
+    用户资料通过批量获取接口(每次最多 100 个)查询, 同一用户的并发查询合并为一次。
+    """
+
+    logger = LOG().logger
+
+    PROFILE_BATCH_SIZE = 100  # 微信批量获取用户信息接口的上限
+
+    def __init__(
+        self, mp: MPUtils, admission: AdmissionController, flush_interval: float = None
+    ):
+        self.mp = mp
+        self.admission = admission
+        self.flush_interval = flush_interval or settings.user_flush_interval
+        self._buffer = {}  # (公众号, openid) -> [nickname, subscribed]
+        self._flushed = None  # 下一次写入完成时完成的 future
+        self._known = OrderedDict()  # 本进程已确认写入的 (公众号, openid)
+        self._profiles = {}  # 等待查询的 (公众号, openid) -> future
+        self._task = None
+
+    async def start(self):
+        """启动后台写入任务 (需在 FastAPI 启动事件中调用)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台写入任务并写入缓冲区中剩余的数据"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush_users()
+
+    def subscribe(self, openid: str, account: str = None):
+        """关注事件: 记录用户并异步获取用户资料"""
+        self._write(account, openid, subscribed=1)
+        self.fetch_profile(openid, account)
+
+    def unsubscribe(self, openid: str, account: str = None):
+        """取消关注事件"""
+        self._write(account, openid, subscribed=0)
+
+    async def ensure(self, openid: str, account: str = None) -> bool:
+        """
+        确保用户已写入 users 表, 未知用户等待下一次批量写入
+        Returns:
+            bool: 是否写入成功
+        """
+        key = (account or MySQL.DEFAULT_ACCOUNT, openid)
+        if key in self._known:
+            self._known.move_to_end(key)
+            return True
+        self._write(account, openid, subscribed=1)
+        return await asyncio.shield(self._next_flush())
+
+    def fetch_profile(self, openid: str, account: str = None) -> asyncio.Future:
+        """查询用户资料, 已在等待查询的用户直接复用同一个 future"""
+        key = (account or MySQL.DEFAULT_ACCOUNT, openid)
+        future = self._profiles.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._profiles[key] = future
+        return future
+
+    def _write(
+        self, account: str, openid: str, nickname: str = None, subscribed: int = None
+    ):
+        """合并写入缓冲区, 同一用户的多次变更只保留最终状态"""
+        key = (account or MySQL.DEFAULT_ACCOUNT, openid)
+        row = self._buffer.setdefault(key, [None, 1])
+        if nickname is not None:
+            row[0] = nickname
+        if subscribed is not None:
+            row[1] = subscribed
+
+    def _next_flush(self) -> asyncio.Future:
+        if self._flushed is None:
+            self._flushed = asyncio.get_running_loop().create_future()
+        return self._flushed
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._fetch_profiles()
+                await self._flush_users()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f"用户批量写入失败: {e}")
+
+    async def _fetch_profiles(self):
+        """批量获取等待查询的用户资料, 结果写入缓冲区, 每批只包含同一公众号的用户"""
+        while self._profiles:
+            account = next(iter(self._profiles))[0]
+            batch = {}
+            for key, future in self._profiles.items():
+                if key[0] == account:
+                    batch[key[1]] = future
+                    if len(batch) == self.PROFILE_BATCH_SIZE:
+                        break
+            for openid in batch:
+                del self._profiles[(account, openid)]
+            try:
+                result = await self.mp.batch_get_user_info(list(batch), account=account)
+                profiles = {
+                    info["openid"]: info for info in result.get("user_info_list", [])
+                }
+            except Exception as e:
+                self.logger.warning(f"批量获取用户信息失败: {e}")
+                profiles = {}
+            for openid, future in batch.items():
+                profile = profiles.get(openid)
+                if profile:
+                    self._write(account, openid, nickname=profile.get("nickname") or None)
+                if not future.done():
+                    future.set_result(profile)
+
+    async def _flush_users(self):
+        """将缓冲区分批写入 MySQL, 失败时放回缓冲区等待重试"""
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, {}
+        flushed, self._flushed = self._flushed, None
+        rows = [(account, openid, row[0], row[1]) for (account, openid), row in buffer.items()]
+        ok = True
+        conn = None
+        try:
+            conn = await self.admission.get_worker_connection()
+            for i in range(0, len(rows), settings.user_flush_batch_size):
+                await MySQL.upsert_users(conn, rows[i : i + settings.user_flush_batch_size])
+        except Exception as e:
+            ok = False
+            self.logger.error(f"写入用户失败, 稍后重试: {e}")
+            for key, row in buffer.items():
+                current = self._buffer.setdefault(key, row)
+                if current[0] is None:
+                    current[0] = row[0]
+        finally:
+            await self.admission.release_worker_connection(conn)
+
+        if ok:
+            for key in buffer:
+                self._known[key] = True
+            while len(self._known) > settings.user_known_cache_size:
+                self._known.popitem(last=False)
+            self.logger.debug(f"批量写入用户 {len(rows)} 个")
+        if flushed is not None and not flushed.done():
+            flushed.set_result(ok)
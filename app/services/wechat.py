@@ -6,64 +6,117 @@ import time
 from fastapi import Depends
 from aiomysql import Connection
 from xml.etree import ElementTree as ET
+from app.core.logger import LOG
 from app.core.config import settings
-from app.core.dependencies import get_mysql
+from app.core.dependencies import (
+    get_mysql,
+    get_tag_sync,
+    get_users,
+    get_status,
+    get_mute,
+    get_undeliverable,
+)
 from app.database.mysql import MySQL
+from app.services.tag import TagSync
+from app.services.user import UserRegistry
+from app.services.status import StatusHub
+from app.services.mute import GroupMute
+from app.services.undeliverable import UndeliverableCache
+from app.services.account import accounts
+from app.services.group import GroupService
+from app.services.command import Argument, CommandRouter
+
+
+# 公众号命令注册表, 导入时构建一次
+commands = CommandRouter()
+
+GROUP_NAME = Argument(
+    "name", re.compile(r"[\w]+"), "群组名只能包含字母、数字和下划线"
+)
+OPENIDS = Argument(
+    "openid", re.compile(r"[\w-]+"), "openid 只能包含字母、数字、下划线和连字符", many=True
+)
 
 
 class WechatService:
 
-    HELP_MESSAGE = (
-        "/id - 获取您的 OpenID\n" "/group - 群组操作\n" "/help - 获取帮助信息"
+    logger = LOG().logger
+
+    WELCOME_MESSAGE = "感谢关注！可用命令：\n"
+
+    # XML 回复中除用户、时间和内容外的固定部分
+    XML_TEMPLATE = (
+        "<xml><ToUserName><![CDATA[{to}]]></ToUserName>"
+        "<FromUserName><![CDATA[{from_}]]></FromUserName>"
+        "<CreateTime>{time}</CreateTime>"
+        "<MsgType><![CDATA[text]]></MsgType>{content}</xml>"
     )
 
     def __init__(
         self,
         mysql_conn: Connection = Depends(get_mysql),
+        tag_sync: TagSync = Depends(get_tag_sync),
+        users: UserRegistry = Depends(get_users),
+        status: StatusHub = Depends(get_status),
+        mute: GroupMute = Depends(get_mute),
+        undeliverable: UndeliverableCache = Depends(get_undeliverable),
         # repo: GroupRepository = Depends(GroupRepository),
         # user_repo: UserRepository = Depends(UserRepository),
     ):
         self.mysql_conn = mysql_conn
+        self.tag_sync = tag_sync
+        self.users = users
+        self.status = status
+        self.mute = mute
+        self.undeliverable = undeliverable
+        self.event = {}  # 事件推送的全部字段
+        self.account = accounts.DEFAULT  # 消息来自的公众号, 群组命令只操作该公众号的用户和群组
         # self.repo = repo
         # self.user_repo = user_repo
         pass
 
-    async def process_text_message(self, from_user: str, content: str) -> str:
+    async def process_text_message(
+        self, from_user: str, content: str, account: str = None
+    ) -> str:
         """处理文本消息业务逻辑"""
-        if content == "/id":
-            return await self._handle_get_id(from_user)
-        elif content.startswith("/group"):
-            return await self._handle_group_operations(from_user, content)
-        elif content == "/help":
-            return self.HELP_MESSAGE
-        return "未知指令，请输入/help查看帮助"
-
-    async def _handle_group_operations(self, openid: str, content: str) -> str:
-        """处理群组相关操作"""
-        # 命令解析交给独立方法
-        command, *args = self._parse_group_command(content)
-        print(command, *args)
-
-        # 使用策略模式处理不同命令
-        handlers = {
-            "create": self._create_group,
-            "delete": self._delete_group,
-            "join": self._join_group,
-            "leave": self._leave_group,
-            "list": self._list_groups,
-        }
-
-        if command not in handlers:
-            return "无效的群组命令"
-
-        return await handlers[command](openid, *args)
-
-    def _parse_group_command(self, content: str) -> tuple:
-        """解析群组命令专用方法"""
-        parts = content.split()
-        if len(parts) < 2:
-            return ("invalid",)
-        return parts[1], parts[2:] if len(parts) > 2 else []
+        self.logger.debug(f"收到命令: {content}")
+        self.account = accounts.get(account).key
+        # 群组操作依赖 users 表中的用户记录
+        await self.users.ensure(from_user, self.account)
+        return await commands.dispatch(self, from_user, content)
+
+    async def process_event(self, from_user: str, event: str, account: str = None) -> str:
+        """处理事件推送, 返回空字符串时不回复"""
+        if event == "subscribe":
+            self.users.subscribe(from_user, account)
+            # 重新关注后可以再次接收模板消息
+            await self.undeliverable.clear(accounts.get(account).key, from_user)
+            return self.WELCOME_MESSAGE + commands.help()
+        if event == "unsubscribe":
+            self.users.unsubscribe(from_user, account)
+        if event == "templatesendjobfinish":
+            # 模板消息送达结果, Status 为 success 或失败原因
+            await self.status.record_delivery(
+                self.event.get("MsgID", ""), self.event.get("Status", "")
+            )
+        return ""
+
+    async def _track(self, group_name: str, openid: str, joined: bool):
+        """记录成员变更到群组标签, 标签只镜像默认公众号的群组"""
+        if self.account == accounts.DEFAULT:
+            await self.tag_sync.track(group_name, openid, joined=joined)
+
+    @commands.register("/id", help="获取您的 OpenID")
+    async def _get_id(self, openid: str) -> str:
+        return openid
+
+    @commands.register("/help", help="获取帮助信息")
+    async def _help(self, openid: str) -> str:
+        return commands.help()
+
+    @commands.register("/group", help="群组操作")
+    async def _group_help(self, openid: str) -> str:
+        return commands.help(("/group",))
 
     def parse_message_body(self, body: bytes):
         """解析微信服务器返回的用户消息"""
@@ -73,29 +126,40 @@ class WechatService:
         msg_type = root.find("MsgType").text
         from_user = root.find("FromUserName").text  # 用户的 OpenID
         to_user = root.find("ToUserName").text
-        content = root.find("Content").text.strip()
+        if msg_type == "event":
+            # 事件推送的内容为事件类型, 如 subscribe/unsubscribe
+            content = root.find("Event").text.lower()
+            self.event = {child.tag: child.text for child in root}
+        else:
+            node = root.find("Content")
+            content = node.text.strip() if node is not None and node.text else ""
 
         return msg_type, from_user, to_user, content
 
     def generate_xml_response(self, to_user: str, from_user: str, content: str) -> str:
-        # 生成微信要求的 XML 响应
-        return f"""<xml>
-            <ToUserName><![CDATA[{from_user}]]></ToUserName>
-            <FromUserName><![CDATA[{to_user}]]></FromUserName>
-            <CreateTime>{int(time.time())}</CreateTime>
-            <MsgType><![CDATA[text]]></MsgType>
-            <Content><![CDATA[{content}]]></Content>
-        </xml>"""
+        # 生成微信要求的 XML 响应, 静态回复的 Content 片段已预先渲染
+        return self.XML_TEMPLATE.format(
+            to=from_user,
+            from_=to_user,
+            time=int(time.time()),
+            content=commands.render(content),
+        )
 
+    @commands.register(
+        "/group create",
+        args=[GROUP_NAME],
+        help="创建一个群组",
+        ok="群组 {name} 创建成功",
+        fail="群组 {name} 创建失败",
+    )
     async def _create_group(self, openid: str, group_name: str) -> bool:
-        # 创建群组
-        if not re.fullmatch(r"^[\w]+$", group_name):
-            raise ValueError("群组名只能包含字母、数字和下划线")
+        # 创建群组, 对应命令 /group create <name>
         try:
             if await MySQL.create_group(
                 conn=self.mysql_conn,
                 openid=openid,
-                group_name=group_name,
+                name=group_name,
+                account=self.account,
             ):
                 return True
             else:
@@ -103,20 +167,41 @@ class WechatService:
         except Exception as e:
             return False
 
+    @commands.register(
+        "/group delete",
+        args=[GROUP_NAME],
+        help="删除一个群组",
+        ok="群组 {name} 已删除",
+        fail="删除群组 {name} 失败",
+    )
     async def _delete_group(self, openid: str, group_name: str) -> bool:
         # 删除群组
         try:
-            if await MySQL.delete_group(
+            if not await MySQL.delete_group(
                 conn=self.mysql_conn,
                 openid=openid,
                 group_name=group_name,
+                account=self.account,
             ):
-                return True
-            else:
                 return False
         except Exception as e:
             return False
-    
+        # 群组已删除, 清理标签和免打扰记录失败不影响结果
+        try:
+            if self.account == accounts.DEFAULT:
+                await self.tag_sync.drop(group_name)
+            await self.mute.drop(group_name, self.account)
+        except Exception as e:
+            self.logger.warning(f"清理群组 {group_name} 的标签和免打扰记录失败: {e}")
+        return True
+
+    @commands.register(
+        "/group join",
+        args=[GROUP_NAME],
+        help="加入一个群组",
+        ok="已加入群组 {name}",
+        fail="加入群组 {name} 失败",
+    )
     async def _join_group(self, openid: str, group_name: str) -> bool:
         # 加入群组, 对应命令 /group join <name>
         try:
@@ -124,13 +209,22 @@ class WechatService:
                 conn=self.mysql_conn,
                 openid=openid,
                 group_name=group_name,
+                account=self.account,
             ):
+                await self._track(group_name, openid, joined=True)
                 return True
             else:
                 return False
         except Exception as e:
             return False
-    
+
+    @commands.register(
+        "/group leave",
+        args=[GROUP_NAME],
+        help="离开一个群组",
+        ok="已离开群组 {name}",
+        fail="离开群组 {name} 失败",
+    )
     async def _leave_group(self, openid: str, group_name: str) -> bool:
         # 离开群组, 对应命令 /group leave <name>
         try:
@@ -138,16 +232,102 @@ class WechatService:
                 conn=self.mysql_conn,
                 openid=openid,
                 group_name=group_name,
+                account=self.account,
             ):
+                await self._track(group_name, openid, joined=False)
+                await self.mute.unmute(group_name, openid, self.account)
                 return True
             else:
                 return False
         except Exception as e:
             return False
-    
-    async def _list_groups(self, openid: str, *args) -> str:
+
+    @commands.register(
+        "/group add",
+        args=[GROUP_NAME, OPENIDS],
+        help="批量添加成员到群组(仅群主)",
+    )
+    async def _add_members(self, openid: str, group_name: str, openids: list) -> str:
+        # 批量添加成员, 对应命令 /group add <name> <openid...>
+        return await self._update_members(openid, group_name, add=openids)
+
+    @commands.register(
+        "/group remove",
+        args=[GROUP_NAME, OPENIDS],
+        help="批量从群组移除成员(仅群主)",
+    )
+    async def _remove_members(self, openid: str, group_name: str, openids: list) -> str:
+        # 批量移除成员, 对应命令 /group remove <name> <openid...>
+        return await self._update_members(openid, group_name, remove=openids)
+
+    async def _update_members(self, openid: str, group_name: str, **changes) -> str:
+        service = GroupService(
+            mysql_conn=self.mysql_conn, tag_sync=self.tag_sync, mute=self.mute
+        )
+        try:
+            result = await service.update_members(
+                openid, group_name, account=self.account, **changes
+            )
+        except ValueError:
+            return f"群组 {group_name} 不存在或您不是群主"
+        except Exception as e:
+            return f"更新群组 {group_name} 成员失败"
+        if "add" in changes:
+            return f"群组 {group_name} 已添加 {result['added']} 人, 跳过 {result['skipped']} 人"
+        return f"群组 {group_name} 已移除 {result['removed']} 人"
+
+    @commands.register(
+        "/group mute",
+        args=[GROUP_NAME],
+        help="开启群组免打扰, 不再接收群组消息",
+        ok="已开启群组 {name} 的免打扰",
+        fail="开启群组 {name} 的免打扰失败",
+    )
+    async def _mute_group(self, openid: str, group_name: str) -> bool:
+        # 开启免打扰, 对应命令 /group mute <name>, 仍保留群组成员身份
+        try:
+            group_list = await MySQL.read(
+                MySQL.get_info,
+                openid=openid,
+                account=self.account,
+                sticky=openid,
+                primary=self.mysql_conn,
+            )
+            if group_name not in group_list["member"]:
+                return False
+            await self.mute.mute(group_name, openid, self.account)
+            await self._track(group_name, openid, joined=False)
+            return True
+        except Exception as e:
+            return False
+
+    @commands.register(
+        "/group unmute",
+        args=[GROUP_NAME],
+        help="关闭群组免打扰",
+        ok="已关闭群组 {name} 的免打扰",
+        fail="关闭群组 {name} 的免打扰失败",
+    )
+    async def _unmute_group(self, openid: str, group_name: str) -> bool:
+        # 关闭免打扰, 对应命令 /group unmute <name>
         try:
-            group_list = await MySQL.get_info(conn=self.mysql_conn, openid=openid,)
+            if not await self.mute.unmute(group_name, openid, self.account):
+                return False
+            await self._track(group_name, openid, joined=True)
+            return True
+        except Exception as e:
+            return False
+
+    @commands.register("/group list", help="列出创建的群组和加入的群组")
+    async def _list_groups(self, openid: str) -> str:
+        try:
+            group_list = await MySQL.read(
+                MySQL.get_info,
+                openid=openid,
+                account=self.account,
+                sticky=openid,
+                primary=self.mysql_conn,
+            )
         except Exception as e:
             return f"获取群组信息失败：{e}"
         reply = ""
@@ -158,3 +338,11 @@ class WechatService:
         if not reply:
             reply = "您还没有创建或加入任何群组"
         return reply
+
+
+# 命令注册完成后预先渲染静态回复
+commands.prerender(
+    commands.help(),
+    commands.help(("/group",)),
+    WechatService.WELCOME_MESSAGE + commands.help(),
+)
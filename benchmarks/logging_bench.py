@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# benchmarks/logging_bench.py
+"""
+日志记录开销基准测试, 对比事件循环线程上每条日志的耗时:
+  - sync: 旧实现, 同步写控制台且每条日志新建 Formatter
+  - queue: 队列处理器, 格式化与写入由后台线程完成
+
+运行方式 (需要 .env 或环境变量满足 Settings):
+    python benchmarks/logging_bench.py 2>/dev/null
+"""
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.core.logger import LOG, ColoredFormatter
+
+RECORDS = 20000
+
+
+class PerRecordFormatter(ColoredFormatter):
+    """复现旧实现: 每条日志都创建新的 Formatter"""
+
+    def format(self, record):
+        log_fmt = self.FORMATS.get(record.levelno, self.FORMATS[logging.DEBUG])
+        formatter = logging.Formatter(log_fmt, datefmt="%Y-%m-%d %H:%M:%S")
+        return formatter.format(record)
+
+
+def bench(logger: logging.Logger) -> float:
+    start = time.perf_counter()
+    for i in range(RECORDS):
+        logger.info(f"向 openid_{i} 发送消息成功")
+    return (time.perf_counter() - start) / RECORDS * 1e6
+
+
+def main():
+    sync_logger = logging.getLogger("bench_sync")
+    sync_logger.propagate = False
+    handler = logging.StreamHandler()
+    handler.setFormatter(PerRecordFormatter())
+    sync_logger.addHandler(handler)
+    sync_logger.setLevel(logging.INFO)
+
+    queue_logger = LOG(name="bench_queue", level=LOG.INFO).logger
+
+    sync_cost = bench(sync_logger)
+    queue_cost = bench(queue_logger)
+    LOG.shutdown()
+    print(f"sync : {sync_cost:.2f} us/record", file=sys.stdout)
+    print(f"queue: {queue_cost:.2f} us/record", file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
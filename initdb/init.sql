@@ -1,3 +1,49 @@
 CREATE DATABASE IF NOT EXISTS weixin 
 CHARACTER SET utf8mb4 
-COLLATE utf8mb4_unicode_ci;
\ No newline at end of file
+COLLATE utf8mb4_unicode_ci;
+
+USE weixin;
+
+CREATE TABLE IF NOT EXISTS users (
+    account VARCHAR(64) NOT NULL DEFAULT 'default', -- 所属公众号
+    openid VARCHAR(255) NOT NULL,             -- 微信唯一标识, 同一用户在不同公众号下不同
+    nickname VARCHAR(255),                    -- 用户昵称
+    subscribed TINYINT(1) NOT NULL DEFAULT 1, -- 是否关注公众号
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (account, openid)
+);
+
+CREATE TABLE IF NOT EXISTS `groups` (
+    group_id INT AUTO_INCREMENT PRIMARY KEY,
+    account VARCHAR(64) NOT NULL DEFAULT 'default', -- 所属公众号, 成员只能来自该公众号
+    name VARCHAR(255) NOT NULL,         -- 群组名称, 同一公众号内唯一
+    owner_openid VARCHAR(255) NOT NULL, -- 群主 openid
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY (account, name),
+    FOREIGN KEY (account, owner_openid) REFERENCES users(account, openid)
+);
+
+CREATE TABLE IF NOT EXISTS user_groups (
+    account VARCHAR(64) NOT NULL DEFAULT 'default', -- 所属公众号
+    openid VARCHAR(255) NOT NULL,     -- 用户 openid
+    group_name VARCHAR(255) NOT NULL, -- 关联的群组名称
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (account, openid, group_name), -- 联合主键避免重复加入
+    KEY (account, group_name, openid),         -- 按群组分页读取成员
+    FOREIGN KEY (account, openid) REFERENCES users(account, openid),
+    FOREIGN KEY (account, group_name) REFERENCES `groups`(account, name)
+);
+
+-- 已有部署升级(多公众号前创建的表, 原有数据属于默认公众号):
+-- ALTER TABLE user_groups DROP FOREIGN KEY <openid 外键>, DROP FOREIGN KEY <group_name 外键>;
+-- ALTER TABLE `groups` DROP FOREIGN KEY <owner_openid 外键>;
+-- ALTER TABLE users ADD COLUMN account VARCHAR(64) NOT NULL DEFAULT 'default' FIRST,
+--     DROP PRIMARY KEY, ADD PRIMARY KEY (account, openid);
+-- ALTER TABLE `groups` ADD COLUMN account VARCHAR(64) NOT NULL DEFAULT 'default' AFTER group_id,
+--     ADD UNIQUE KEY (account, name), DROP INDEX name,
+--     ADD FOREIGN KEY (account, owner_openid) REFERENCES users(account, openid);
+-- ALTER TABLE user_groups ADD COLUMN account VARCHAR(64) NOT NULL DEFAULT 'default' FIRST,
+--     DROP PRIMARY KEY, ADD PRIMARY KEY (account, openid, group_name), ADD KEY (account, group_name, openid),
+--     ADD FOREIGN KEY (account, openid) REFERENCES users(account, openid),
+--     ADD FOREIGN KEY (account, group_name) REFERENCES `groups`(account, name);